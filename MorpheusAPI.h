@@ -31,6 +31,14 @@ namespace MorpheusAPI {
         json data;
         int remaining_days;
         int remaining_hours;
+        // Подписанная лиза: до lease_expires_at клиент может не ходить в сеть,
+        // затем продлевает её через RefreshLease. Для клиента лиза непрозрачна:
+        // по умолчанию она подписана секретом сервера (HS256), и подпись
+        // проверяет только сервер при продлении. Чтобы проверять её локально,
+        // на сервере нужен асимметричный LEASE_ALGORITHM (EdDSA/RS256), а в
+        // клиенте — публичный ключ LEASE_PUBLIC_KEY и JWT-библиотека
+        std::string lease;
+        std::string lease_expires_at;
     };
 
     class MorpheusClient {
@@ -341,35 +349,11 @@ namespace MorpheusAPI {
             return result;
         }
         
-    public:
-        MorpheusClient(const std::string& url) : base_url(url) {
-            // Инициализация COM для WMI
-            CoInitializeEx(0, COINIT_MULTITHREADED);
-        }
-        
-        ~MorpheusClient() {
-            CoUninitialize();
-        }
-        
-        // Получение UUID (кэшируется после первого вызова)
-        std::string GetUUID() {
-            return GenerateHardwareUUID();
-        }
-        
-        // Активация/авторизация ключа
-        APIResponse Auth(const std::string& productSlug, const std::string& key) {
+        // Разбор ответа /auth и /lease/refresh
+        APIResponse ParseAuthResponse(const std::string& result) {
             APIResponse response;
             response.success = false;
             
-            std::string uuid = GetUUID();
-            
-            json requestBody;
-            requestBody["key"] = key;
-            requestBody["uuid"] = uuid;
-            
-            std::string endpoint = "/api/" + productSlug + "/auth";
-            std::string result = HTTPRequest("POST", endpoint, requestBody);
-            
             if (result.empty()) {
                 response.error = "Network error";
                 return response;
@@ -382,6 +366,11 @@ namespace MorpheusAPI {
                     response.success = true;
                     response.data = jsonResponse;
                     
+                    if (jsonResponse.contains("lease") && jsonResponse["lease"].is_string()) {
+                        response.lease = jsonResponse["lease"].get<std::string>();
+                        response.lease_expires_at = jsonResponse.value("lease_expires_at", "");
+                    }
+                    
                     if (jsonResponse.contains("remaining")) {
                         auto remaining = jsonResponse["remaining"];
                         if (remaining.contains("days")) {
@@ -405,6 +394,45 @@ namespace MorpheusAPI {
             
             return response;
         }
+        
+    public:
+        MorpheusClient(const std::string& url) : base_url(url) {
+            // Инициализация COM для WMI
+            CoInitializeEx(0, COINIT_MULTITHREADED);
+        }
+        
+        ~MorpheusClient() {
+            CoUninitialize();
+        }
+        
+        // Получение UUID (кэшируется после первого вызова)
+        std::string GetUUID() {
+            return GenerateHardwareUUID();
+        }
+        
+        // Активация/авторизация ключа
+        APIResponse Auth(const std::string& productSlug, const std::string& key) {
+            std::string uuid = GetUUID();
+            
+            json requestBody;
+            requestBody["key"] = key;
+            requestBody["uuid"] = uuid;
+            
+            std::string endpoint = "/api/" + productSlug + "/auth";
+            std::string result = HTTPRequest("POST", endpoint, requestBody);
+            
+            return ParseAuthResponse(result);
+        }
+        
+        // Продление офлайн-лизы (без повторной передачи ключа)
+        APIResponse RefreshLease(const std::string& productSlug, const std::string& lease) {
+            json requestBody;
+            requestBody["lease"] = lease;
+            requestBody["uuid"] = GetUUID();
+            
+            std::string endpoint = "/api/" + productSlug + "/lease/refresh";
+            return ParseAuthResponse(HTTPRequest("POST", endpoint, requestBody));
+        }
     };
 }
 
@@ -0,0 +1,53 @@
+"""
+Служебные команды, которые не должны выполняться при каждом старте API:
+
+    python -m app.cli ensure-admin    # создать первого администратора (Dockerfile, до uvicorn)
+    python -m app.cli rebuild-stock   # пересчитать key_stock по таблице keys
+"""
+import argparse
+import logging
+import secrets
+
+from app.database import SessionLocal
+from app.models import AdminUser
+from app.security import get_password_hash
+from app.services import stock
+
+logger = logging.getLogger("morpheus.cli")
+
+
+def ensure_admin() -> None:
+    with SessionLocal() as db:
+        admin = db.query(AdminUser).first()
+        if not admin:
+            username = "admin"
+            password = secrets.token_hex(8)
+            admin = AdminUser(username=username, password_hash=get_password_hash(password))
+            db.add(admin)
+            db.commit()
+            logger.info("Generated admin credentials - username: %s password: %s", username, password)
+
+
+def rebuild_stock() -> None:
+    with SessionLocal() as db:
+        stock.rebuild(db)
+        db.commit()
+    logger.info("Key stock counters rebuilt")
+
+
+COMMANDS = {
+    "ensure-admin": ensure_admin,
+    "rebuild-stock": rebuild_stock,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    COMMANDS[args.command]()
+
+
+if __name__ == "__main__":
+    main()
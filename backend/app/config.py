@@ -21,7 +21,86 @@ class Settings(BaseSettings):
 
     public_base_url: str = Field("https://localhost", env="PUBLIC_BASE_URL")
 
+    # Кэш активированных ключей для /api/{slug}/auth
+    license_cache_size: int = Field(10000, env="LICENSE_CACHE_SIZE")
+    license_cache_ttl_seconds: int = Field(300, env="LICENSE_CACHE_TTL_SECONDS")
+
+    # Офлайн-лизы для клиентов: по умолчанию подписываются SECRET_KEY (HS256).
+    # Для проверки подписи на клиенте задайте асимметричный алгоритм (EdDSA/RS256) и PEM-ключи.
+    lease_ttl_minutes: int = Field(60, env="LEASE_TTL_MINUTES")
+    # Цепочка продлений без обращения к БД не длиннее этого срока от полной проверки ключа
+    lease_chain_max_minutes: int = Field(1440, env="LEASE_CHAIN_MAX_MINUTES")
+    lease_algorithm: str = Field("HS256", env="LEASE_ALGORITHM")
+    lease_private_key: str = Field("", env="LEASE_PRIVATE_KEY")
+    lease_public_key: str = Field("", env="LEASE_PUBLIC_KEY")
+
+    # Token bucket лимитер /api/{slug}/auth: по ключу, по uuid и по IP клиента.
+    # RATE_LIMIT_BACKEND=postgres делит бакеты между воркерами через таблицу rate_limit_buckets.
+    rate_limit_enabled: bool = Field(True, env="RATE_LIMIT_ENABLED")
+    rate_limit_backend: str = Field("local", env="RATE_LIMIT_BACKEND")
+    rate_limit_key_burst: int = Field(10, env="RATE_LIMIT_KEY_BURST")
+    rate_limit_key_per_minute: float = Field(20, env="RATE_LIMIT_KEY_PER_MINUTE")
+    rate_limit_ip_burst: int = Field(60, env="RATE_LIMIT_IP_BURST")
+    rate_limit_ip_per_minute: float = Field(120, env="RATE_LIMIT_IP_PER_MINUTE")
+    # /auth/batch — отдельный бакет по IP, каждая пара пакета стоит токен.
+    # Ёмкость не меньше MAX_BATCH_AUTH_ITEMS (500), иначе полный пакет не пройдёт никогда
+    rate_limit_batch_ip_burst: int = Field(500, env="RATE_LIMIT_BATCH_IP_BURST")
+    rate_limit_batch_ip_per_minute: float = Field(1000, env="RATE_LIMIT_BATCH_IP_PER_MINUTE")
+    # Брать IP из X-Real-IP (его выставляет nginx из deploy/)
+    rate_limit_trust_proxy: bool = Field(True, env="RATE_LIMIT_TRUST_PROXY")
+
+    # Сколько минут ключ удерживается за созданным, но ещё не оплаченным заказом
+    key_reservation_minutes: int = Field(30, env="KEY_RESERVATION_MINUTES")
+    # Сколько живёт заказ, подготовленный в фоне при выборе срока или метода оплаты,
+    # если покупатель его не подтвердил (0 — не готовить заказы заранее)
+    speculative_order_ttl_seconds: int = Field(600, env="SPECULATIVE_ORDER_TTL_SECONDS")
+    # Как часто проверять остатки и догенерировать ключи по target_stock цен
+    restock_interval_seconds: int = Field(300, env="RESTOCK_INTERVAL_SECONDS")
+    # Завершённые заказы и истёкшие ключи старше стольких дней переносятся в *_archive
+    archive_after_days: int = Field(90, env="ARCHIVE_AFTER_DAYS")
+    archive_interval_seconds: int = Field(3600, env="ARCHIVE_INTERVAL_SECONDS")
+    # Пул заранее арендованных ключей на каждый (продукт, срок) в памяти воркера
+    key_pool_size: int = Field(20, env="KEY_POOL_SIZE")
+    key_pool_low_water: int = Field(5, env="KEY_POOL_LOW_WATER")
+    key_pool_lease_minutes: int = Field(10, env="KEY_POOL_LEASE_MINUTES")
+    # Как часто отменять неоплаченные заказы и возвращать их ключи (0 — не запускать)
+    order_sweep_interval_seconds: int = Field(60, env="ORDER_SWEEP_INTERVAL_SECONDS")
+    # Как часто переводить ключи с истёкшим сроком в статус expired
+    key_expiry_interval_seconds: int = Field(300, env="KEY_EXPIRY_INTERVAL_SECONDS")
+
+    # Outbox: выдача заказов после webhook (app.services.outbox)
+    outbox_concurrency: int = Field(8, env="OUTBOX_CONCURRENCY")
+    outbox_max_attempts: int = Field(10, env="OUTBOX_MAX_ATTEMPTS")
+    outbox_retry_base_seconds: float = Field(5.0, env="OUTBOX_RETRY_BASE_SECONDS")
+    outbox_poll_interval_seconds: float = Field(5.0, env="OUTBOX_POLL_INTERVAL_SECONDS")
+
+    # Сверка зависших заказов waiting со статусом платежа (0 — не запускать)
+    reconcile_interval_seconds: int = Field(120, env="RECONCILE_INTERVAL_SECONDS")
+    # Сверяются заказы старше стольких секунд: свежим даём дождаться webhook'а
+    reconcile_min_age_seconds: int = Field(120, env="RECONCILE_MIN_AGE_SECONDS")
+    # Отменённые sweeper'ом заказы с платежом сверяются ещё столько часов после отмены
+    reconcile_lookback_hours: int = Field(24, env="RECONCILE_LOOKBACK_HOURS")
+    # Одновременных запросов статуса к платёжным системам с одного воркера
+    reconcile_concurrency: int = Field(5, env="RECONCILE_CONCURRENCY")
+
+    # Курсы валют к рублю (app.services.currency_rates): проверка сумм webhook'ов
+    # и оплата не в рублях. Источник "file" читает JSON {"USD": 100.0, ...};
+    # пустой CURRENCY_RATES_FILE — файл app/currency_rates.json
+    currency_rates_source: str = Field("file", env="CURRENCY_RATES_SOURCE")
+    currency_rates_file: str = Field("", env="CURRENCY_RATES_FILE")
+    currency_rates_interval_seconds: int = Field(3600, env="CURRENCY_RATES_INTERVAL_SECONDS")
+    # Курс старше стольких секунд не используется: сумма не пересчитывается
+    currency_rates_max_age_seconds: int = Field(86400, env="CURRENCY_RATES_MAX_AGE_SECONDS")
+
+    # Общий HTTP-клиент для платёжных API (app.services.http_client)
+    http_http2: bool = Field(True, env="HTTP_HTTP2")
+    http_max_connections: int = Field(20, env="HTTP_MAX_CONNECTIONS")
+    http_timeout_seconds: float = Field(15.0, env="HTTP_TIMEOUT_SECONDS")
+    http_connect_timeout_seconds: float = Field(5.0, env="HTTP_CONNECT_TIMEOUT_SECONDS")
+    http_retries: int = Field(2, env="HTTP_RETRIES")
+
     # NicePay
+    nicepay_api_base: str = Field("https://nicepay.io/public/api", env="NICEPAY_API_BASE")
     nicepay_merchant_id: str = Field("", env="NICEPAY_MERCHANT_ID")
     nicepay_secret_key: str = Field("", env="NICEPAY_SECRET_KEY")
     nicepay_currency: str = Field("RUB", env="NICEPAY_CURRENCY")
@@ -30,6 +109,26 @@ class Settings(BaseSettings):
     nicepay_success_url: str = Field("", env="NICEPAY_SUCCESS_URL")
     nicepay_fail_url: str = Field("", env="NICEPAY_FAIL_URL")
 
+    # Anypay (SCI): запасная платёжная система
+    anypay_project_id: str = Field("", env="ANYPAY_PROJECT_ID")
+    anypay_secret_key: str = Field("", env="ANYPAY_SECRET_KEY")
+    # API_ID и API_KEY нужны только для запроса статуса платежа при сверке
+    anypay_api_id: str = Field("", env="ANYPAY_API_ID")
+    anypay_api_key: str = Field("", env="ANYPAY_API_KEY")
+    anypay_currency: str = Field("RUB", env="ANYPAY_CURRENCY")
+    anypay_methods: str = Field("", env="ANYPAY_METHODS")
+    anypay_success_url: str = Field("", env="ANYPAY_SUCCESS_URL")
+    anypay_fail_url: str = Field("", env="ANYPAY_FAIL_URL")
+    anypay_sign_algorithm: str = Field("sha256", env="ANYPAY_SIGN_ALGORITHM")
+
+    # Порядок платёжных систем: следующая используется, если предыдущая недоступна
+    payment_providers: str = Field("nicepay,anypay", env="PAYMENT_PROVIDERS")
+    # Столько ошибок подряд размыкают breaker платёжной системы на PAYMENT_BREAKER_RESET_SECONDS
+    payment_breaker_failures: int = Field(3, env="PAYMENT_BREAKER_FAILURES")
+    payment_breaker_reset_seconds: float = Field(60.0, env="PAYMENT_BREAKER_RESET_SECONDS")
+    # Общий таймаут создания платежа в одной системе, с учётом повторов
+    payment_create_timeout_seconds: float = Field(10.0, env="PAYMENT_CREATE_TIMEOUT_SECONDS")
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,62 +1,53 @@
 import asyncio
 import logging
-import secrets
+import os
 from contextlib import asynccontextmanager
+from alembic.config import Config as AlembicConfig
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
 
-from app.database import Base, engine, SessionLocal
-from app.models import AdminUser
-from app.security import get_password_hash
+from app.config import settings
+from app.database import engine, async_engine
 from app.routers import admin, public, payments
+from app.services.archive import archive_settled
 from app.services.bot import run_bot
+from app.services.currency_rates import currency_rates
+from app.services.http_client import http_client
+from app.services.key_pool import key_pool
+from app.services.notify import notify_listener
+from app.services.outbox import outbox_dispatcher
+from app.services.reconciler import reconcile_waiting_orders
+from app.services.restock import restock_job
+from app.services.scheduler import scheduler
+from app.services.sweeper import expire_keys, sweep_abandoned_orders
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("morpheus")
 
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), "..", "alembic.ini")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    Base.metadata.create_all(bind=engine)
-    # Миграция: изменение типа telegram_id на BigInteger
-    try:
-        from sqlalchemy import text
-        with engine.connect() as conn:
-            # Проверяем текущий тип колонки
-            result = conn.execute(text("""
-                SELECT data_type FROM information_schema.columns 
-                WHERE table_name = 'users' AND column_name = 'telegram_id'
-            """))
-            row = result.fetchone()
-            if row and row[0] == 'integer':
-                # Меняем тип на bigint
-                conn.execute(text("ALTER TABLE users ALTER COLUMN telegram_id TYPE bigint"))
-                conn.commit()
-                logger.info("Migrated telegram_id to BigInteger")
-    except Exception as e:
-        logger.warning(f"Migration check failed (may be already migrated): {e}")
-    
-    # Миграция: добавление колонки api_enabled в bot_settings
-    try:
-        from sqlalchemy import text
-        with engine.connect() as conn:
-            # Проверяем, существует ли колонка api_enabled
-            result = conn.execute(text("""
-                SELECT column_name FROM information_schema.columns 
-                WHERE table_name = 'bot_settings' AND column_name = 'api_enabled'
-            """))
-            row = result.fetchone()
-            if not row:
-                # Добавляем колонку api_enabled со значением по умолчанию True
-                conn.execute(text("ALTER TABLE bot_settings ADD COLUMN api_enabled BOOLEAN DEFAULT TRUE"))
-                conn.commit()
-                logger.info("Added api_enabled column to bot_settings")
-    except Exception as e:
-        logger.warning(f"Migration check for api_enabled failed (may be already migrated): {e}")
-    ensure_admin()
+    # Startup: из работы с БД — только сверка ревизии схемы. Первого
+    # администратора создаёт `python -m app.cli ensure-admin` (Dockerfile),
+    # снимки настроек, курсов и отзывов лиз воркер загружает при подключении
+    # notify_listener, остальное делают фоновые задачи
+    check_schema_version()
+    await notify_listener.start()
+    await http_client.start()
+    await outbox_dispatcher.start()
+    scheduler.add_job("order_sweeper", settings.order_sweep_interval_seconds, sweep_abandoned_orders)
+    scheduler.add_job("key_expiry", settings.key_expiry_interval_seconds, expire_keys)
+    scheduler.add_job("currency_rates", settings.currency_rates_interval_seconds, currency_rates.refresh)
+    scheduler.add_job("reconcile", settings.reconcile_interval_seconds, reconcile_waiting_orders)
+    scheduler.add_job("restock", settings.restock_interval_seconds, restock_job)
+    scheduler.add_job("archive", settings.archive_interval_seconds, archive_settled)
+    scheduler.add_job("key_pool_renew", settings.key_pool_lease_minutes * 60 / 3, key_pool.renew)
+    await scheduler.start()
     try:
         asyncio.create_task(run_bot())
         logger.info("Bot task started")
@@ -65,6 +56,15 @@ async def lifespan(app: FastAPI):
     logger.info("Startup complete")
     yield
     # Shutdown
+    await scheduler.stop()
+    await outbox_dispatcher.stop()
+    try:
+        await key_pool.release_all()
+    except Exception as e:
+        logger.error(f"Failed to release key pool: {e}")
+    await notify_listener.stop()
+    await http_client.close()
+    await async_engine.dispose()
     logger.info("Shutdown")
 
 
@@ -83,16 +83,21 @@ app.include_router(public.router)
 app.include_router(payments.router)
 
 
-def ensure_admin():
-    with SessionLocal() as db:
-        admin = db.query(AdminUser).first()
-        if not admin:
-            username = "admin"
-            password = secrets.token_hex(8)
-            admin = AdminUser(username=username, password_hash=get_password_hash(password))
-            db.add(admin)
-            db.commit()
-            logger.info("Generated admin credentials - username: %s password: %s", username, password)
+def check_schema_version():
+    """
+    Схемой управляет Alembic (alembic upgrade head в Dockerfile). На старте только
+    сверяем ревизию БД с последней миграцией и не запускаемся на устаревшей схеме.
+    """
+    script = ScriptDirectory.from_config(AlembicConfig(ALEMBIC_INI))
+    expected = set(script.get_heads())
+    with engine.connect() as conn:
+        current = set(MigrationContext.configure(conn).get_current_heads())
+    if current != expected:
+        raise RuntimeError(
+            f"Database schema revision {sorted(current) or 'none'} does not match {sorted(expected)}; "
+            "run `alembic upgrade head`"
+        )
+    logger.info("Database schema at revision %s", ", ".join(sorted(current)))
 
 
 @app.get("/health")
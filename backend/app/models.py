@@ -1,6 +1,5 @@
 import enum
 from datetime import datetime, timedelta
-from typing import Optional
 from sqlalchemy import (
     BigInteger,
     Boolean,
@@ -9,10 +8,13 @@ from sqlalchemy import (
     Enum,
     Float,
     ForeignKey,
+    Index,
     Integer,
+    JSON,
     String,
     Text,
     UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -28,6 +30,7 @@ class OrderStatus(str, enum.Enum):
 
 class KeyStatus(str, enum.Enum):
     available = "available"
+    reserved = "reserved"
     sold = "sold"
     activated = "activated"
     expired = "expired"
@@ -51,6 +54,8 @@ class BotSettings(Base):
     maintenance_mode = Column(Boolean, default=False)
     alert_message = Column(Text, nullable=True)
     technical_message = Column(Text, nullable=True)
+    # Версия растёт при каждом изменении; по ней воркеры синхронизируют снимок настроек
+    version = Column(Integer, default=1, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
@@ -91,6 +96,10 @@ class ProductPrice(Base):
     product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"))
     duration_days = Column(Integer, nullable=False)
     price_rub = Column(Float, nullable=False)
+    # Автопополнение: когда свободных ключей меньше restock_threshold,
+    # фоновая задача догенерирует их до target_stock. 0 — выключено
+    target_stock = Column(Integer, nullable=False, default=0, server_default="0")
+    restock_threshold = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, default=datetime.utcnow)
 
     product = relationship("Product", back_populates="prices")
@@ -111,6 +120,12 @@ class Build(Base):
 
 class Key(Base):
     __tablename__ = "keys"
+    __table_args__ = (
+        Index("ix_keys_product_duration_status", "product_id", "duration_days", "status"),
+        Index("ix_keys_available", "product_id", "duration_days", postgresql_where=text("status = 'available'")),
+        Index("ix_keys_expires_at", "expires_at", postgresql_where=text("status IN ('sold', 'activated')")),
+        Index("ix_keys_reserved_until", "reserved_until", postgresql_where=text("status = 'reserved'")),
+    )
 
     id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
@@ -122,6 +137,10 @@ class Key(Base):
     sold_at = Column(DateTime, nullable=True)
     activated_at = Column(DateTime, nullable=True)
     expires_at = Column(DateTime, nullable=True)
+    # Срок удержания ключа за неоплаченным заказом (статус reserved)
+    reserved_until = Column(DateTime, nullable=True)
+    # Воркер, держащий свободный ключ в своём пуле (services/key_pool) до reserved_until
+    pool_owner = Column(String(32), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     product = relationship("Product", back_populates="keys")
@@ -137,20 +156,69 @@ class Key(Base):
         self.status = KeyStatus.activated
 
 
+class KeyArchive(Base):
+    """Холодный слой: истёкшие ключи, перенесённые из keys фоновой задачей"""
+    __tablename__ = "keys_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    value = Column(String(100), unique=True, nullable=False, index=True)
+    duration_days = Column(Integer, nullable=False)
+    status = Column(Enum(KeyStatus), nullable=False)
+    sold_to_user_id = Column(Integer, nullable=True)
+    activation_uuid = Column(String(120), nullable=True)
+    sold_at = Column(DateTime, nullable=True)
+    activated_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+
+class KeyStock(Base):
+    """Материализованные остатки ключей по продукту и сроку"""
+    __tablename__ = "key_stock"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    duration_days = Column(Integer, primary_key=True)
+    available = Column(Integer, nullable=False, default=0)
+    reserved = Column(Integer, nullable=False, default=0)
+    sold = Column(Integer, nullable=False, default=0)
+
+
+class RateLimitBucket(Base):
+    """Общие для всех воркеров token bucket'ы лимитера /api/{slug}/auth"""
+    __tablename__ = "rate_limit_buckets"
+
+    bucket = Column(String(255), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    capacity = Column(Float, nullable=False)
+    rate = Column(Float, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_open_created_at", "created_at", postgresql_where=text("status IN ('pending', 'waiting')")),
+        Index("ix_orders_speculative_updated_at", "updated_at", postgresql_where=text("speculative")),
+    )
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
     duration_days = Column(Integer, nullable=False)
     amount = Column(Float, nullable=False)
     currency = Column(String(10), default="RUB")
     provider = Column(String(30), default="nicepay")
     provider_pay_id = Column(String(50), nullable=True)
     payment_url = Column(String(400), nullable=True)
-    status = Column(Enum(OrderStatus), default=OrderStatus.pending)
-    key_id = Column(Integer, ForeignKey("keys.id"), nullable=True)
+    status = Column(Enum(OrderStatus), default=OrderStatus.pending, index=True)
+    key_id = Column(Integer, ForeignKey("keys.id"), nullable=True, index=True)
+    # Метод оплаты, под который создан платёж
+    payment_method = Column(String(50), nullable=True)
+    # Заказ подготовлен заранее и ещё не подтверждён покупателем:
+    # отменяется через SPECULATIVE_ORDER_TTL_SECONDS после последнего изменения
+    speculative = Column(Boolean, nullable=False, default=False, server_default="false")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -158,3 +226,95 @@ class Order(Base):
     product = relationship("Product")
     key = relationship("Key", back_populates="order", uselist=False)
 
+
+class OrderArchive(Base):
+    """Холодный слой: завершённые заказы старше ARCHIVE_AFTER_DAYS"""
+    __tablename__ = "orders_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    duration_days = Column(Integer, nullable=False)
+    amount = Column(Float, nullable=False)
+    currency = Column(String(10))
+    provider = Column(String(30))
+    provider_pay_id = Column(String(50), nullable=True)
+    payment_url = Column(String(400), nullable=True)
+    status = Column(Enum(OrderStatus), nullable=False)
+    # Ключ может лежать как в keys, так и в keys_archive
+    key_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+
+class OutboxMessage(Base):
+    """
+    Задача, записанная в одной транзакции с изменением состояния
+    (например, выдача ключа после оплаты). Её выполняет OutboxDispatcher.
+    """
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        Index("ix_outbox_messages_pending", "available_at", postgresql_where=text("sent_at IS NULL")),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # Не раньше этого времени (пауза между повторами)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Сообщение взято воркером; после падения воркера снова доступно с этого времени
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+
+class PaymentEvent(Base):
+    """
+    Журнал уведомлений платёжных систем. Уникальность (provider, payment_id,
+    result) отсекает повторы webhook'ов одним INSERT ... ON CONFLICT DO NOTHING.
+    """
+    __tablename__ = "payment_events"
+    __table_args__ = (
+        UniqueConstraint("provider", "payment_id", "result", name="uq_payment_events_provider_payment_result"),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    provider = Column(String(30), nullable=False)
+    payment_id = Column(String(64), nullable=False)
+    result = Column(String(20), nullable=False)
+    # Без внешнего ключа: заказы уходят в orders_archive, а журнал остаётся
+    order_id = Column(Integer, nullable=True, index=True)
+    amount = Column(Integer, nullable=True)
+    currency = Column(String(10), nullable=True)
+    payload = Column(JSON, nullable=True)
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class CurrencyRate(Base):
+    """
+    Курс валюты к рублю: сколько RUB стоит единица currency. Таблицу
+    заполняет app.services.currency_rates, а читают воркеры из памяти.
+    """
+    __tablename__ = "currency_rates"
+
+    currency = Column(String(10), primary_key=True)
+    rub_per_unit = Column(Float, nullable=False)
+    source = Column(String(30), nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class LeaseRevocation(Base):
+    """
+    Отзыв офлайн-лиз: лизы ключа, выданные раньше revoked_at, при обновлении
+    перепроверяются по БД. Пустой key_value отзывает лизы всего продукта,
+    пустые product_slug и key_value — все лизы. Записи старше LEASE_TTL_MINUTES
+    ни на что не влияют и удаляются.
+    """
+    __tablename__ = "lease_revocations"
+
+    product_slug = Column(String(100), primary_key=True)
+    key_value = Column(String(100), primary_key=True)
+    revoked_at = Column(DateTime, nullable=False, index=True)
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from datetime import datetime
 import os
 
 from app import schemas
-from app.database import get_db
+from app.database import SessionLocal, get_db
 from app.dependencies import authenticate_admin, get_current_admin
 from app.models import (
     AdminUser,
@@ -15,13 +16,18 @@ from app.models import (
     ProductPrice,
     Build,
     Key,
+    KeyArchive,
     KeyStatus,
     User,
     Order,
     OrderStatus,
 )
-from app.security import create_access_token, get_password_hash
-from app.utils import generate_key_value
+from app.security import create_access_token
+from app.services import keygen, restock, stock
+from app.services.bot_settings import bot_settings_store
+from app.services.key_filter import key_filter
+from app.services.license_cache import license_cache
+from app.services.payment_providers import payment_providers
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -72,8 +78,11 @@ def create_product(data: schemas.ProductCreate, db: Session = Depends(get_db), _
         raise HTTPException(status_code=400, detail="Slug already exists")
     product = Product(slug=normalized_slug, title=data.title, description=data.description)
     db.add(product)
+    db.flush()
+    key_filter.publish(db, product.id)
     db.commit()
     db.refresh(product)
+    key_filter.add_product(product.id, product.slug)
     return product
 
 
@@ -151,8 +160,14 @@ def delete_product(
             db.delete(key)
         
         # Удаляем продукт
+        product_slug = product.slug
+        db.execute(stock.clear_product_stock(product_id))
+        key_filter.publish(db, product_id)
+        license_cache.publish(db, product_slug)
         db.delete(product)
         db.commit()
+        license_cache.invalidate_product(product_slug)
+        key_filter.drop_product(product_id)
         
         return {"success": True, "message": "Product deleted successfully"}
     except HTTPException:
@@ -192,10 +207,13 @@ def add_price(
     ).first()
     if existing:
         raise HTTPException(status_code=400, detail="Price for this duration already exists")
+    _check_restock_levels(payload.target_stock or 0, payload.restock_threshold or 0)
     price = ProductPrice(
         product_id=product.id,
         duration_days=payload.duration_days,
         price_rub=payload.price_rub,
+        target_stock=payload.target_stock or 0,
+        restock_threshold=payload.restock_threshold or 0,
     )
     db.add(price)
     db.commit()
@@ -227,13 +245,25 @@ def update_price(
         if existing and existing.id != price_id:
             raise HTTPException(status_code=400, detail="Price for this duration already exists")
     
+    # Уровни автопополнения необязательны: старые клиенты шлют только срок и цену
+    target_stock = price.target_stock if payload.target_stock is None else payload.target_stock
+    restock_threshold = price.restock_threshold if payload.restock_threshold is None else payload.restock_threshold
+    _check_restock_levels(target_stock, restock_threshold)
+
     price.duration_days = payload.duration_days
     price.price_rub = payload.price_rub
+    price.target_stock = target_stock
+    price.restock_threshold = restock_threshold
     db.commit()
     db.refresh(price)
     return price
 
 
+def _check_restock_levels(target_stock: int, restock_threshold: int) -> None:
+    if restock_threshold > target_stock:
+        raise HTTPException(status_code=400, detail="Restock threshold must not exceed target stock")
+
+
 @router.delete("/products/{product_id}/prices/{price_id}")
 def delete_price(
     product_id: int,
@@ -317,42 +347,90 @@ def upload_build(
         return build
 
 
+def _rebuild_key_filter(product_id: int) -> None:
+    """Просит все воркеры (включая текущий) перестроить фильтр ключей продукта"""
+    with SessionLocal() as db:
+        key_filter.publish(db, product_id, rebuild=True)
+        db.commit()
+
+
 @router.get("/keys", response_model=List[schemas.KeyOut])
 def list_keys(
     product_id: Optional[int] = None,
+    include_archived: bool = False,
     db: Session = Depends(get_db),
     _: AdminUser = Depends(get_current_admin),
 ):
-    """Список ключей с фильтрацией по продукту"""
+    """Список ключей с фильтрацией по продукту; include_archived добавляет ключи из keys_archive"""
     query = db.query(Key)
     if product_id:
         query = query.filter_by(product_id=product_id)
     keys = query.order_by(Key.created_at.desc()).limit(500).all()
+    if include_archived:
+        archived = db.query(KeyArchive)
+        if product_id:
+            archived = archived.filter_by(product_id=product_id)
+        keys += archived.order_by(KeyArchive.created_at.desc()).limit(500).all()
+        keys = sorted(keys, key=lambda k: k.created_at or datetime.min, reverse=True)[:500]
     return keys
 
 
 @router.post("/keys/generate", response_model=List[schemas.KeyOut])
 def generate_keys(
     payload: schemas.KeysGenerateRequest,
+    format: str = Query("json", pattern="^(json|csv)$"),
     db: Session = Depends(get_db),
     _: AdminUser = Depends(get_current_admin),
 ):
+    """Массовая генерация ключей; format=csv отдаёт созданные ключи потоком CSV"""
     product = db.query(Product).filter_by(id=payload.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    created = []
-    for _ in range(payload.count):
-        key_val = generate_key_value()
-        key = Key(
-            product_id=product.id,
-            value=key_val,
-            duration_days=payload.duration_days,
-            status=KeyStatus.available,
+    created = keygen.insert_generated_keys(db, product.id, payload.duration_days, payload.count)
+    db.execute(stock.stock_delta(product.id, payload.duration_days, available=len(created)))
+    # Большую пачку дешевле перестроить из БД, чем добавлять в фильтр по одному
+    rebuild = len(created) > keygen.KEY_FILTER_INCREMENTAL_LIMIT
+    key_filter.publish(db, product.id, rebuild=rebuild)
+    db.commit()
+    if not rebuild and key_filter.add_values(product.id, [value for _, value in created]):
+        _rebuild_key_filter(product.id)
+    if format == "csv":
+        return StreamingResponse(
+            keygen.keys_csv(created, payload.duration_days),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{product.slug}-keys.csv"'},
         )
-        db.add(key)
-        created.append(key)
+    return [
+        {
+            "id": key_id,
+            "value": value,
+            "duration_days": payload.duration_days,
+            "status": KeyStatus.available,
+            "activation_uuid": None,
+            "expires_at": None,
+        }
+        for key_id, value in created
+    ]
+
+
+@router.get("/stock/restock", response_model=Optional[schemas.RestockReportOut])
+def last_restock_report(_: AdminUser = Depends(get_current_admin)):
+    """Отчёт последнего автопополнения в этом воркере (null, если ещё не запускалось)"""
+    return restock.last_report
+
+
+@router.post("/stock/restock", response_model=schemas.RestockReportOut)
+def run_restock(_: AdminUser = Depends(get_current_admin)):
+    """Внеочередной запуск автопополнения"""
+    return restock.restock_low_stock()
+
+
+@router.post("/stock/rebuild")
+def rebuild_stock(db: Session = Depends(get_db), _: AdminUser = Depends(get_current_admin)):
+    """Пересчёт счётчиков key_stock по таблице keys (ремонт дрейфа)"""
+    stock.rebuild(db)
     db.commit()
-    return created
+    return {"success": True}
 
 
 @router.put("/keys/{key_id}", response_model=schemas.KeyOut)
@@ -367,6 +445,7 @@ def update_key(
     if not key:
         raise HTTPException(status_code=404, detail="Key not found")
     
+    old_status, old_duration = key.status, key.duration_days
     if payload.duration_days is not None:
         key.duration_days = payload.duration_days
     if payload.status is not None:
@@ -376,8 +455,15 @@ def update_key(
     if payload.expires_at is not None:
         key.expires_at = payload.expires_at
     
+    for statement in stock.bulk_deltas([
+        (key.product_id, old_duration, old_status, None),
+        (key.product_id, key.duration_days, None, key.status),
+    ]):
+        db.execute(statement)
+    license_cache.publish(db, key.product.slug, key.value)
     db.commit()
     db.refresh(key)
+    license_cache.invalidate(key.product.slug, key.value)
     return key
 
 
@@ -391,8 +477,17 @@ def delete_key(
     key = db.query(Key).filter_by(id=key_id).first()
     if not key:
         raise HTTPException(status_code=404, detail="Key not found")
+    product_slug, key_value = key.product.slug, key.value
+    product_id = key.product_id
+    stock_change = stock.transition(key.product_id, key.duration_days, key.status, None)
+    if stock_change is not None:
+        db.execute(stock_change)
+    license_cache.publish(db, product_slug, key_value)
     db.delete(key)
     db.commit()
+    if key_filter.discard(product_id, key_value):
+        _rebuild_key_filter(product_id)
+    license_cache.invalidate(product_slug, key_value)
     return {"success": True}
 
 
@@ -427,11 +522,19 @@ def update_settings(
         settings_obj.alert_message = payload.alert_message
     if payload.technical_message is not None:
         settings_obj.technical_message = payload.technical_message
+    bot_settings_store.publish(db, settings_obj)
     db.commit()
     db.refresh(settings_obj)
+    bot_settings_store.set(settings_obj)
     return settings_obj
 
 
+@router.get("/payments/providers")
+def payment_providers_health(_: AdminUser = Depends(get_current_admin)):
+    """Состояние платёжных систем в этом воркере: настроена ли, состояние breaker'а"""
+    return {"providers": payment_providers.health()}
+
+
 @router.get("/users", response_model=List[schemas.UserOut])
 def list_users(db: Session = Depends(get_db), _: AdminUser = Depends(get_current_admin)):
     """Список пользователей"""
@@ -440,10 +543,13 @@ def list_users(db: Session = Depends(get_db), _: AdminUser = Depends(get_current
 
 
 @router.get("/export/data")
-def export_data(db: Session = Depends(get_db), _: AdminUser = Depends(get_current_admin)):
-    """Экспорт всех данных (пользователи, ключи, продукты)"""
+def export_data(
+    include_archived: bool = False,
+    db: Session = Depends(get_db),
+    _: AdminUser = Depends(get_current_admin),
+):
+    """Экспорт всех данных (пользователи, ключи, продукты); архивные ключи — по include_archived"""
     from fastapi.responses import JSONResponse
-    import json
     
     # Экспортируем пользователей
     users = db.query(User).all()
@@ -484,6 +590,8 @@ def export_data(db: Session = Depends(get_db), _: AdminUser = Depends(get_curren
     
     # Экспортируем ключи
     keys = db.query(Key).all()
+    if include_archived:
+        keys += db.query(KeyArchive).all()
     keys_data = [{
         "id": k.id,
         "product_id": k.product_id,
@@ -519,6 +627,8 @@ def import_data(
     from datetime import datetime
     
     imported_counts = {"users": 0, "products": 0, "keys": 0, "errors": []}
+    stock_changes = []
+    imported_product_ids = []
     
     try:
         # Импортируем пользователей
@@ -557,6 +667,7 @@ def import_data(
                             product.created_at = datetime.fromisoformat(product_data["created_at"])
                         db.add(product)
                         db.flush()  # Чтобы получить ID продукта
+                        imported_product_ids.append(product.id)
                         
                         # Импортируем цены
                         for price_data in product_data.get("prices", []):
@@ -575,7 +686,10 @@ def import_data(
         if "keys" in data:
             for key_data in data["keys"]:
                 try:
-                    existing = db.query(Key).filter_by(value=key_data["value"]).first()
+                    existing = (
+                        db.query(Key.id).filter_by(value=key_data["value"]).first()
+                        or db.query(KeyArchive.id).filter_by(value=key_data["value"]).first()
+                    )
                     if not existing:
                         key = Key(
                             product_id=key_data["product_id"],
@@ -594,11 +708,20 @@ def import_data(
                         if key_data.get("created_at"):
                             key.created_at = datetime.fromisoformat(key_data["created_at"])
                         db.add(key)
+                        stock_changes.append((key.product_id, key.duration_days, None, key.status))
                         imported_counts["keys"] += 1
                 except Exception as e:
                     imported_counts["errors"].append(f"Key import error: {e}")
         
+        for statement in stock.bulk_deltas(stock_changes):
+            db.execute(statement)
+        # Импорт затрагивает произвольные продукты — фильтры перестраивают все воркеры
+        for product_id in {change[0] for change in stock_changes} | set(imported_product_ids):
+            key_filter.publish(db, product_id, rebuild=True)
+        license_cache.publish(db)
         db.commit()
+        # Импорт мог затронуть любые ключи — сбрасываем кэш лицензий целиком
+        license_cache.clear()
         
         return {
             "success": True,
@@ -1,18 +1,28 @@
 import logging
-from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
-from app.models import Order, OrderStatus, KeyStatus
-from app.services.bot import bot_service
-from app.services.nicepay import NicepayClient
+from app.database import get_async_db
+from app.services import orders, payment_events
+from app.services.anypay import FINAL_STATUSES as ANYPAY_FINAL_STATUSES, anypay_client
+from app.services.currency_rates import currency_rates
+from app.services.nicepay import nicepay_client
+from app.services.rate_limit import client_ip
 
 logger = logging.getLogger("morpheus.payments")
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
-nicepay_client = NicepayClient()
+
+def _check_amount(order, amount: float, currency: str) -> None:
+    """Сверяет оплаченную сумму с суммой заказа (погрешность 10%) и пишет предупреждение"""
+    amount_rub = currency_rates.to_rub(amount, currency)
+    if amount_rub is None:
+        logger.warning(f"No fresh {currency} rate, amount {amount} of order {order.id} not checked")
+        return
+    if abs(amount_rub - order.amount) > order.amount * 0.1:
+        logger.warning(f"Webhook amount {amount_rub:.2f} RUB ({amount} {currency}) differs significantly from order amount {order.amount} for order {order.id}")
 
 
 @router.get("/nicepay/webhook")
@@ -27,7 +37,7 @@ async def nicepay_webhook(
     profit_currency: str = Query(None),
     method: str = Query(None),
     hash: str = Query(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Обработчик webhook от NicePay.
@@ -52,83 +62,45 @@ async def nicepay_webhook(
     params["hash"] = str(hash)
     
     # Проверяем подпись
-    if not nicepay_client.verify_webhook_hash(params):
+    if not nicepay_client.verify_webhook(params):
         logger.error(f"Invalid webhook hash for order_id={order_id}")
         raise HTTPException(status_code=400, detail="Invalid hash")
     
     try:
-        order = db.query(Order).filter_by(id=int(order_id)).first()
+        # Повтор webhook'а отсекается одним INSERT в журнал, до загрузки заказа и ключа.
+        # Запись коммитится вместе с обработкой: после ошибки повтор обработается заново
+        event_id = (
+            await db.execute(
+                payment_events.record_statement(
+                    "nicepay",
+                    payment_id,
+                    result,
+                    order_id=int(order_id),
+                    amount=amount,
+                    currency=amount_currency,
+                    payload={k: v for k, v in params.items() if k != "hash"},
+                )
+            )
+        ).scalar()
+        if event_id is None:
+            logger.info(f"Duplicate NicePay webhook: payment_id={payment_id}, result={result}, skipping")
+            return {"result": {"message": "Success"}}
+        
+        order = await orders.lock_order(db, int(order_id))
         if not order:
             logger.warning(f"Order {order_id} not found for webhook")
             raise HTTPException(status_code=404, detail="Order not found")
         
-        # Конвертируем amount из центов/копеек в рубли
-        amount_rub = amount / 100.0
-        
-        # Если валюта не RUB, конвертируем (упрощенно)
-        if amount_currency != "RUB":
-            # Примерные курсы (должны совпадать с теми, что в bot.py)
-            if amount_currency == "USD":
-                amount_rub = amount_rub * 100.0  # 1 USD = 100 RUB
-            elif amount_currency == "EUR":
-                amount_rub = amount_rub * 110.0  # 1 EUR = 110 RUB
-            elif amount_currency == "UAH":
-                amount_rub = amount_rub / 4.0    # 1 RUB = 4 UAH
-            elif amount_currency == "KZT":
-                amount_rub = amount_rub / 5.0    # 1 RUB = 5 KZT
-        
-        # Проверяем сумму (с погрешностью 10%)
-        expected_amount = order.amount
-        difference = abs(amount_rub - expected_amount)
-        max_difference = expected_amount * 0.1  # 10% погрешность
-        
-        if difference > max_difference:
-            logger.warning(f"Webhook amount {amount_rub} differs significantly from order amount {expected_amount} for order {order_id}")
+        # amount приходит в копейках/центах; курс — из памяти воркера, без запросов
+        _check_amount(order, amount / 100.0, amount_currency)
         
         # Обрабатываем статус платежа
-        if result == "success":
-            if order.status != OrderStatus.paid:
-                order.status = OrderStatus.paid
-                order.provider_pay_id = payment_id
-                order.paid_at = datetime.utcnow()
-                
-                if order.key:
-                    if order.key.status == KeyStatus.available:
-                        order.key.status = KeyStatus.sold
-                        order.key.sold_at = datetime.utcnow()
-                        order.key.sold_to_user_id = order.user_id
-                        logger.info(f"Order {order.id} marked as paid. Key {order.key.id} marked as sold and linked to user {order.user_id}.")
-                    else:
-                        logger.warning(f"Order {order.id} paid, but key {order.key.id} status is {order.key.status}, not available. Skipping status change.")
-                
-                db.commit()
-                
-                # Отправляем ключ пользователю через бота
-                if bot_service:
-                    await bot_service.send_order_delivery(order.id)
-                    logger.info(f"Order {order.id} delivery sent to user")
-                
-            else:
-                logger.info(f"Order {order.id} already paid, skipping.")
-                
-        elif result == "error":
-            if order.status != OrderStatus.failed:
-                order.status = OrderStatus.failed
-                order.failed_at = datetime.utcnow()
-                
-                # Возвращаем ключ в доступные, если платеж не прошел
-                if order.key and order.key.status == KeyStatus.sold:
-                    order.key.status = KeyStatus.available
-                    order.key.sold_at = None
-                    order.key.sold_to_user_id = None
-                    logger.info(f"Order {order.id} marked as failed. Key {order.key.id} reverted to available.")
-                
-                db.commit()
-            else:
-                logger.info(f"Order {order.id} already failed, skipping.")
-        else:
-            logger.warning(f"Unhandled NicePay webhook result: {result} for order {order.id}")
+        changed = await orders.apply_payment_result(db, order, result, payment_id)
         
+        # Событие остаётся в журнале и тогда, когда заказ менять не пришлось
+        await db.commit()
+        if changed:
+            orders.invalidate_license(order)
         # Возвращаем JSON ответ согласно документации NicePay
         return {"result": {"message": "Success"}}
         
@@ -136,4 +108,68 @@ async def nicepay_webhook(
         raise
     except Exception as e:
         logger.error(f"Webhook error: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.api_route("/anypay/webhook", methods=["GET", "POST"], response_class=PlainTextResponse)
+async def anypay_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Оповещение Anypay (SCI). Anypay повторяет его, пока не получит ответ "OK".
+    В журнале и в provider_pay_id платёж Anypay — это pay_id, как и при сверке.
+    """
+    params = dict(request.query_params)
+    if request.method == "POST":
+        params.update((await request.form()).items())
+    pay_id = params.get("pay_id", "")
+    status = str(params.get("status", "")).lower()
+    logger.info(f"Received Anypay webhook: pay_id={pay_id}, status={status}, transaction_id={params.get('transaction_id')}")
+
+    if not anypay_client.verify_webhook_ip(client_ip(request)):
+        logger.error(f"Anypay webhook from unexpected IP {client_ip(request)}")
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not anypay_client.verify_webhook(params):
+        logger.error(f"Invalid Anypay webhook sign for pay_id={pay_id}")
+        raise HTTPException(status_code=400, detail="Invalid sign")
+    if not pay_id.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid pay_id")
+
+    result = ANYPAY_FINAL_STATUSES.get(status)
+    if result is None:
+        logger.info(f"Anypay payment {pay_id} is {status}, nothing to do")
+        return "OK"
+
+    try:
+        event_id = (
+            await db.execute(
+                payment_events.record_statement(
+                    "anypay",
+                    pay_id,
+                    result,
+                    order_id=int(pay_id),
+                    currency=params.get("currency"),
+                    payload={k: v for k, v in params.items() if k != "sign"},
+                )
+            )
+        ).scalar()
+        if event_id is None:
+            logger.info(f"Duplicate Anypay webhook: pay_id={pay_id}, result={result}, skipping")
+            return "OK"
+
+        order = await orders.lock_order(db, int(pay_id))
+        if not order:
+            logger.warning(f"Order {pay_id} not found for Anypay webhook")
+            raise HTTPException(status_code=404, detail="Order not found")
+        if params.get("amount"):
+            _check_amount(order, float(params["amount"]), params.get("currency"))
+
+        changed = await orders.apply_payment_result(db, order, result, pay_id)
+        await db.commit()
+        if changed:
+            orders.invalidate_license(order)
+        return "OK"
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Anypay webhook error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,89 +1,428 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import Dict
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy import DateTime, and_, func, literal, literal_column, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Optional, Tuple
+import jwt
+import orjson
+import time
 
-from app.database import get_db
-from app.models import Product, Key, KeyStatus, BotSettings
+from app import schemas
+from app.config import settings
+from app.database import get_async_db
+from app.models import Product, Key, KeyArchive, KeyStatus, KeyStock
+from app.security import create_lease_token, decode_lease_token
+from app.services.bot_settings import bot_settings_store
+from app.services.key_filter import key_filter
+from app.services.license_cache import CachedLicense, license_cache
+from app.services.rate_limit import limit_auth, limit_batch_auth
 
-router = APIRouter(prefix="/api", tags=["api"])
+router = APIRouter(prefix="/api", tags=["api"], default_response_class=ORJSONResponse)
 
+# Максимум пар {key, uuid} в одном запросе /auth/batch
+MAX_BATCH_AUTH_ITEMS = 500
 
-def check_api_enabled(db: Session):
-    """Проверяет, включен ли API"""
-    settings = db.query(BotSettings).first()
-    if not settings:
-        return True  # По умолчанию включен
-    return settings.api_enabled
+# Заранее закодированные метаданные продуктов для /api/products.
+# Ключ — сами значения полей, поэтому правка продукта просто даёт новую запись.
+_product_fragments: Dict[Tuple[str, str, Optional[str]], bytes] = {}
 
 
-@router.get("/products")
-def products(db: Session = Depends(get_db)):
-    if not check_api_enabled(db):
+def check_api_enabled() -> bool:
+    """Проверяет, включен ли API (по снимку настроек в памяти)"""
+    return bot_settings_store.get().api_enabled
+
+
+@router.get("/products", response_model=schemas.PublicProductsOut)
+async def products(db: AsyncSession = Depends(get_async_db)):
+    if not check_api_enabled():
         raise HTTPException(status_code=503, detail="API is disabled")
     items = []
-    products = db.query(Product).filter(Product.is_active == True).all()  # noqa: E712
-    for p in products:
-        variants: Dict[int, int] = {}
-        for key in p.keys:
-            if key.status == KeyStatus.available:
-                variants[key.duration_days] = variants.get(key.duration_days, 0) + 1
-        items.append(
-            {
-                "slug": p.slug,
-                "title": p.title,
-                "description": p.description,
-                "available": variants,
-            }
+    products = (
+        await db.execute(
+            select(Product.id, Product.slug, Product.title, Product.description)
+            .where(Product.is_active == True)  # noqa: E712
         )
-    return {"products": items}
+    ).all()
+    # Остатки читаем из материализованной таблицы key_stock: O(продуктов), а не O(ключей)
+    stock_rows = await db.execute(
+        select(KeyStock.product_id, KeyStock.duration_days, KeyStock.available)
+        .where(KeyStock.product_id.in_([p.id for p in products]), KeyStock.available > 0)
+    )
+    available: Dict[int, Dict[int, int]] = {}
+    for product_id, duration_days, count in stock_rows:
+        available.setdefault(product_id, {})[duration_days] = count
+    for p in products:
+        # Тело собираем из готовых байтовых фрагментов: меняются только остатки
+        variants = orjson.dumps(available.get(p.id, {}), option=orjson.OPT_NON_STR_KEYS)
+        items.append(b"".join((_product_fragment(p.slug, p.title, p.description), variants, b"}")))
+    return Response(content=b'{"products":[' + b",".join(items) + b"]}", media_type="application/json")
 
 
-@router.post("/{product_slug}/auth")
-def product_auth(
+def _product_fragment(slug: str, title: str, description: Optional[str]) -> bytes:
+    """'{"slug":...,"title":...,"description":...,"available":' для продукта"""
+    cache_key = (slug, title, description)
+    fragment = _product_fragments.get(cache_key)
+    if fragment is None:
+        if len(_product_fragments) > 1000:
+            _product_fragments.clear()
+        encoded = orjson.dumps({"slug": slug, "title": title, "description": description})
+        fragment = encoded[:-1] + b',"available":'
+        _product_fragments[cache_key] = fragment
+    return fragment
+
+
+@router.post(
+    "/{product_slug}/auth",
+    response_model=schemas.AuthOut,
+    response_model_exclude_unset=True,
+    dependencies=[Depends(limit_auth)],
+)
+async def product_auth(
     product_slug: str,
     payload: dict,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    if not check_api_enabled(db):
+    if not check_api_enabled():
         raise HTTPException(status_code=503, detail="API is disabled")
     key_value = payload.get("key")
     uuid = payload.get("uuid")
-    if not key_value or not uuid:
+    if not key_value or not uuid or not isinstance(key_value, str) or not isinstance(uuid, str):
         raise HTTPException(status_code=400, detail="Key and uuid required")
-    product = db.query(Product).filter_by(slug=product_slug).first()
+
+    # Повторные запуски уже активированных ключей обслуживаем из кэша
+    cached = license_cache.get(product_slug, key_value)
+    if cached:
+        if cached.activation_uuid != uuid:
+            return {"success": False, "error": "HWID mismatch"}
+        if not cached.expires_at or cached.expires_at >= datetime.utcnow():
+            return _auth_success(product_slug, key_value, uuid, cached.expires_at)
+        license_cache.invalidate(product_slug, key_value)
+
+    # Мусорные и подобранные ключи отсекаем в памяти, не доходя до БД
+    if not key_filter.might_exist(product_slug, key_value):
+        return {"success": False, "error": "Key mismatch"}
+
+    now = datetime.utcnow()
+    row = (await db.execute(_activation_statement(product_slug, key_value, uuid, now))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if row.key_id is None:
+        return {"success": False, "error": await _archived_key_error(db, row.product_id, key_value, uuid, now)}
+
+    if row.activated_now:
+        await db.commit()
+        status, activation_uuid, expires_at = KeyStatus.activated, uuid, row.new_expires_at
+    else:
+        status, activation_uuid, expires_at = row.status, row.activation_uuid, row.expires_at
+        if activation_uuid is None and _auth_error(status, activation_uuid, expires_at, uuid, now) is None:
+            # Условный UPDATE не сработал, хотя по снимку ключ свободен:
+            # его только что активировал параллельный запрос — перечитываем
+            status, activation_uuid, expires_at = (
+                await db.execute(
+                    select(Key.status, Key.activation_uuid, Key.expires_at).where(Key.id == row.key_id)
+                )
+            ).one()
+        # Статус expired проставляет фоновая задача (sweeper.expire_keys): здесь только чтение
+        error = _auth_error(status, activation_uuid, expires_at, uuid, now)
+        if error:
+            return {"success": False, "error": error}
+
+    if status == KeyStatus.activated:
+        license_cache.put(
+            product_slug,
+            key_value,
+            CachedLicense(key_id=row.key_id, activation_uuid=activation_uuid, expires_at=expires_at),
+        )
+    return _auth_success(product_slug, key_value, uuid, expires_at)
+
+
+def _activation_statement(product_slug: str, key_value: str, uuid: str, now: datetime):
+    """
+    Один запрос на всю проверку: находит продукт и ключ и, если ключ продан,
+    не привязан к HWID и не истёк, атомарно активирует его условным UPDATE.
+    Из двух одновременных первых запусков активирует ключ только один.
+    """
+    target = (
+        select(
+            Product.id.label("product_id"),
+            Key.id.label("key_id"),
+            Key.status,
+            Key.activation_uuid,
+            Key.expires_at,
+        )
+        .select_from(Product)
+        .outerjoin(Key, and_(Key.product_id == Product.id, Key.value == key_value))
+        .where(Product.slug == product_slug)
+        .cte("target")
+    )
+    activated = (
+        update(Key)
+        .where(
+            Key.id == target.c.key_id,
+            Key.activation_uuid.is_(None),
+            Key.status.notin_((KeyStatus.available, KeyStatus.reserved)),
+            or_(Key.expires_at.is_(None), Key.expires_at >= now),
+        )
+        .values(
+            activation_uuid=uuid,
+            expires_at=func.coalesce(Key.expires_at, literal(now, DateTime) + Key.duration_days * literal_column("interval '1 day'")),
+            activated_at=func.coalesce(Key.activated_at, now),
+            status=KeyStatus.activated,
+        )
+        .returning(Key.id, Key.expires_at)
+        .cte("activated")
+    )
+    return (
+        select(
+            target.c.product_id,
+            target.c.key_id,
+            target.c.status,
+            target.c.activation_uuid,
+            target.c.expires_at,
+            activated.c.id.is_not(None).label("activated_now"),
+            activated.c.expires_at.label("new_expires_at"),
+        )
+        .select_from(target.outerjoin(activated, activated.c.id == target.c.key_id))
+    )
+
+
+@router.post(
+    "/{product_slug}/auth/batch",
+    response_model=schemas.BatchAuthOut,
+    response_model_exclude_unset=True,
+    dependencies=[Depends(limit_batch_auth)],
+)
+async def product_auth_batch(
+    product_slug: str,
+    payload: dict,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Пакетная проверка ключей: одно чтение keys и один условный UPDATE на все
+    активации — по тому же правилу, что и /auth: ключ привязывает к HWID
+    только тот запрос, чей UPDATE застал его непривязанным.
+    """
+    if not check_api_enabled():
+        raise HTTPException(status_code=503, detail="API is disabled")
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Items required")
+    if len(items) > MAX_BATCH_AUTH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {MAX_BATCH_AUTH_ITEMS})")
+    product = (await db.execute(select(Product).filter_by(slug=product_slug))).scalars().first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    key = db.query(Key).filter_by(value=key_value, product_id=product.id).first()
-    if not key:
-        return {"success": False, "error": "Key mismatch"}
 
-    if key.status == KeyStatus.available:
-        return {"success": False, "error": "Key not sold"}
+    pairs = [_batch_item(item) for item in items]
+    values = {
+        key_value
+        for key_value, uuid in pairs
+        if key_value and uuid and key_filter.might_exist(product_slug, key_value)
+    }
+    keys = {}
+    if values:
+        result = await db.execute(
+            select(Key.value, Key.id, Key.status, Key.activation_uuid, Key.expires_at).where(
+                Key.product_id == product.id, Key.value.in_(values)
+            )
+        )
+        keys = {value: (key_id, status, activation_uuid, expires_at) for value, key_id, status, activation_uuid, expires_at in result}
+    archived = {}
+    if values - keys.keys():
+        result = await db.execute(
+            select(KeyArchive.value, KeyArchive.status, KeyArchive.activation_uuid, KeyArchive.expires_at).where(
+                KeyArchive.product_id == product.id, KeyArchive.value.in_(values - keys.keys())
+            )
+        )
+        archived = {value: (status, activation_uuid, expires_at) for value, status, activation_uuid, expires_at in result}
+
+    now = datetime.utcnow()
+    # Непривязанный ключ достаётся первому элементу пакета с ним
+    claims: Dict[str, str] = {}
+    for key_value, uuid in pairs:
+        state = keys.get(key_value)
+        if state and state[2] is None and key_value not in claims and _auth_error(*state[1:], uuid, now) is None:
+            claims[key_value] = uuid
+    if claims:
+        await _activate_batch(db, keys, claims, now)
+
+    results = []
+    for key_value, uuid in pairs:
+        if not key_value or not uuid:
+            results.append({"key": key_value, "uuid": uuid, "success": False, "error": "Key and uuid required"})
+            continue
+        state = keys.get(key_value)
+        if not state:
+            archived_row = archived.get(key_value)
+            error = _auth_error(*archived_row, uuid, now) if archived_row else None
+            results.append({"key": key_value, "uuid": uuid, "success": False, "error": error or "Key mismatch"})
+            continue
+        key_id, status, activation_uuid, expires_at = state
+        error = _auth_error(status, activation_uuid, expires_at, uuid, now)
+        if error:
+            results.append({"key": key_value, "uuid": uuid, "success": False, "error": error})
+            continue
+        if status == KeyStatus.activated and activation_uuid:
+            license_cache.put(
+                product_slug,
+                key_value,
+                CachedLicense(key_id=key_id, activation_uuid=activation_uuid, expires_at=expires_at),
+            )
+        results.append(_auth_success(product_slug, key_value, uuid, expires_at))
+    return {"results": results}
+
+
+# Условная активация пакета: как в _activation_statement, UPDATE срабатывает
+# только для ключей, которые на момент записи ещё не привязаны к HWID
+_BATCH_ACTIVATION_SQL = text("""
+    UPDATE keys k
+    SET activation_uuid = c.uuid,
+        expires_at = coalesce(k.expires_at, CAST(:now AS timestamp) + k.duration_days * interval '1 day'),
+        activated_at = coalesce(k.activated_at, CAST(:now AS timestamp)),
+        status = 'activated'
+    FROM unnest(CAST(:ids AS integer[]), CAST(:uuids AS text[])) AS c(id, uuid)
+    WHERE k.id = c.id
+      AND k.activation_uuid IS NULL
+      AND k.status NOT IN ('available', 'reserved')
+      AND (k.expires_at IS NULL OR k.expires_at >= CAST(:now AS timestamp))
+    RETURNING k.id, k.status, k.activation_uuid, k.expires_at
+""")
+
+
+async def _activate_batch(db: AsyncSession, keys: Dict[str, tuple], claims: Dict[str, str], now: datetime) -> None:
+    """
+    Активирует ключи claims ({значение: uuid}) одним UPDATE и обновляет их
+    состояние в keys. Ключи, которые параллельный запрос успел привязать
+    первым, перечитываются: ответ по ним строится по их настоящему HWID.
+    """
+    ids = {keys[key_value][0]: key_value for key_value in claims}
+    activated = await db.execute(
+        _BATCH_ACTIVATION_SQL,
+        {"ids": list(ids), "uuids": [claims[ids[key_id]] for key_id in ids], "now": now},
+    )
+    await db.commit()
+    lost = set(ids)
+    for key_id, status, activation_uuid, expires_at in activated:
+        keys[ids[key_id]] = (key_id, KeyStatus(status), activation_uuid, expires_at)
+        lost.discard(key_id)
+    if lost:
+        # Ключ, удалённый параллельно, в ответе станет "Key mismatch"
+        for key_id in lost:
+            del keys[ids[key_id]]
+        result = await db.execute(
+            select(Key.id, Key.status, Key.activation_uuid, Key.expires_at).where(Key.id.in_(lost))
+        )
+        for key_id, status, activation_uuid, expires_at in result:
+            keys[ids[key_id]] = (key_id, status, activation_uuid, expires_at)
+
+
+def _batch_item(item) -> Tuple[Optional[str], Optional[str]]:
+    """key и uuid элемента пакета; не строки (списки, объекты, числа) считаются отсутствующими"""
+    if not isinstance(item, dict):
+        return None, None
+    key_value, uuid = item.get("key"), item.get("uuid")
+    return (
+        key_value if isinstance(key_value, str) else None,
+        uuid if isinstance(uuid, str) else None,
+    )
+
 
-    if key.activation_uuid and key.activation_uuid != uuid:
+async def _archived_key_error(db: AsyncSession, product_id: int, key_value: str, uuid: str, now: datetime) -> str:
+    """Ключа нет в keys: он мог уйти в keys_archive, тогда ответ тот же, что и до переноса"""
+    archived = (
+        await db.execute(
+            select(KeyArchive.status, KeyArchive.activation_uuid, KeyArchive.expires_at).where(
+                KeyArchive.product_id == product_id, KeyArchive.value == key_value
+            )
+        )
+    ).first()
+    if archived is None:
+        return "Key mismatch"
+    return _auth_error(*archived, uuid, now) or "Key expired"
+
+
+def _auth_error(
+    status: KeyStatus,
+    activation_uuid: Optional[str],
+    expires_at: Optional[datetime],
+    uuid: str,
+    now: datetime,
+) -> Optional[str]:
+    if status in (KeyStatus.available, KeyStatus.reserved):
+        return "Key not sold"
+    if activation_uuid and activation_uuid != uuid:
+        return "HWID mismatch"
+    if expires_at and expires_at < now:
+        return "Key expired"
+    return None
+
+
+@router.post(
+    "/{product_slug}/lease/refresh",
+    response_model=schemas.AuthOut,
+    response_model_exclude_unset=True,
+    # Отказ в продлении ведёт на полную проверку по БД: лимит тот же, что у /auth
+    dependencies=[Depends(limit_auth)],
+)
+async def refresh_lease(
+    product_slug: str,
+    payload: dict,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Продление офлайн-лизы без обращения к БД, если ключ не отзывался"""
+    if not check_api_enabled():
+        raise HTTPException(status_code=503, detail="API is disabled")
+    token = payload.get("lease")
+    uuid = payload.get("uuid")
+    if not token or not uuid or not isinstance(token, str) or not isinstance(uuid, str):
+        raise HTTPException(status_code=400, detail="Lease and uuid required")
+    try:
+        claims = decode_lease_token(token)
+    except jwt.PyJWTError:
+        return {"success": False, "error": "Invalid lease"}
+    if claims["product"] != product_slug:
+        return {"success": False, "error": "Invalid lease"}
+    if claims["uuid"] != uuid:
         return {"success": False, "error": "HWID mismatch"}
 
-    if key.expires_at and key.expires_at < datetime.utcnow():
-        key.status = KeyStatus.expired
-        db.commit()
+    key_value = claims["sub"]
+    checked_at = claims.get("chk") or claims["iat"]
+    if (
+        license_cache.is_revoked(product_slug, key_value, claims["iat"])
+        or time.time() - checked_at > settings.lease_chain_max_minutes * 60
+    ):
+        # Ключ мог измениться после выдачи лизы или слишком давно не
+        # проверялся по БД — перепроверяем его полным путём
+        return await product_auth(product_slug, {"key": key_value, "uuid": uuid}, db)
+
+    expires_at = datetime.utcfromtimestamp(claims["kex"]) if claims.get("kex") else None
+    if expires_at and expires_at < datetime.utcnow():
         return {"success": False, "error": "Key expired"}
+    return _auth_success(product_slug, key_value, uuid, expires_at, checked_at)
 
-    if not key.activation_uuid:
-        key.activation_uuid = uuid
-        if not key.expires_at:
-            key.expires_at = datetime.utcnow() + timedelta(days=key.duration_days)
-        key.status = KeyStatus.activated
-        key.activated_at = datetime.utcnow()
-        db.commit()
 
+def _auth_success(
+    product_slug: str,
+    key_value: str,
+    uuid: str,
+    expires_at: Optional[datetime],
+    checked_at: Optional[int] = None,
+) -> dict:
     remaining = None
-    if key.expires_at:
-        remaining_delta = key.expires_at - datetime.utcnow()
+    if expires_at:
+        remaining_delta = expires_at - datetime.utcnow()
         remaining = {
             "days": remaining_delta.days,
             "hours": int(remaining_delta.seconds / 3600),
         }
 
-    return {"success": True, "key": key_value, "uuid": uuid, "remaining": remaining}
-
+    lease, lease_expires_at = create_lease_token(key_value, uuid, product_slug, expires_at, checked_at)
+    return {
+        "success": True,
+        "key": key_value,
+        "uuid": uuid,
+        "remaining": remaining,
+        "lease": lease,
+        "lease_expires_at": lease_expires_at,
+    }
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
 from app.models import OrderStatus, KeyStatus
 
@@ -18,6 +18,8 @@ class ProductPriceOut(BaseModel):
     id: int
     duration_days: int
     price_rub: float
+    target_stock: int
+    restock_threshold: int
 
     class Config:
         from_attributes = True
@@ -60,6 +62,21 @@ class ProductUpdate(BaseModel):
 class ProductPriceCreate(BaseModel):
     duration_days: int
     price_rub: float
+    target_stock: Optional[int] = Field(None, ge=0, le=1_000_000)
+    restock_threshold: Optional[int] = Field(None, ge=0, le=1_000_000)
+
+
+class RestockItemOut(BaseModel):
+    product_id: int
+    duration_days: int
+    available: int
+    generated: int
+
+
+class RestockReportOut(BaseModel):
+    started_at: datetime
+    finished_at: datetime
+    items: List[RestockItemOut]
 
 
 class BotSettingsOut(BaseModel):
@@ -96,7 +113,7 @@ class KeyOut(BaseModel):
 class KeysGenerateRequest(BaseModel):
     product_id: int
     duration_days: int
-    count: int = Field(gt=0, le=1000)
+    count: int = Field(gt=0, le=1_000_000)
 
 
 class KeyUpdate(BaseModel):
@@ -127,3 +144,32 @@ class UserOut(BaseModel):
     class Config:
         from_attributes = True
 
+
+class RemainingOut(BaseModel):
+    days: int
+    hours: int
+
+
+class AuthOut(BaseModel):
+    success: bool
+    error: Optional[str] = None
+    key: Optional[str] = None
+    uuid: Optional[str] = None
+    remaining: Optional[RemainingOut] = None
+    lease: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+
+
+class BatchAuthOut(BaseModel):
+    results: List[AuthOut]
+
+
+class PublicProductOut(BaseModel):
+    slug: str
+    title: str
+    description: Optional[str]
+    available: Dict[int, int]
+
+
+class PublicProductsOut(BaseModel):
+    products: List[PublicProductOut]
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 import jwt
 import bcrypt
@@ -34,3 +34,54 @@ def create_access_token(subject: str, expires_minutes: Optional[int] = None) ->
 def decode_token(token: str):
     return jwt.decode(token, settings.secret_key, algorithms=["HS256"])
 
+
+
+LEASE_AUDIENCE = "morpheus-lease"
+
+
+def _lease_keys() -> tuple[str, str]:
+    """Ключи подписи и проверки лиз: асимметричная пара или SECRET_KEY"""
+    if settings.lease_algorithm.upper().startswith("HS"):
+        return settings.secret_key, settings.secret_key
+    return settings.lease_private_key, settings.lease_public_key
+
+
+def create_lease_token(
+    key_value: str,
+    uuid: str,
+    product_slug: str,
+    key_expires_at: Optional[datetime],
+    checked_at: Optional[int] = None,
+) -> tuple[str, datetime]:
+    """
+    Подписанная краткосрочная лиза, привязанная к ключу, HWID и продукту.
+    checked_at (claim "chk") — время последней проверки ключа по БД; при
+    продлении лизы переносится из прежней.
+    """
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=settings.lease_ttl_minutes)
+    if key_expires_at and key_expires_at < expire:
+        expire = key_expires_at
+    to_encode = {
+        "sub": key_value,
+        "uuid": uuid,
+        "product": product_slug,
+        "kex": int(key_expires_at.replace(tzinfo=timezone.utc).timestamp()) if key_expires_at else None,
+        "aud": LEASE_AUDIENCE,
+        "chk": checked_at or int(now.replace(tzinfo=timezone.utc).timestamp()),
+        "iat": now,
+        "exp": expire,
+    }
+    signing_key, _ = _lease_keys()
+    return jwt.encode(to_encode, signing_key, algorithm=settings.lease_algorithm), expire
+
+
+def decode_lease_token(token: str) -> dict:
+    _, verify_key = _lease_keys()
+    return jwt.decode(
+        token,
+        verify_key,
+        algorithms=[settings.lease_algorithm],
+        audience=LEASE_AUDIENCE,
+        options={"require": ["sub", "uuid", "product", "iat", "exp"]},
+    )
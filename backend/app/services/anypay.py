@@ -1,15 +1,28 @@
 import hashlib
 import urllib.parse
 import logging
+from typing import Optional
 from app.config import settings
+from app.services.currency_rates import currency_rates
+from app.services.http_client import http_client
+from app.services.payment_providers import CreatedPayment, PaymentProvider, payment_providers
 
 logger = logging.getLogger("morpheus.anypay")
 
+# Статусы платежа Anypay, после которых он уже не изменится, -> result webhook'а
+FINAL_STATUSES = {
+    "paid": "success",
+    "canceled": "error",
+    "expired": "error",
+}
 
-class AnypayClient:
+
+class AnypayClient(PaymentProvider):
     """Клиент для работы с Anypay через SCI (Simple Checkout Interface)"""
     
+    name = "anypay"
     merchant_url = "https://anypay.io/merchant"
+    api_url = "https://anypay.io/api"
     
     # IP адреса Anypay для проверки webhook
     ANYPAY_IPS = [
@@ -19,12 +32,38 @@ class AnypayClient:
     ]
 
     def __init__(self):
-        self.merchant_id = settings.anypay_project_id
+        self.merchant_id = settings.anypay_project_id.strip()
         # Для SCI используем отдельный secret_key, если задан, иначе API_KEY
-        # Используем getattr для безопасного доступа к полю
-        self.secret_key = getattr(settings, 'anypay_secret_key', None) or settings.anypay_api_key
-        if not self.secret_key:
-            logger.error("Anypay secret key not configured! Set ANYPAY_SECRET_KEY or ANYPAY_API_KEY in .env")
+        self.secret_key = settings.anypay_secret_key.strip() or settings.anypay_api_key.strip()
+
+    def configured(self) -> bool:
+        return bool(self.merchant_id and self.secret_key)
+
+    def supports_method(self, method: Optional[str]) -> bool:
+        methods = [m.strip().lower() for m in settings.anypay_methods.split(",") if m.strip()]
+        return bool(method) and method.lower() in methods
+
+    async def create_payment(
+        self,
+        order_id: str,
+        amount_rub: float,
+        description: str = "",
+        customer: str = "",
+        method: Optional[str] = None,
+    ) -> CreatedPayment:
+        """
+        Платёж через SCI: ссылка подписывается локально, без запроса к Anypay.
+        Метод другой платёжной системы (при переключении с NicePay) не передаём.
+        """
+        link = self.create_payment_url(
+            str(order_id),
+            amount_rub,
+            description,
+            email=customer or "client@example.com",
+            method=method if self.supports_method(method) else None,
+        )
+        # Номер платежа Anypay придёт в webhook; до тех пор платёж ищется по pay_id
+        return CreatedPayment(provider=self.name, payment_id=str(order_id), link=link)
 
     def create_payment_url(self, pay_id: str, amount: float, desc: str, email: str = "client@example.com", method: str = None):
         """
@@ -54,6 +93,15 @@ class AnypayClient:
             if currency not in valid_currencies:
                 logger.warning(f"Invalid currency {currency}, using RUB instead")
                 currency = "RUB"
+            
+            # Цена заказа в рублях: пересчитываем по тем же курсам, что проверяет webhook
+            if currency != "RUB":
+                converted = currency_rates.from_rub(amount, currency)
+                if converted is None:
+                    logger.warning(f"No fresh {currency} rate, using RUB instead")
+                    currency = "RUB"
+                else:
+                    amount = converted
         
         # Форматируем сумму с точкой как разделителем десятичных знаков
         amount_str = f"{amount:.2f}"
@@ -85,7 +133,7 @@ class AnypayClient:
         ])
         
         # Выбираем алгоритм подписи (SHA256 или MD5)
-        sign_algorithm = getattr(settings, 'anypay_sign_algorithm', 'sha256').lower().strip()
+        sign_algorithm = settings.anypay_sign_algorithm.lower().strip()
         
         if sign_algorithm == "md5":
             # MD5 порядок: currency:amount:secret_key:merchant_id:pay_id
@@ -97,12 +145,12 @@ class AnypayClient:
                 str(pay_id)
             ])
             sign = hashlib.md5(sign_payload.encode()).hexdigest()
-            logger.info(f"Using MD5 algorithm for signature")
+            logger.info("Using MD5 algorithm for signature")
         else:
             # SHA256 порядок: merchant_id:pay_id:amount:currency:desc:success_url:fail_url:secret_key
             sign_payload = sign_payload_sha256
             sign = hashlib.sha256(sign_payload.encode()).hexdigest()
-            logger.info(f"Using SHA256 algorithm for signature")
+            logger.info("Using SHA256 algorithm for signature")
         
         logger.debug(f"Sign components: merchant_id={self.merchant_id}, pay_id={pay_id}, amount={amount_str}, currency={currency}, desc={desc_trimmed}, success_url={success_url}, fail_url={fail_url}")
         logger.debug(f"Full sign payload (before hash): {sign_payload.replace(self.secret_key, '***SECRET_KEY***')}")
@@ -164,6 +212,56 @@ class AnypayClient:
         
         return is_valid
 
+    def verify_webhook(self, params: dict) -> bool:
+        if not params.get("sign"):
+            return False
+        return self.verify_webhook_signature(
+            params.get("currency", ""),
+            params.get("amount", ""),
+            params.get("pay_id", ""),
+            params.get("merchant_id", ""),
+            params.get("status", ""),
+            params["sign"],
+        )
+
     def verify_webhook_ip(self, ip: str) -> bool:
         """Проверяет, что IP адрес принадлежит Anypay"""
         return ip in self.ANYPAY_IPS
+
+    async def fetch_status(self, payment_id: str) -> Optional[dict]:
+        """
+        Статус платежа по pay_id через API payments (нужны ANYPAY_API_ID и ANYPAY_API_KEY).
+        Подпись: sha256('payments' + API_ID + project_id + API_KEY).
+        """
+        api_id = settings.anypay_api_id.strip()
+        api_key = settings.anypay_api_key.strip()
+        if not api_id or not api_key:
+            return None
+        sign = hashlib.sha256(f"payments{api_id}{self.merchant_id}{api_key}".encode()).hexdigest()
+        response = await http_client.request(
+            "POST",
+            f"{self.api_url}/payments/{api_id}",
+            data={"project_id": self.merchant_id, "pay_id": payment_id, "sign": sign},
+            headers={"Accept": "application/json"},
+        )
+        logger.debug(f"Status response for {payment_id}: {response.status_code} {response.text}")
+        response.raise_for_status()
+        data = response.json()
+        if "error" in data:
+            logger.warning(f"Anypay status error for {payment_id}: {data['error'].get('message')}")
+            return None
+        payments = (data.get("result") or {}).get("payments") or {}
+        if not payments:
+            return None
+        payment = next(iter(payments.values()))
+        status = str(payment.get("status", "")).lower()
+        return {
+            "result": FINAL_STATUSES.get(status),
+            "status": status,
+            "amount": None,
+            "currency": payment.get("currency"),
+        }
+
+
+anypay_client = AnypayClient()
+payment_providers.register(anypay_client)
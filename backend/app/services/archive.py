@@ -0,0 +1,94 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger("morpheus.archive")
+
+ARCHIVE_BATCH_SIZE = 1000
+
+_ORDER_COLUMNS = (
+    "id, user_id, product_id, duration_days, amount, currency, provider, provider_pay_id, "
+    "payment_url, status, key_id, created_at, updated_at"
+)
+_KEY_COLUMNS = (
+    "id, product_id, value, duration_days, status, sold_to_user_id, activation_uuid, "
+    "sold_at, activated_at, expires_at, created_at"
+)
+
+# Завершённые заказы переносятся первыми: пока заказ в orders, его ключ
+# удерживается внешним ключом orders.key_id
+_ARCHIVE_ORDERS_SQL = text(f"""
+    WITH moved AS (
+        DELETE FROM orders
+        WHERE id IN (
+            SELECT id FROM orders
+            WHERE status IN ('paid', 'failed', 'cancelled') AND coalesce(updated_at, created_at) < :cutoff
+            ORDER BY id
+            LIMIT :batch
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {_ORDER_COLUMNS}
+    )
+    INSERT INTO orders_archive ({_ORDER_COLUMNS}, archived_at)
+    SELECT {_ORDER_COLUMNS}, :now FROM moved
+""")
+
+# Истёкшие ключи без заказа в горячей таблице; key_stock.sold уменьшается
+# в том же запросе, как при полном пересчёте по таблице keys
+_ARCHIVE_KEYS_SQL = text(f"""
+    WITH moved AS (
+        DELETE FROM keys
+        WHERE id IN (
+            SELECT k.id FROM keys k
+            WHERE k.status = 'expired' AND k.expires_at < :cutoff
+              AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.key_id = k.id)
+              AND NOT EXISTS (SELECT 1 FROM keys_archive a WHERE a.value = k.value)
+            ORDER BY k.id
+            LIMIT :batch
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {_KEY_COLUMNS}
+    ), archived AS (
+        INSERT INTO keys_archive ({_KEY_COLUMNS}, archived_at)
+        SELECT {_KEY_COLUMNS}, :now FROM moved
+    ), destocked AS (
+        UPDATE key_stock ks SET sold = ks.sold - m.cnt
+        FROM (SELECT product_id, duration_days, count(*) AS cnt FROM moved GROUP BY product_id, duration_days) m
+        WHERE ks.product_id = m.product_id AND ks.duration_days = m.duration_days
+    )
+    SELECT count(*) FROM moved
+""")
+
+# Выполненные сообщения outbox нужны только для разбора инцидентов
+_PRUNE_OUTBOX_SQL = text("DELETE FROM outbox_messages WHERE sent_at < :cutoff")
+
+
+async def archive_settled() -> Dict[str, int]:
+    """
+    Переносит в orders_archive и keys_archive завершённые заказы и истёкшие
+    ключи старше ARCHIVE_AFTER_DAYS, пачками по ARCHIVE_BATCH_SIZE строк.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=settings.archive_after_days)
+    params = {"cutoff": cutoff, "now": now, "batch": ARCHIVE_BATCH_SIZE}
+    moved = {"orders": 0, "keys": 0}
+    for name, statement in (("orders", _ARCHIVE_ORDERS_SQL), ("keys", _ARCHIVE_KEYS_SQL)):
+        while True:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(statement, params)
+                count = result.rowcount if name == "orders" else result.scalar()
+                await db.commit()
+            moved[name] += count
+            if count < ARCHIVE_BATCH_SIZE:
+                break
+    async with AsyncSessionLocal() as db:
+        await db.execute(_PRUNE_OUTBOX_SQL, {"cutoff": cutoff})
+        await db.commit()
+    if moved["orders"] or moved["keys"]:
+        logger.info("Archived %s orders and %s keys", moved["orders"], moved["keys"])
+    return moved
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from typing import Optional
 from aiogram import Bot, Dispatcher, F
@@ -12,17 +11,18 @@ from app.database import SessionLocal
 
 logger = logging.getLogger("morpheus.bot")
 from app.models import (
-    BotSettings,
     Product,
     ProductPrice,
-    Key,
-    KeyStatus,
+    KeyStock,
     User,
     Order,
-    OrderStatus,
     Build,
 )
-from app.services.nicepay import NicepayClient
+from app.services.bot_settings import BotSettingsSnapshot, bot_settings_store
+from app.services.checkout import attach_payment, discard_order, open_order, speculative_checkout
+from app.services.currency_rates import currency_rates
+from app.services.key_pool import key_pool
+from app.services.outbox import ORDER_DELIVERY, outbox_dispatcher
 
 
 class BotService:
@@ -33,7 +33,7 @@ class BotService:
             raise ValueError("TELEGRAM_BOT_TOKEN is empty or not set in .env file")
         
         if ":" not in token:
-            logger.error(f"Invalid token format: token should be 'BOT_ID:TOKEN'")
+            logger.error("Invalid token format: token should be 'BOT_ID:TOKEN'")
             raise ValueError("TELEGRAM_BOT_TOKEN has invalid format (should be 'BOT_ID:TOKEN')")
         
         try:
@@ -44,16 +44,9 @@ class BotService:
             logger.error(f"Failed to initialize bot: {e}")
             raise
         
-        self.nicepay = NicepayClient()
 
-    async def _get_settings(self, db: Session) -> BotSettings:
-        settings_obj = db.query(BotSettings).first()
-        if not settings_obj:
-            settings_obj = BotSettings(bot_enabled=False, maintenance_mode=False)
-            db.add(settings_obj)
-            db.commit()
-            db.refresh(settings_obj)
-        return settings_obj
+    def _get_settings(self) -> BotSettingsSnapshot:
+        return bot_settings_store.get()
 
     async def _require_user(self, db: Session, message: Message) -> User:
         try:
@@ -92,7 +85,7 @@ class BotService:
         @dp.message(Command(commands=["start", "help"]))
         async def cmd_start(message: Message):
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await message.answer(
                         settings_obj.alert_message or "Бот отключен администратором."
@@ -112,7 +105,7 @@ class BotService:
         @dp.message(F.text == "📋 Каталог")
         async def show_products(message: Message):
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await message.answer("Бот отключен администратором.")
                     return
@@ -141,7 +134,7 @@ class BotService:
         async def product_details(call: CallbackQuery):
             slug = call.data.split(":")[1]
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await call.answer("Бот отключен", show_alert=True)
                     return
@@ -158,18 +151,13 @@ class BotService:
                 if not variants:
                     await call.answer("Нет вариантов подписки", show_alert=True)
                     return
+                available_by_duration = {
+                    row.duration_days: row.available
+                    for row in db.query(KeyStock).filter_by(product_id=product.id).all()
+                }
                 buttons = []
                 for v in variants:
-                    available = (
-                        db.query(Key)
-                        .filter(
-                            Key.product_id == product.id,
-                            Key.duration_days == v.duration_days,
-                            Key.status == KeyStatus.available,
-                        )
-                        .count()
-                    )
-                    if available == 0:
+                    if available_by_duration.get(v.duration_days, 0) <= 0:
                         continue
                     buttons.append(
                         InlineKeyboardButton(
@@ -197,7 +185,7 @@ class BotService:
         @dp.callback_query(F.data == "back")
         async def back_to_catalog(call: CallbackQuery):
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await call.answer("Бот отключен", show_alert=True)
                     return
@@ -234,7 +222,7 @@ class BotService:
             duration = int(duration_str)
             
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await call.answer("Бот отключен", show_alert=True)
                     return
@@ -261,16 +249,7 @@ class BotService:
                     await call.answer("Нет цены для выбранной длительности", show_alert=True)
                     return
                 
-                key = (
-                    db.query(Key)
-                    .filter(
-                        Key.product_id == product.id,
-                        Key.duration_days == duration,
-                        Key.status == KeyStatus.available,
-                    )
-                    .first()
-                )
-                if not key:
+                if not key_pool.has_keys(db, product.id, duration) and not speculative_checkout.holds_key(db, user.id, product.id, duration):
                     await call.answer("Ключи закончились", show_alert=True)
                     return
                 
@@ -279,6 +258,9 @@ class BotService:
                     await call.answer("Минимальная сумма для оплаты составляет 200 рублей", show_alert=True)
                     return
                 
+                # Пока покупатель выбирает метод, в фоне создаётся заказ с ключом
+                speculative_checkout.prepare(user.id, product.id, duration)
+                
                 # Получаем доступные методы оплаты
                 methods_str = settings.nicepay_methods or "sbp_rub"
                 available_methods = [m.strip().lower() for m in methods_str.split(",") if m.strip()]
@@ -377,7 +359,7 @@ class BotService:
             duration = int(duration_str)
             
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await call.answer("Бот отключен", show_alert=True)
                     return
@@ -404,11 +386,18 @@ class BotService:
                     await call.answer("Нет цены для выбранной длительности", show_alert=True)
                     return
                 
+                if not key_pool.has_keys(db, product.id, duration) and not speculative_checkout.holds_key(db, user.id, product.id, duration):
+                    await call.answer("Ключи закончились", show_alert=True)
+                    return
+                
                 # Проверяем минимальную сумму для СБП (200 рублей)
                 if method and method.lower() in ["sbp_rub", "sbp"] and price.price_rub < 200:
                     await call.answer("Минимальная сумма для оплаты через СБП составляет 200 рублей", show_alert=True)
                     return
                 
+                # Пока покупатель читает подтверждение, в фоне создаётся платёж
+                speculative_checkout.prepare(user.id, product.id, duration, method)
+                
                 method_names = {
                     "sbp_rub": "СБП по QR",
                     "sbp": "СБП",
@@ -437,11 +426,18 @@ class BotService:
                 }
                 method_display = method_names.get(method.lower(), method.upper())
                 
+                # Для метода не в рублях показываем примерную сумму по текущему курсу
+                amount_note = ""
+                method_currency = method.rsplit("_", 1)[-1].upper()
+                converted = currency_rates.from_rub(price.price_rub, method_currency) if "_" in method else None
+                if converted is not None and method_currency != "RUB":
+                    amount_note = f" (≈ {converted:.2f} {method_currency})"
+                
                 text = (
                     f"<b>Подтверждение покупки</b>\n\n"
                     f"📦 Товар: {product.title}\n"
                     f"📅 Срок: {duration} дней\n"
-                    f"💰 Сумма: {int(price.price_rub)}₽\n"
+                    f"💰 Сумма: {int(price.price_rub)}₽{amount_note}\n"
                     f"💳 Метод оплаты: {method_display}\n\n"
                     f"Подтвердите покупку:"
                 )
@@ -470,7 +466,7 @@ class BotService:
             duration = int(duration_str)
             
             with SessionLocal() as db:
-                settings_obj = await self._get_settings(db)
+                settings_obj = self._get_settings()
                 if not settings_obj.bot_enabled:
                     await call.answer("Бот отключен", show_alert=True)
                     return
@@ -502,83 +498,33 @@ class BotService:
                     await call.answer("Минимальная сумма для оплаты через СБП составляет 200 рублей", show_alert=True)
                     return
                 
-                key = (
-                    db.query(Key)
-                    .filter(
-                        Key.product_id == product.id,
-                        Key.duration_days == duration,
-                        Key.status == KeyStatus.available,
-                    )
-                    .first()
-                )
-                if not key:
-                    await call.answer("Ключи закончились", show_alert=True)
-                    return
-                
-                # Создаем заказ
-                order = Order(
-                    user_id=user.id,
-                    product_id=product.id,
-                    duration_days=duration,
-                    amount=price.price_rub,
-                    currency="RUB",
-                    status=OrderStatus.pending,
-                    key=key,
-                )
-                db.add(order)
-                db.commit()
-                db.refresh(order)
-
-                desc = f"{product.title} {duration}d / Telegram ID: {user.telegram_id}"
-                
-                # Генерируем автоматический email
-                customer_email = f"user_{user.telegram_id}@example.com"
-                
-                try:
-                    # ПРОСТАЯ конвертация: всегда RUB, рубли в копейки
-                    currency = "RUB"
-                    amount = int(price.price_rub * 100)  # Рубли → копейки
-                    
-                    logger.info(f"=== BOT PAYMENT CREATION ===")
-                    logger.info(f"Order ID: {order.id}")
-                    logger.info(f"Product: {product.title}, Price: {price.price_rub} RUB")
-                    logger.info(f"Amount in kopecks: {amount}")
-                    logger.info(f"Customer email: {customer_email}")
-                    logger.info(f"Description: {desc}")
-                    
-                    # Создаем платеж через NicePay API
-                    payment_result = await self.nicepay.create_payment(
-                        order_id=str(order.id),
-                        amount=amount,  # Копейки!
-                        currency=currency,
-                        customer=customer_email,
-                        description=desc,
-                    )
-                    
-                    if not payment_result.get("success") or not payment_result.get("link"):
-                        raise ValueError(f"Invalid payment response: {payment_result}")
-                    
-                    payment_url = payment_result["link"]
-                    payment_id = payment_result["payment_id"]
-                    
-                    logger.info(f"✅ Payment URL created: {payment_url[:80]}...")
+                # Обычно заказ и платёж уже подготовлены в фоне на предыдущих шагах
+                order_id = await speculative_checkout.claim(user.id, product.id, duration, method)
+                order = db.get(Order, order_id) if order_id is not None else None
+                if order is None:
+                    # Резервируем ключ из пула воркера: параллельные покупки получают разные ключи
+                    order = open_order(db, user, product, duration, price.price_rub)
+                    if not order:
+                        await call.answer("Ключи закончились", show_alert=True)
+                        return
                     
-                    order.payment_url = payment_url
-                    order.provider_pay_id = payment_id
-                    order.status = OrderStatus.waiting
-                    db.commit()
-                    
-                    logger.info(f"✅ Order {order.id} created successfully!")
-                    
-                except Exception as e:
-                    db.rollback()
-                    if order.id:
-                        db.delete(order)
-                        db.commit()
-                    logger.error(f"❌ Payment creation error: {e}", exc_info=True)
-                    error_message = str(e) if str(e) else "Неизвестная ошибка"
-                    await call.answer(f"Ошибка создания платежа: {error_message}", show_alert=True)
-                    return
+                    try:
+                        logger.info(f"Creating payment for order {order.id}: {product.title}, {price.price_rub} RUB")
+                        
+                        # Первая по приоритету платёжная система, которую не отключил breaker;
+                        # при её ошибке — сразу следующая
+                        await attach_payment(db, order, user, product, method)
+                        
+                        logger.info(f"✅ Order {order.id} created successfully!")
+                        
+                    except Exception as e:
+                        db.rollback()
+                        # Заказ удаляем, а зарезервированный ключ возвращаем в продажу
+                        discard_order(db, order)
+                        logger.error(f"❌ Payment creation error: {e}", exc_info=True)
+                        error_message = str(e) if str(e) else "Неизвестная ошибка"
+                        await call.answer(f"Ошибка создания платежа: {error_message}", show_alert=True)
+                        return
 
                 try:
                     await call.message.edit_text(
@@ -655,6 +601,16 @@ class BotService:
 bot_service: Optional[BotService] = None
 
 
+async def deliver_order(payload: dict) -> None:
+    """Обработчик outbox: пока бот не запущен, сообщение ждёт следующей попытки"""
+    if bot_service is None:
+        raise RuntimeError("Bot is not running")
+    await bot_service.send_order_delivery(payload["order_id"])
+
+
+outbox_dispatcher.register(ORDER_DELIVERY, deliver_order)
+
+
 async def run_bot():
     global bot_service
     try:
@@ -672,7 +628,7 @@ async def run_bot():
             return
         
         if ":" not in token:
-            logger.error(f"Invalid token format: token should be 'BOT_ID:TOKEN'")
+            logger.error("Invalid token format: token should be 'BOT_ID:TOKEN'")
             logger.error("Please check TELEGRAM_BOT_TOKEN format in .env file")
             return
             
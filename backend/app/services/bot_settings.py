@@ -0,0 +1,84 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import AsyncSessionLocal
+from app.models import BotSettings
+from app.services.notify import notify_listener, notify_statement
+
+logger = logging.getLogger("morpheus.bot_settings")
+
+CHANNEL = "morpheus_bot_settings"
+
+
+@dataclass(frozen=True)
+class BotSettingsSnapshot:
+    """Неизменяемый снимок строки bot_settings"""
+    bot_enabled: bool = False
+    api_enabled: bool = True
+    maintenance_mode: bool = False
+    alert_message: Optional[str] = None
+    technical_message: Optional[str] = None
+    version: int = 0
+
+    @classmethod
+    def from_model(cls, obj: BotSettings) -> "BotSettingsSnapshot":
+        return cls(
+            bot_enabled=bool(obj.bot_enabled),
+            api_enabled=obj.api_enabled is not False,
+            maintenance_mode=bool(obj.maintenance_mode),
+            alert_message=obj.alert_message,
+            technical_message=obj.technical_message,
+            version=obj.version or 0,
+        )
+
+
+class BotSettingsStore:
+    """
+    Снимок настроек бота в памяти процесса.
+
+    Чтение бесплатное. PUT /admin/settings увеличивает версию и отправляет
+    NOTIFY, по которому остальные воркеры перечитывают строку из БД.
+    """
+
+    def __init__(self):
+        # До первой загрузки действуют значения по умолчанию модели BotSettings
+        self._snapshot = BotSettingsSnapshot()
+
+    def get(self) -> BotSettingsSnapshot:
+        return self._snapshot
+
+    def set(self, obj: BotSettings) -> BotSettingsSnapshot:
+        snapshot = BotSettingsSnapshot.from_model(obj)
+        if snapshot.version >= self._snapshot.version:
+            self._snapshot = snapshot
+        return self._snapshot
+
+    async def reload(self) -> BotSettingsSnapshot:
+        async with AsyncSessionLocal() as db:
+            settings_obj = (await db.execute(select(BotSettings).limit(1))).scalars().first()
+            if not settings_obj:
+                settings_obj = BotSettings(bot_enabled=False, api_enabled=True, maintenance_mode=False, version=1)
+                db.add(settings_obj)
+                await db.commit()
+            self._snapshot = BotSettingsSnapshot.from_model(settings_obj)
+        logger.info("Bot settings loaded (version %s)", self._snapshot.version)
+        return self._snapshot
+
+    def publish(self, db: Session, obj: BotSettings) -> None:
+        """Поднимает версию и ставит NOTIFY в текущую транзакцию (до commit)"""
+        obj.version = (obj.version or 0) + 1
+        db.flush()
+        db.execute(notify_statement(CHANNEL, str(obj.version)))
+
+    async def on_notify(self, payload: Optional[str]) -> None:
+        if payload is not None and payload.isdigit() and int(payload) <= self._snapshot.version:
+            return
+        await self.reload()
+
+
+bot_settings_store = BotSettingsStore()
+notify_listener.subscribe(CHANNEL, bot_settings_store.on_notify)
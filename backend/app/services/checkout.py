@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Order, OrderStatus, Product, ProductPrice, User
+from app.services.key_pool import key_pool
+from app.services.payment_providers import payment_providers
+from app.services.reservations import release_key
+
+logger = logging.getLogger("morpheus.checkout")
+
+
+def open_order(db: Session, user: User, product: Product, duration_days: int, amount: float, speculative: bool = False) -> Optional[Order]:
+    """Заказ с ключом из пула воркера (с commit); None — ключи закончились"""
+    key = key_pool.pop(db, product.id, duration_days)
+    if not key:
+        db.rollback()
+        return None
+    order = Order(
+        user_id=user.id,
+        product_id=product.id,
+        duration_days=duration_days,
+        amount=amount,
+        currency="RUB",
+        status=OrderStatus.pending,
+        key=key,
+        speculative=speculative,
+    )
+    db.add(order)
+    db.commit()
+    db.refresh(order)
+    return order
+
+
+async def attach_payment(db: Session, order: Order, user: User, product: Product, method: str) -> None:
+    """
+    Создаёт платёж в первой доступной платёжной системе и переводит заказ
+    в waiting (с commit). Ошибку создания пробрасывает.
+    """
+    payment = await payment_providers.create_payment(
+        order_id=str(order.id),
+        amount_rub=order.amount,
+        description=f"{product.title} {order.duration_days}d / Telegram ID: {user.telegram_id}",
+        customer=f"user_{user.telegram_id}@example.com",
+        method=method,
+    )
+    order.provider = payment.provider
+    order.payment_url = payment.link
+    order.provider_pay_id = payment.payment_id
+    order.payment_method = method
+    order.status = OrderStatus.waiting
+    db.commit()
+    logger.info(f"Payment for order {order.id} created via {payment.provider}")
+
+
+def discard_order(db: Session, order: Order) -> None:
+    """Удаляет заказ, который покупатель не видел, и возвращает его ключ в продажу (с commit)"""
+    if order.key:
+        release_key(db, order.key)
+    db.delete(order)
+    db.commit()
+
+
+class SpeculativeCheckout:
+    """
+    Заказ и платёж готовятся в фоне, пока покупатель выбирает метод оплаты
+    и читает экран подтверждения: заказ с ключом — при выборе срока, платёж —
+    при выборе метода. Подтверждение лишь забирает готовую ссылку.
+
+    У пользователя не больше одного такого заказа: подготовки одного
+    пользователя идут по очереди, и новый выбор заменяет прежний заказ.
+    Неподтверждённые заказы отменяет sweeper через SPECULATIVE_ORDER_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def prepare(self, user_id: int, product_id: int, duration_days: int, method: Optional[str] = None) -> None:
+        if settings.speculative_order_ttl_seconds <= 0:
+            return
+        task = asyncio.create_task(
+            self._prepare(self._tasks.get(user_id), user_id, product_id, duration_days, method)
+        )
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+
+    def _forget(self, user_id: int, task: asyncio.Task) -> None:
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    def holds_key(self, db: Session, user_id: int, product_id: int, duration_days: int) -> bool:
+        """Держит ли подготовленный заказ пользователя ключ на этот срок (например, последний)"""
+        return (
+            db.query(Order.id)
+            .filter(
+                Order.user_id == user_id,
+                Order.product_id == product_id,
+                Order.duration_days == duration_days,
+                Order.speculative.is_(True),
+                Order.status.in_([OrderStatus.pending, OrderStatus.waiting]),
+                Order.key_id.is_not(None),
+            )
+            .first()
+            is not None
+        )
+
+    async def claim(self, user_id: int, product_id: int, duration_days: int, method: str) -> Optional[int]:
+        """
+        Дожидается подготовки и забирает готовый заказ с платежом под method.
+        Возвращает id заказа или None, если заказ нужно создавать сейчас.
+        """
+        task = self._tasks.get(user_id)
+        if task is not None:
+            await asyncio.wait({task})
+        with SessionLocal() as db:
+            # FOR UPDATE: sweeper отменяет заказы через SKIP LOCKED и этот не тронет
+            order = (
+                db.query(Order)
+                .filter_by(
+                    user_id=user_id,
+                    product_id=product_id,
+                    duration_days=duration_days,
+                    payment_method=method,
+                    status=OrderStatus.waiting,
+                    speculative=True,
+                )
+                .order_by(Order.id.desc())
+                .with_for_update()
+                .first()
+            )
+            if order is None:
+                return None
+            order.speculative = False
+            db.commit()
+            return order.id
+
+    async def _prepare(
+        self,
+        previous: Optional[asyncio.Task],
+        user_id: int,
+        product_id: int,
+        duration_days: int,
+        method: Optional[str],
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait({previous})
+        with SessionLocal() as db:
+            order = None
+            try:
+                order = (
+                    db.query(Order)
+                    .filter(
+                        Order.user_id == user_id,
+                        Order.speculative.is_(True),
+                        Order.status.in_([OrderStatus.pending, OrderStatus.waiting]),
+                    )
+                    .order_by(Order.id.desc())
+                    .first()
+                )
+                if order is not None:
+                    same_item = (order.product_id, order.duration_days) == (product_id, duration_days)
+                    if same_item and (method is None or order.payment_method == method):
+                        return
+                    if not same_item or order.payment_method is not None:
+                        # Платёж под другой метод не переиспользуем: у систем номер заказа уникален
+                        discard_order(db, order)
+                        order = None
+                user = db.get(User, user_id)
+                product = db.get(Product, product_id)
+                if order is None:
+                    price = db.query(ProductPrice).filter_by(product_id=product_id, duration_days=duration_days).first()
+                    if price is None:
+                        return
+                    order = open_order(db, user, product, duration_days, price.price_rub, speculative=True)
+                    if order is None:
+                        return
+                if method is not None:
+                    await attach_payment(db, order, user, product, method)
+            except Exception as e:
+                logger.warning(f"Speculative checkout for user {user_id} failed: {e!r}")
+                if order is not None:
+                    self._discard_pending(db, user_id, order)
+
+    @staticmethod
+    def _discard_pending(db: Session, user_id: int, order: Order) -> None:
+        """
+        Уборка после сбоя подготовки. Ошибка уборки (например, БД недоступна)
+        не должна уйти из фоновой задачи: заказ тогда отменит sweeper по TTL.
+        """
+        try:
+            db.rollback()
+            if order.status == OrderStatus.pending:
+                discard_order(db, order)
+        except Exception as e:
+            # identity, а не order.id: после rollback обращение к атрибуту снова пошло бы в БД
+            order_ref = inspect(order).identity
+            logger.error(f"Failed to discard speculative order {order_ref} for user {user_id}: {e!r}")
+
+
+speculative_checkout = SpeculativeCheckout()
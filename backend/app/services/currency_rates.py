@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import CurrencyRate
+from app.services.notify import notify_listener, notify_statement
+
+logger = logging.getLogger("morpheus.currency_rates")
+
+CHANNEL = "currency_rates"
+BASE_CURRENCY = "RUB"
+# Источник опрашивает один воркер, остальные перечитывают таблицу по NOTIFY
+REFRESH_LOCK_ID = 0x72617465
+
+DEFAULT_RATES_FILE = os.path.join(os.path.dirname(__file__), "..", "currency_rates.json")
+
+
+class RateSource(ABC):
+    """Источник курсов: fetch возвращает {валюта: рублей за единицу}"""
+
+    name = ""
+
+    @abstractmethod
+    async def fetch(self) -> Dict[str, float]:
+        ...
+
+
+class FileRateSource(RateSource):
+    """JSON-файл {"USD": 100.0, ...} — локальная замена внешнего источника курсов"""
+
+    name = "file"
+
+    async def fetch(self) -> Dict[str, float]:
+        return await asyncio.to_thread(self._read, settings.currency_rates_file or DEFAULT_RATES_FILE)
+
+    @staticmethod
+    def _read(path: str) -> Dict[str, float]:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {str(currency).upper(): float(rate) for currency, rate in data.items()}
+
+
+class CurrencyRates:
+    """
+    Снимок таблицы currency_rates в памяти воркера. Пересчёт суммы — чистое
+    вычисление без запросов к БД; курс старше CURRENCY_RATES_MAX_AGE_SECONDS
+    считается неизвестным, и вызывающий получает None.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, RateSource] = {}
+        self._rates: Dict[str, Tuple[float, datetime]] = {}
+
+    def register_source(self, source: RateSource) -> None:
+        self._sources[source.name] = source
+
+    def rate(self, currency: Optional[str]) -> Optional[float]:
+        """Сколько рублей стоит единица валюты; None — курса нет или он устарел"""
+        currency = (currency or BASE_CURRENCY).upper()
+        if currency == BASE_CURRENCY:
+            return 1.0
+        item = self._rates.get(currency)
+        if item is None:
+            return None
+        rate, updated_at = item
+        if datetime.utcnow() - updated_at > timedelta(seconds=settings.currency_rates_max_age_seconds):
+            return None
+        return rate
+
+    def to_rub(self, amount: float, currency: Optional[str]) -> Optional[float]:
+        rate = self.rate(currency)
+        return amount * rate if rate is not None else None
+
+    def from_rub(self, amount_rub: float, currency: Optional[str]) -> Optional[float]:
+        rate = self.rate(currency)
+        return amount_rub / rate if rate else None
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            currency: {"rub_per_unit": rate, "updated_at": updated_at}
+            for currency, (rate, updated_at) in sorted(self._rates.items())
+        }
+
+    async def reload(self) -> None:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(CurrencyRate))).scalars().all()
+        self._rates = {row.currency: (row.rub_per_unit, row.updated_at) for row in rows}
+
+    async def refresh(self) -> None:
+        """
+        Забирает курсы из источника CURRENCY_RATES_SOURCE в таблицу и
+        оповещает воркеры. Если источник сейчас опрашивает другой воркер,
+        только перечитывает таблицу.
+        """
+        source = self._sources.get(settings.currency_rates_source)
+        if source is None:
+            logger.error(f"Unknown currency rates source: {settings.currency_rates_source}")
+            await self.reload()
+            return
+        async with AsyncSessionLocal() as db:
+            if (await db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": REFRESH_LOCK_ID})).scalar():
+                rates = {
+                    currency: rate
+                    for currency, rate in (await source.fetch()).items()
+                    if currency != BASE_CURRENCY and rate > 0
+                }
+                if rates:
+                    now = datetime.utcnow()
+                    stmt = insert(CurrencyRate).values([
+                        {"currency": currency, "rub_per_unit": rate, "source": source.name, "updated_at": now}
+                        for currency, rate in rates.items()
+                    ])
+                    await db.execute(stmt.on_conflict_do_update(
+                        index_elements=[CurrencyRate.currency],
+                        set_={
+                            "rub_per_unit": stmt.excluded.rub_per_unit,
+                            "source": stmt.excluded.source,
+                            "updated_at": stmt.excluded.updated_at,
+                        },
+                    ))
+                    await db.execute(notify_statement(CHANNEL, source.name))
+                    logger.info(f"Currency rates refreshed from {source.name}: {len(rates)} currencies")
+            await db.commit()
+        await self.reload()
+
+    async def on_notify(self, _payload: Optional[str]) -> None:
+        await self.reload()
+
+
+currency_rates = CurrencyRates()
+currency_rates.register_source(FileRateSource())
+notify_listener.subscribe(CHANNEL, currency_rates.on_notify)
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import random
+from typing import Optional
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger("morpheus.http")
+
+# Ошибки, при которых запрос гарантированно не ушёл на сервер: только их
+# безопасно повторять и для неидемпотентных POST (создание платежа)
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class HttpClient:
+    """
+    Общий httpx.AsyncClient для исходящих запросов к платёжным API.
+
+    Соединения держатся keep-alive (и мультиплексируются по HTTP/2), так что
+    заказ не платит за TCP+TLS handshake. Клиент открывает и закрывает
+    lifespan приложения.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=settings.http_http2,
+                limits=httpx.Limits(
+                    max_connections=settings.http_max_connections,
+                    max_keepalive_connections=settings.http_max_connections,
+                    keepalive_expiry=60.0,
+                ),
+                timeout=httpx.Timeout(settings.http_timeout_seconds, connect=settings.http_connect_timeout_seconds),
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Запрос с повтором при ошибках соединения: до HTTP_RETRIES повторов
+        с экспоненциальной паузой и случайным разбросом. Таймаут — на попытку.
+        """
+        if self._client is None:
+            # Вне lifespan (скрипты, тесты) клиент создаётся при первом запросе
+            await self.start()
+        attempt = 0
+        while True:
+            try:
+                return await self._client.request(method, url, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= settings.http_retries:
+                    raise
+                delay = random.uniform(0, 0.2 * 2 ** attempt)
+                attempt += 1
+                logger.warning(f"{method} {url} failed ({e!r}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+
+http_client = HttpClient()
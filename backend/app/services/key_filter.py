@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import threading
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import AsyncSessionLocal
+from app.models import Key, KeyArchive, Product
+from app.services.notify import WORKER_ID, notify_listener, notify_statement
+
+logger = logging.getLogger("morpheus.key_filter")
+
+CHANNEL = "morpheus_keys"
+
+# Формат значений из utils.generate_key_value: MPH-XXXXX-XXXXX-XXXXX-XXXXX
+KEY_PATTERN = re.compile(r"^MPH(?:-[A-Z0-9]{5}){4}$")
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray с двойным хешированием blake2b"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class ProductKeyFilter:
+    """Множество выпущенных ключей одного продукта"""
+
+    def __init__(self, product_id: int, slug: str, values: Iterable[str] = ()):
+        values = list(values)
+        self.product_id = product_id
+        self.slug = slug
+        self.bloom = BloomFilter(capacity=max(len(values) * 2, 10000))
+        self.count = 0
+        self.stale = 0
+        # Структурная проверка допустима, пока все ключи продукта в формате MPH-...
+        self.strict_format = True
+        for value in values:
+            self.add(value)
+
+    def add(self, value: str) -> None:
+        self.bloom.add(value)
+        self.count += 1
+        if self.strict_format and not KEY_PATTERN.match(value):
+            self.strict_format = False
+
+    def might_contain(self, value: str) -> bool:
+        if self.strict_format and not KEY_PATTERN.match(value):
+            return False
+        return value in self.bloom
+
+    @property
+    def needs_rebuild(self) -> bool:
+        # Переполнение повышает долю ложных срабатываний, удалённые ключи — тоже
+        return self.count > self.bloom.capacity or self.stale > max(self.count // 4, 1000)
+
+
+class KeyFilterStore:
+    """
+    Отсев заведомо несуществующих ключей в /auth без обращения к БД.
+
+    Фильтр не даёт ложных отрицаний для известных продуктов: пока фильтр
+    не построен, slug неизвестен, перестроение продукта объявлено, но ещё
+    не закончено, или нет соединения LISTEN (уведомления о новых ключах
+    теряются), любой ключ считается возможным.
+    """
+
+    def __init__(self):
+        self._filters: Dict[str, ProductKeyFilter] = {}
+        self._by_id: Dict[int, ProductKeyFilter] = {}
+        self._lock = threading.Lock()
+        self._rebuilds = 0
+        # Ключи, добавленные во время перестроения: иначе новый фильтр,
+        # построенный по более раннему снимку БД, их бы «потерял»
+        self._journal: list = []
+        self._rebuild_task: Optional[asyncio.Task] = None
+        # Номер события: перестроение снимает только отметки, сделанные до его начала
+        self._seq = 0
+        # product_id -> номер отметки «в БД есть ключи, которых нет в фильтре»
+        self._pending: Dict[int, int] = {}
+        # Номер последнего сброса всех фильтров (после переподключения LISTEN)
+        self._reset_seq = 0
+        self.ready = False
+
+    def might_exist(self, product_slug: str, key_value: str) -> bool:
+        if not self.ready or not notify_listener.connected:
+            return True
+        product_filter = self._filters.get(product_slug)
+        if product_filter is None or product_filter.product_id in self._pending:
+            return True
+        return product_filter.might_contain(key_value)
+
+    def mark_pending(self, product_id: int) -> None:
+        """До конца следующего перестроения фильтр продукта ключи не отсекает"""
+        with self._lock:
+            self._seq += 1
+            self._pending[product_id] = self._seq
+
+    def add_product(self, product_id: int, slug: str) -> None:
+        with self._lock:
+            self._install(ProductKeyFilter(product_id, slug))
+
+    def drop_product(self, product_id: int) -> None:
+        with self._lock:
+            product_filter = self._by_id.pop(product_id, None)
+            if product_filter:
+                self._filters.pop(product_filter.slug, None)
+
+    def add_values(self, product_id: int, values: Iterable[str]) -> bool:
+        """Добавляет ключи; возвращает True, если фильтр продукта пора перестроить"""
+        values = list(values)
+        with self._lock:
+            if self._rebuilds:
+                self._journal.append((product_id, values))
+            product_filter = self._by_id.get(product_id)
+            if product_filter is None:
+                return False
+            for value in values:
+                product_filter.add(value)
+            return product_filter.needs_rebuild
+
+    def discard(self, product_id: int, value: str) -> bool:
+        """Из фильтра Блума удалить нельзя: только учитываем устаревшие записи"""
+        with self._lock:
+            product_filter = self._by_id.get(product_id)
+            if product_filter is None:
+                return False
+            product_filter.stale += 1
+            return product_filter.needs_rebuild
+
+    def _install(self, product_filter: ProductKeyFilter) -> None:
+        old = self._by_id.get(product_filter.product_id)
+        if old is not None:
+            self._filters.pop(old.slug, None)
+        self._by_id[product_filter.product_id] = product_filter
+        self._filters[product_filter.slug] = product_filter
+
+    def _begin_rebuild(self) -> int:
+        with self._lock:
+            self._rebuilds += 1
+            return self._seq
+
+    def _finish_rebuild(self, filters: list, replace_all: bool, started: int, product_id: Optional[int] = None) -> None:
+        with self._lock:
+            self._rebuilds -= 1
+            for pending_id in list(self._pending) if replace_all else [product_id]:
+                if pending_id in self._pending and self._pending[pending_id] <= started:
+                    del self._pending[pending_id]
+            by_id = {f.product_id: f for f in filters}
+            for product_id, values in self._journal:
+                if product_id in by_id:
+                    for value in values:
+                        by_id[product_id].add(value)
+            if not self._rebuilds:
+                self._journal.clear()
+            if replace_all:
+                self._filters = {f.slug: f for f in filters}
+                self._by_id = by_id
+                self.ready = self._reset_seq <= started
+            else:
+                for product_filter in filters:
+                    self._install(product_filter)
+
+    async def rebuild_all(self) -> None:
+        started = self._begin_rebuild()
+        filters = []
+        try:
+            async with AsyncSessionLocal() as db:
+                products = (await db.execute(select(Product.id, Product.slug))).all()
+                values: Dict[int, list] = {product_id: [] for product_id, _ in products}
+                # Архивные ключи тоже выпущены: /auth ищет их в keys_archive
+                result = await db.stream(
+                    select(Key.product_id, Key.value)
+                    .union_all(select(KeyArchive.product_id, KeyArchive.value))
+                    .execution_options(yield_per=10000)
+                )
+                async for product_id, value in result:
+                    values.setdefault(product_id, []).append(value)
+            # Хеширование миллионов значений не должно блокировать event loop
+            filters = await asyncio.to_thread(
+                lambda: [ProductKeyFilter(product_id, slug, values[product_id]) for product_id, slug in products]
+            )
+        except Exception:
+            self._finish_rebuild([], replace_all=False, started=started)
+            raise
+        self._finish_rebuild(filters, replace_all=True, started=started)
+        logger.info("Key filter built for %s products, %s keys", len(filters), sum(f.count for f in filters))
+
+    async def rebuild_product(self, product_id: int) -> None:
+        started = self._begin_rebuild()
+        filters = []
+        try:
+            async with AsyncSessionLocal() as db:
+                slug = (await db.execute(select(Product.slug).where(Product.id == product_id))).scalar()
+                if slug is not None:
+                    values = (
+                        await db.execute(
+                            select(Key.value)
+                            .where(Key.product_id == product_id)
+                            .union_all(select(KeyArchive.value).where(KeyArchive.product_id == product_id))
+                        )
+                    ).scalars().all()
+                    filters = [await asyncio.to_thread(ProductKeyFilter, product_id, slug, values)]
+        except Exception:
+            self._finish_rebuild([], replace_all=False, started=started)
+            raise
+        self._finish_rebuild(filters, replace_all=False, started=started, product_id=product_id)
+        if not filters:
+            self.drop_product(product_id)
+
+    def publish(self, db: Session, product_id: int, rebuild: bool = False) -> None:
+        """
+        NOTIFY остальным воркерам (до commit). С rebuild=True перестраивает
+        фильтр и текущий воркер: до конца перестроения фильтр продукта
+        пропускает все ключи, иначе только что добавленные получили бы отказ.
+        """
+        if rebuild:
+            self.mark_pending(product_id)
+        payload = str(product_id) if rebuild else f"{product_id}:{WORKER_ID}"
+        db.execute(notify_statement(CHANNEL, payload))
+
+    async def on_notify(self, payload: Optional[str]) -> None:
+        if payload is None:
+            # После (пере)подключения строим фильтр заново в фоне: уведомления
+            # за время разрыва потеряны, до конца перестроения фильтр не отсекает
+            with self._lock:
+                self._seq += 1
+                self._reset_seq = self._seq
+                self.ready = False
+            self._rebuild_task = asyncio.create_task(self._safe_rebuild_all(self._rebuild_task))
+            return
+        product_id, _, sender = payload.partition(":")
+        if sender == WORKER_ID or not product_id.isdigit():
+            return
+        # Ключи уже в БД, а в фильтре этого воркера их нет до конца перестроения
+        self.mark_pending(int(product_id))
+        await self.rebuild_product(int(product_id))
+
+    async def _safe_rebuild_all(self, previous: Optional[asyncio.Task] = None) -> None:
+        if previous is not None and not previous.done():
+            await asyncio.wait({previous})
+        try:
+            await self.rebuild_all()
+        except Exception as e:
+            logger.error(f"Key filter rebuild failed: {e}", exc_info=True)
+
+
+key_filter = KeyFilterStore()
+notify_listener.subscribe(CHANNEL, key_filter.on_notify)
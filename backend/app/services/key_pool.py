@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Key, KeyStatus
+from app.services import stock
+from app.services.notify import WORKER_ID
+from app.services.reservations import claim_key
+
+logger = logging.getLogger("morpheus.key_pool")
+
+Sku = Tuple[int, int]
+
+
+class KeyPool:
+    """
+    Пул заранее арендованных свободных ключей на каждый (product_id, duration_days).
+
+    Аренда — это pool_owner = WORKER_ID и reserved_until у ключа в статусе
+    available: остатки в каталоге не меняются, а другие воркеры и
+    claim_key такие ключи пропускают. Пока воркер жив, аренда продлевается;
+    при остановке ключи возвращаются явно, а после падения — сами, когда
+    истечёт reserved_until.
+    """
+
+    def __init__(self):
+        self._pools: Dict[Sku, Deque[int]] = {}
+        self._refilling: Set[Sku] = set()
+        self._tasks: set = set()
+
+    def has_keys(self, db: Session, product_id: int, duration_days: int) -> bool:
+        """Есть ли свободный ключ; при непустом пуле — без запроса к БД"""
+        sku = (product_id, duration_days)
+        if self._pools.get(sku):
+            return True
+        self._schedule_refill(sku)
+        # Тот же отбор, что у claim_statement: ключи в чужой живой аренде
+        # (в том числе прошлого процесса после падения) pop всё равно не получит
+        return db.query(
+            select(Key.id)
+            .where(
+                Key.product_id == product_id,
+                Key.duration_days == duration_days,
+                Key.status == KeyStatus.available,
+                or_(Key.pool_owner.is_(None), Key.reserved_until < datetime.utcnow()),
+            )
+            .exists()
+        ).scalar()
+
+    def pop(self, db: Session, product_id: int, duration_days: int) -> Optional[Key]:
+        """
+        Резервирует ключ под заказ (без commit), как reservations.claim_key.
+        Ключ из пула переводится в reserved одним UPDATE по первичному ключу.
+        """
+        sku = (product_id, duration_days)
+        pool = self._pools.setdefault(sku, deque())
+        now = datetime.utcnow()
+        key_id = None
+        while pool and key_id is None:
+            # Аренда могла истечь или ключ изменили в админке: тогда берём следующий
+            key_id = db.execute(
+                update(Key)
+                .where(Key.id == pool.popleft(), Key.status == KeyStatus.available, Key.pool_owner == WORKER_ID)
+                .values(
+                    status=KeyStatus.reserved,
+                    reserved_until=now + timedelta(minutes=settings.key_reservation_minutes),
+                    pool_owner=None,
+                )
+                .returning(Key.id)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+        if len(pool) < settings.key_pool_low_water:
+            self._schedule_refill(sku)
+        if key_id is None:
+            return claim_key(db, product_id, duration_days)
+        db.execute(stock.transition(product_id, duration_days, KeyStatus.available, KeyStatus.reserved))
+        return db.execute(
+            select(Key).where(Key.id == key_id).execution_options(populate_existing=True)
+        ).scalars().one()
+
+    def _schedule_refill(self, sku: Sku) -> None:
+        if settings.key_pool_size <= 0 or sku in self._refilling:
+            return
+        self._refilling.add(sku)
+        task = asyncio.get_running_loop().create_task(self._refill(sku))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self, sku: Sku) -> None:
+        try:
+            pool = self._pools.setdefault(sku, deque())
+            missing = settings.key_pool_size - len(pool)
+            if missing <= 0:
+                return
+            product_id, duration_days = sku
+            now = datetime.utcnow()
+            candidates = (
+                select(Key.id)
+                .where(
+                    Key.product_id == product_id,
+                    Key.duration_days == duration_days,
+                    Key.status == KeyStatus.available,
+                    or_(Key.pool_owner.is_(None), Key.reserved_until < now),
+                )
+                .limit(missing)
+                .with_for_update(skip_locked=True)
+            )
+            async with AsyncSessionLocal() as db:
+                key_ids = (
+                    await db.execute(
+                        update(Key)
+                        .where(Key.id.in_(candidates.scalar_subquery()))
+                        .values(
+                            pool_owner=WORKER_ID,
+                            reserved_until=now + timedelta(minutes=settings.key_pool_lease_minutes),
+                        )
+                        .returning(Key.id)
+                        .execution_options(synchronize_session=False)
+                    )
+                ).scalars().all()
+                await db.commit()
+            # renew мог уже вернуть эти ключи в пул по аренде в БД
+            present = set(pool)
+            pool.extend(key_id for key_id in key_ids if key_id not in present)
+            logger.debug("Key pool %s refilled with %s keys", sku, len(key_ids))
+        except Exception as e:
+            logger.error(f"Key pool refill for {sku} failed: {e}")
+        finally:
+            self._refilling.discard(sku)
+
+    async def renew(self) -> None:
+        """
+        Продлевает аренду ключей пула. Источник истины — аренда в БД: ключи,
+        которые у воркера забрали, из пула выкидываются, а арендованные, но
+        потерянные памятью (pop с откатом транзакции), возвращаются в пул.
+        """
+        if not self._pools:
+            return
+        async with AsyncSessionLocal() as db:
+            held = (
+                await db.execute(
+                    update(Key)
+                    .where(Key.pool_owner == WORKER_ID, Key.status == KeyStatus.available)
+                    .values(reserved_until=datetime.utcnow() + timedelta(minutes=settings.key_pool_lease_minutes))
+                    .returning(Key.id, Key.product_id, Key.duration_days)
+                    .execution_options(synchronize_session=False)
+                )
+            ).all()
+            await db.commit()
+        self._sync(held)
+
+    def _sync(self, held) -> None:
+        """Приводит пулы к аренде в БД: held — строки (key_id, product_id, duration_days)"""
+        held_skus = {key_id: (product_id, duration_days) for key_id, product_id, duration_days in held}
+        for pool in self._pools.values():
+            kept = [key_id for key_id in pool if held_skus.pop(key_id, None) is not None]
+            pool.clear()
+            pool.extend(kept)
+        for key_id, sku in held_skus.items():
+            self._pools.setdefault(sku, deque()).append(key_id)
+
+    async def release_all(self) -> None:
+        """Возвращает все ключи пула при остановке воркера"""
+        for task in list(self._tasks):
+            task.cancel()
+        self._pools.clear()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Key)
+                .where(Key.pool_owner == WORKER_ID, Key.status == KeyStatus.available)
+                .values(pool_owner=None, reserved_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        logger.info("Key pool released %s keys", result.rowcount)
+
+
+key_pool = KeyPool()
@@ -0,0 +1,76 @@
+import io
+import logging
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.utils import generate_key_values
+
+logger = logging.getLogger("morpheus.keygen")
+
+# Сгенерированные ключи добавляются в фильтр текущего воркера напрямую
+# только в небольших пачках; крупные перестраиваются всеми воркерами из БД
+KEY_FILTER_INCREMENTAL_LIMIT = 10000
+
+# Сколько раз догенерировать ключи взамен столкнувшихся с уже существующими
+MAX_TOP_UP_ROUNDS = 5
+
+_CREATE_STAGING_SQL = text(
+    "CREATE TEMP TABLE IF NOT EXISTS keygen_staging (value varchar(100) NOT NULL) ON COMMIT DROP"
+)
+
+_INSERT_FROM_STAGING_SQL = text("""
+    INSERT INTO keys (product_id, value, duration_days, status, created_at)
+    SELECT :product_id, value, :duration_days, 'available', :now FROM keygen_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM keys_archive a WHERE a.value = s.value)
+    ORDER BY value
+    ON CONFLICT (value) DO NOTHING
+    RETURNING id, value
+""")
+
+
+def insert_generated_keys(db: Session, product_id: int, duration_days: int, count: int) -> List[Tuple[int, str]]:
+    """
+    Генерирует и вставляет count свободных ключей (без commit). Возвращает (id, value).
+
+    Значения пачкой попадают через COPY во временную таблицу, а оттуда одним
+    INSERT ... ON CONFLICT DO NOTHING в keys: столкновение с существующим
+    ключом не откатывает пакет, а лишь уменьшает его, и недостающее
+    догенерируется.
+    """
+    created: List[Tuple[int, str]] = []
+    seen = set()
+    now = datetime.utcnow()
+    db.execute(_CREATE_STAGING_SQL)
+    cursor = db.connection().connection.cursor()
+    try:
+        for _ in range(MAX_TOP_UP_ROUNDS + 1):
+            missing = count - len(created)
+            if missing <= 0:
+                break
+            # Дубликаты внутри пачки отсеиваем в памяти, до обращения к БД
+            batch = [value for value in dict.fromkeys(generate_key_values(missing)) if value not in seen]
+            seen.update(batch)
+            db.execute(text("TRUNCATE keygen_staging"))
+            cursor.copy_expert("COPY keygen_staging (value) FROM STDIN", io.StringIO("\n".join(batch) + "\n"))
+            rows = db.execute(
+                _INSERT_FROM_STAGING_SQL,
+                {"product_id": product_id, "duration_days": duration_days, "now": now},
+            ).all()
+            created.extend((row.id, row.value) for row in rows)
+            if len(rows) < len(batch):
+                logger.info("Key generation: %s collisions, topping up", len(batch) - len(rows))
+    finally:
+        cursor.close()
+    if len(created) < count:
+        logger.warning("Key generation: created %s of %s keys", len(created), count)
+    return created
+
+
+def keys_csv(rows: List[Tuple[int, str]], duration_days: int, chunk_size: int = 10000) -> Iterator[str]:
+    """CSV с созданными ключами для StreamingResponse"""
+    yield "id,value,duration_days\n"
+    for i in range(0, len(rows), chunk_size):
+        yield "".join(f"{key_id},{value},{duration_days}\n" for key_id, value in rows[i:i + chunk_size])
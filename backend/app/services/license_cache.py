@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import LeaseRevocation
+from app.services.notify import notify_listener
+
+logger = logging.getLogger("morpheus.license_cache")
+
+CHANNEL = "lease_revocations"
+
+# Отзыв пишется в таблицу и рассылается воркерам в транзакции изменения ключа.
+# Заодно удаляются отзывы, которые уже ни на одну живую лизу не влияют
+_REVOKE_SQL = text("""
+    WITH pruned AS (
+        DELETE FROM lease_revocations WHERE revoked_at < :horizon
+    ), revoked AS (
+        INSERT INTO lease_revocations (product_slug, key_value, revoked_at)
+        VALUES (:product_slug, :key_value, :revoked_at)
+        ON CONFLICT (product_slug, key_value) DO UPDATE SET revoked_at = EXCLUDED.revoked_at
+        RETURNING product_slug
+    )
+    SELECT pg_notify(:channel, :payload) FROM revoked
+""")
+
+
+@dataclass(frozen=True)
+class CachedLicense:
+    """Снимок состояния активированного ключа"""
+    key_id: int
+    activation_uuid: str
+    expires_at: Optional[datetime]
+
+
+class LicenseCache:
+    """
+    Ограниченный LRU/TTL кэш активированных ключей.
+
+    Ключ кэша — (slug продукта, значение ключа). В кэш попадают только
+    активированные ключи: их состояние меняется лишь через админку,
+    импорт и вебхуки, которые явно инвалидируют запись.
+
+    Каждая инвалидация также запоминается как отзыв: лизы, выданные до
+    отзыва, при обновлении перепроверяются по БД. Изменения ключей
+    записывают отзыв в lease_revocations (revocation_statement/publish) —
+    по NOTIFY его применяют остальные воркеры, а после (пере)подключения
+    таблица перечитывается. Лизы, выданные до запуска процесса, и все лизы,
+    пока уведомления не доходят, считаются отозванными.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, CachedLicense]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._revoked_keys: dict[Tuple[str, str], float] = {}
+        self._revoked_products: dict[str, float] = {}
+        self._revoked_all_at = 0.0
+        self._started_at = time.time()
+
+    def get(self, product_slug: str, key_value: str) -> Optional[CachedLicense]:
+        # Без уведомлений запись могла устареть: изменение ключа прошло на другом воркере
+        if self.max_size <= 0 or not notify_listener.connected:
+            return None
+        cache_key = (product_slug, key_value)
+        with self._lock:
+            item = self._entries.get(cache_key)
+            if item is None:
+                return None
+            stored_at, entry = item
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry
+
+    def put(self, product_slug: str, key_value: str, entry: CachedLicense) -> None:
+        if self.max_size <= 0:
+            return
+        cache_key = (product_slug, key_value)
+        with self._lock:
+            self._entries[cache_key] = (time.monotonic(), entry)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, product_slug: str, key_value: str, revoked_at: Optional[float] = None) -> None:
+        cache_key = (product_slug, key_value)
+        revoked_at = time.time() if revoked_at is None else revoked_at
+        with self._lock:
+            self._entries.pop(cache_key, None)
+            self._revoked_keys[cache_key] = max(self._revoked_keys.get(cache_key, 0.0), revoked_at)
+            self._prune_revocations()
+
+    def invalidate_product(self, product_slug: str, revoked_at: Optional[float] = None) -> None:
+        revoked_at = time.time() if revoked_at is None else revoked_at
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == product_slug]:
+                del self._entries[cache_key]
+            self._revoked_products[product_slug] = max(self._revoked_products.get(product_slug, 0.0), revoked_at)
+
+    def clear(self, revoked_at: Optional[float] = None) -> None:
+        revoked_at = time.time() if revoked_at is None else revoked_at
+        with self._lock:
+            self._entries.clear()
+            self._revoked_keys.clear()
+            self._revoked_products.clear()
+            self._revoked_all_at = max(self._revoked_all_at, revoked_at)
+        logger.info("License cache cleared")
+
+    def revocation_statement(self, product_slug: str = "", key_value: str = ""):
+        """
+        Запрос, сохраняющий отзыв лиз ключа (без key_value — продукта, без
+        обоих — всех лиз). Выполняется в транзакции изменения, до commit.
+        """
+        now = datetime.utcnow()
+        payload = json.dumps({
+            "product": product_slug,
+            "key": key_value,
+            "at": now.replace(tzinfo=timezone.utc).timestamp(),
+        })
+        return _REVOKE_SQL.bindparams(
+            product_slug=product_slug,
+            key_value=key_value,
+            revoked_at=now,
+            horizon=now - timedelta(minutes=settings.lease_ttl_minutes),
+            channel=CHANNEL,
+            payload=payload,
+        )
+
+    def publish(self, db: Session, product_slug: str = "", key_value: str = "") -> None:
+        """revocation_statement для синхронной сессии (админка, импорт)"""
+        db.execute(self.revocation_statement(product_slug, key_value))
+
+    def _apply(self, product_slug: str, key_value: str, revoked_at: float) -> None:
+        if not product_slug:
+            self.clear(revoked_at)
+        elif not key_value:
+            self.invalidate_product(product_slug, revoked_at)
+        else:
+            self.invalidate(product_slug, key_value, revoked_at)
+
+    async def reload(self) -> None:
+        """Сбрасывает кэш и заново загружает действующие отзывы из БД"""
+        horizon = datetime.utcnow() - timedelta(minutes=settings.lease_ttl_minutes)
+        async with AsyncSessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(LeaseRevocation)
+                    .where(LeaseRevocation.revoked_at >= horizon)
+                    .order_by(LeaseRevocation.revoked_at)
+                )
+            ).scalars().all()
+        with self._lock:
+            self._entries.clear()
+        for row in rows:
+            self._apply(row.product_slug, row.key_value, row.revoked_at.replace(tzinfo=timezone.utc).timestamp())
+        logger.info("Lease revocations loaded: %s", len(rows))
+
+    async def on_notify(self, payload: Optional[str]) -> None:
+        if payload is None:
+            await self.reload()
+            return
+        try:
+            data = json.loads(payload)
+            self._apply(data["product"], data["key"], float(data["at"]))
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Malformed lease revocation: {payload!r}")
+
+    def is_revoked(self, product_slug: str, key_value: str, issued_at: float) -> bool:
+        """Был ли ключ изменён после выдачи лизы с указанным iat"""
+        # Отзывы до запуска процесса и за время разрыва с БД могли быть пропущены
+        if issued_at < self._started_at or not notify_listener.connected:
+            return True
+        with self._lock:
+            revoked_at = max(
+                self._revoked_all_at,
+                self._revoked_products.get(product_slug, 0.0),
+                self._revoked_keys.get((product_slug, key_value), 0.0),
+            )
+        # iat в JWT хранится с точностью до секунды
+        return revoked_at >= issued_at
+
+    def _prune_revocations(self) -> None:
+        # Отзывы старше максимального срока лизы больше ни на что не влияют
+        horizon = time.time() - settings.lease_ttl_minutes * 60
+        if len(self._revoked_keys) > self.max_size:
+            for cache_key, revoked_at in list(self._revoked_keys.items()):
+                if revoked_at < horizon:
+                    del self._revoked_keys[cache_key]
+
+
+license_cache = LicenseCache(
+    max_size=settings.license_cache_size,
+    ttl_seconds=settings.license_cache_ttl_seconds,
+)
+notify_listener.subscribe(CHANNEL, license_cache.on_notify)
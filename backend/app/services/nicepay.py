@@ -3,62 +3,57 @@ import logging
 import httpx
 from typing import Optional
 from app.config import settings
+from app.services.http_client import http_client
+from app.services.payment_providers import CreatedPayment, PaymentProvider, PaymentRejected, payment_providers
 
 logger = logging.getLogger("morpheus.nicepay")
 
+# Статусы платежа NicePay, после которых он уже не изменится, -> result webhook'а
+FINAL_STATUSES = {
+    "success": "success",
+    "error": "error",
+    "expired": "error",
+    "canceled": "error",
+    "cancelled": "error",
+}
 
-class NicepayClient:
+
+class NicepayClient(PaymentProvider):
     """Клиент для работы с NicePay API"""
     
-    api_url = "https://nicepay.io/public/api/payment"
+    name = "nicepay"
     
     def __init__(self):
-        # ЗАХАРДКОДИМ данные, которые точно работают в тестовом скрипте
-        self.merchant_id = "696179391f37cffbecb0afbd"
-        self.secret_key = "b4UaD-BPAK9-sinXx-41W3q-ZNctr"
-        
-        # Для отладки: сравниваем с настройками
-        settings_merchant = settings.nicepay_merchant_id.strip() if settings.nicepay_merchant_id else ""
-        settings_secret = settings.nicepay_secret_key.strip() if settings.nicepay_secret_key else ""
-        
-        logger.info(f"=== NICE PAY INIT DEBUG ===")
-        logger.info(f"Hardcoded merchant_id: {self.merchant_id}")
-        logger.info(f"Hardcoded secret: {self.secret_key[:5]}...{self.secret_key[-5:]}")
-        logger.info(f"Settings merchant_id: {settings_merchant}")
-        logger.info(f"Settings secret: {settings_secret[:5] if settings_secret else ''}...")
-        
-        if settings_merchant != self.merchant_id or settings_secret != self.secret_key:
-            logger.error(f"!!! ВНИМАНИЕ: Данные из настроек не совпадают с работающими!")
-            logger.error(f"Проверьте файл .env: NICEPAY_MERCHANT_ID и NICEPAY_SECRET_KEY")
+        self.merchant_id = settings.nicepay_merchant_id.strip()
+        self.secret_key = settings.nicepay_secret_key.strip()
+        # Базовый URL настраивается, чтобы сверку можно было прогнать против локальной заглушки
+        api_base = settings.nicepay_api_base.rstrip("/")
+        self.api_url = f"{api_base}/payment"
+        self.status_url = f"{api_base}/payment/status"
+        if not self.configured():
+            logger.warning("NicePay is not configured: set NICEPAY_MERCHANT_ID and NICEPAY_SECRET_KEY")
+
+    def configured(self) -> bool:
+        return bool(self.merchant_id and self.secret_key)
 
     async def create_payment(
         self,
         order_id: str,
-        amount: float,  # Уже в копейках/центах!
-        currency: str = "RUB",
-        customer: str = "",
+        amount_rub: float,
         description: str = "",
+        customer: str = "",
         method: Optional[str] = None,
-        success_url: Optional[str] = None,
-        fail_url: Optional[str] = None,
-    ) -> dict:
+    ) -> CreatedPayment:
         """
-        Создает платеж через NicePay API.
+        Создает платеж через NicePay API. Сумма передаётся в копейках, валюта — RUB.
         """
-        # amount уже в копейках/центах
-        amount_cents = int(amount)
-        
-        merchant_id = str(self.merchant_id).strip()
-        secret_key = str(self.secret_key).strip()
-        
-        # ТОЧНО как в тестовом запросе
         payload = {
-            "merchant_id": merchant_id,
-            "secret": secret_key,
+            "merchant_id": self.merchant_id,
+            "secret": self.secret_key,
             "order_id": str(order_id),
             "customer": str(customer),  # В тестовом скрипте использует "customer", а не "account"
-            "amount": amount_cents,
-            "currency": str(currency).upper(),
+            "amount": int(round(amount_rub * 100)),
+            "currency": "RUB",
         }
         
         # Добавляем только если переданы
@@ -67,53 +62,63 @@ class NicepayClient:
         
         # НЕ передаем method, success_url, fail_url - как в тестовом запросе
         
-        logger.info(f"=== SENDING TO NICE PAY ===")
-        logger.info(f"URL: {self.api_url}")
-        logger.info(f"Payload (без secret): { {k: v if k != 'secret' else '***' for k, v in payload.items()} }")
+        logger.debug(f"Payload (без secret): { {k: v if k != 'secret' else '***' for k, v in payload.items()} }")
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                logger.info(f"Sending POST request...")
-                response = await client.post(self.api_url, json=payload)
-                
-                logger.info(f"Response status: {response.status_code}")
-                logger.info(f"Response text: {response.text}")
-                
-                response.raise_for_status()
-                data = response.json()
+            # Общий клиент из lifespan: соединение с NicePay переиспользуется
+            response = await http_client.request("POST", self.api_url, json=payload)
             
-            if data.get("status") == "success":
-                payment_data = data.get("data", {})
-                logger.info(f"✅ Payment created successfully!")
-                logger.info(f"Order ID: {order_id}, Payment ID: {payment_data.get('payment_id')}")
-                logger.info(f"Link: {payment_data.get('link')}")
-                
-                return {
-                    "success": True,
-                    "payment_id": payment_data.get("payment_id"),
-                    "link": payment_data.get("link"),
-                    "amount": payment_data.get("amount"),
-                    "currency": payment_data.get("currency"),
-                    "expired": payment_data.get("expired"),
-                }
-            else:
-                error_msg = data.get("data", {}).get("message", "Unknown error")
-                error_code = data.get("data", {}).get("code")
-                logger.error(f"❌ NicePay API error: {error_msg} (code: {error_code})")
-                logger.error(f"Full error response: {data}")
-                raise ValueError(f"NicePay API error: {error_msg}")
-                
+            logger.info(f"Response status: {response.status_code}")
+            logger.debug(f"Response text: {response.text}")
+            
+            response.raise_for_status()
+            data = response.json()
         except httpx.RequestError as e:
             logger.error(f"❌ NicePay request error: {e}")
             raise ValueError(f"Failed to create payment: {e}")
         except httpx.HTTPStatusError as e:
             logger.error(f"❌ NicePay HTTP error: {e}")
             raise ValueError(f"Failed to create payment: HTTP {e.response.status_code}")
-        except Exception as e:
-            logger.error(f"❌ Unexpected error in create_payment: {e}", exc_info=True)
-            raise
+        
+        if data.get("status") != "success":
+            error_msg = data.get("data", {}).get("message", "Unknown error")
+            error_code = data.get("data", {}).get("code")
+            logger.error(f"❌ NicePay API error: {error_msg} (code: {error_code})")
+            raise PaymentRejected(f"NicePay API error: {error_msg}")
+        
+        payment_data = data.get("data", {})
+        if not payment_data.get("payment_id") or not payment_data.get("link"):
+            raise ValueError(f"Invalid NicePay response: {data}")
+        logger.info(f"✅ Payment created: order {order_id}, payment {payment_data['payment_id']}")
+        return CreatedPayment(provider=self.name, payment_id=payment_data["payment_id"], link=payment_data["link"])
 
-    def verify_webhook_hash(self, params: dict) -> bool:
+    async def fetch_status(self, payment_id: str) -> Optional[dict]:
+        """
+        Статус платежа для сверки: {"result": "success"|"error"|None, "status", "amount", "currency"}.
+        result None — платёж ещё не завершён. Ошибки сети пробрасываются.
+        """
+        response = await http_client.request(
+            "POST",
+            self.status_url,
+            json={"merchant_id": self.merchant_id, "secret": self.secret_key, "payment_id": payment_id},
+        )
+        logger.debug(f"Status response for {payment_id}: {response.status_code} {response.text}")
+        response.raise_for_status()
+        data = response.json()
+        if data.get("status") != "success":
+            logger.warning(f"NicePay status error for {payment_id}: {data.get('data', {}).get('message')}")
+            return None
+        payment = data.get("data", {})
+        status = str(payment.get("status", "")).lower()
+        amount = payment.get("amount")
+        return {
+            "result": FINAL_STATUSES.get(status),
+            "status": status,
+            "amount": int(amount) if str(amount).isdigit() else None,
+            "currency": payment.get("currency"),
+        }
+
+    def verify_webhook(self, params: dict) -> bool:
         """
         Проверяет подпись webhook от NicePay.
         """
@@ -135,4 +140,8 @@ class NicepayClient:
         if not is_valid:
             logger.warning(f"Invalid webhook hash. Expected: {calculated_hash}, Got: {received_hash}")
         
-        return is_valid
\ No newline at end of file
+        return is_valid
+
+
+nicepay_client = NicepayClient()
+payment_providers.register(nicepay_client)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import uuid as uuid_lib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+from sqlalchemy import text
+
+from app.config import settings
+
+logger = logging.getLogger("morpheus.notify")
+
+# Идентификатор процесса: по нему воркер узнаёт свои уведомления и свои записи в БД
+WORKER_ID = uuid_lib.uuid4().hex
+
+# Обработчик получает payload уведомления или None после (пере)подключения,
+# когда часть уведомлений могла быть пропущена и состояние нужно перечитать
+NotifyHandler = Callable[[Optional[str]], Awaitable[None]]
+
+
+def notify_statement(channel: str, payload: str):
+    """NOTIFY внутри текущей транзакции: доставляется подписчикам только после commit"""
+    return text("SELECT pg_notify(:channel, :payload)").bindparams(channel=channel, payload=payload)
+
+
+class NotifyListener:
+    """Одно выделенное соединение asyncpg, слушающее каналы Postgres LISTEN/NOTIFY"""
+
+    reconnect_delay = 5.0
+
+    def __init__(self):
+        self._handlers: Dict[str, List[NotifyHandler]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._pending: set = set()
+        # Пока соединения нет, уведомления теряются: кэши, которые держатся
+        # на NOTIFY, не должны считать себя актуальными
+        self.connected = False
+
+    def subscribe(self, channel: str, handler: NotifyHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def start(self) -> None:
+        if self._task is None and self._handlers:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(
+                    user=settings.postgres_user,
+                    password=settings.postgres_password,
+                    host=settings.postgres_host,
+                    port=settings.postgres_port,
+                    database=settings.postgres_db,
+                )
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: closed.set())
+                for channel in self._handlers:
+                    await conn.add_listener(channel, self._on_notification)
+                self.connected = True
+                logger.info("Listening on channels: %s", ", ".join(self._handlers))
+                for channel in self._handlers:
+                    await self._dispatch(channel, None)
+                await closed.wait()
+                logger.warning("Notify connection closed, reconnecting")
+            except asyncio.CancelledError:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+                raise
+            except Exception as e:
+                logger.error(f"Notify listener error: {e}")
+            finally:
+                self.connected = False
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _on_notification(self, _conn, _pid, channel: str, payload: str) -> None:
+        task = asyncio.create_task(self._dispatch(channel, payload))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, channel: str, payload: Optional[str]) -> None:
+        for handler in self._handlers.get(channel, []):
+            try:
+                await handler(payload)
+            except Exception as e:
+                logger.error(f"Notify handler for {channel} failed: {e}", exc_info=True)
+
+
+notify_listener = NotifyListener()
@@ -0,0 +1,127 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.models import Key, KeyStatus, Order, OrderStatus
+from app.services import outbox, reservations, stock
+from app.services.license_cache import license_cache
+
+logger = logging.getLogger("morpheus.orders")
+
+
+async def lock_order(db: AsyncSession, order_id: int) -> Optional[Order]:
+    """Заказ с ключом и продуктом под FOR UPDATE: параллельно его может менять sweeper"""
+    return (
+        await db.execute(
+            select(Order)
+            .options(selectinload(Order.key), selectinload(Order.product))
+            .filter_by(id=order_id)
+            .with_for_update(of=Order)
+        )
+    ).scalars().first()
+
+
+async def apply_payment_result(db: AsyncSession, order: Order, result: str, payment_id: str) -> bool:
+    """
+    Переводы заказа по итогу платежа, общие для webhook'а и сверки статусов.
+    Без commit; возвращает True, если заказ изменился — тогда после commit
+    нужно вызвать invalidate_license.
+    """
+    if result == "success":
+        if order.status == OrderStatus.paid:
+            logger.info(f"Order {order.id} already paid, skipping.")
+            return False
+        await _mark_paid(db, order, payment_id)
+        return True
+    if result == "error":
+        if order.status == OrderStatus.failed:
+            logger.info(f"Order {order.id} already failed, skipping.")
+            return False
+        await _mark_failed(db, order)
+        return True
+    logger.warning(f"Unhandled payment result: {result} for order {order.id}")
+    return False
+
+
+def invalidate_license(order: Order) -> None:
+    if order.key:
+        license_cache.invalidate(order.product.slug, order.key.value)
+
+
+async def _mark_paid(db: AsyncSession, order: Order, payment_id: str) -> None:
+    if order.key and not _holds_key(order):
+        # Заказ был отменён или провален, и его ключ мог уйти другому покупателю
+        logger.warning(
+            f"Order {order.id} was paid after it was {order.status.value}, "
+            f"key {order.key.id} is {order.key.status.value}: reserving a new key"
+        )
+        order.key = None
+    order.status = OrderStatus.paid
+    order.provider_pay_id = payment_id
+
+    if not order.key:
+        # Заказ успели отменить и снять с него ключ: резервируем новый
+        key_id = (await db.execute(
+            reservations.claim_statement(order.product_id, order.duration_days)
+        )).scalar()
+        if key_id is not None:
+            await db.execute(stock.transition(
+                order.product_id, order.duration_days, KeyStatus.available, KeyStatus.reserved
+            ))
+            order.key = (
+                await db.execute(
+                    select(Key).where(Key.id == key_id).execution_options(populate_existing=True)
+                )
+            ).scalars().one()
+            logger.info(f"Order {order.id} was paid after cancellation, reserved key {key_id}")
+        else:
+            # Выдавать нечего: заказ оплачен, ключ выдаётся вручную из админки
+            logger.error(f"Order {order.id} was paid after cancellation, but no keys are available; manual delivery required")
+            return
+
+    old_status = order.key.status
+    order.key.status = KeyStatus.sold
+    order.key.reserved_until = None
+    order.key.pool_owner = None
+    order.key.sold_at = datetime.utcnow()
+    order.key.sold_to_user_id = order.user_id
+    await db.execute(stock.transition(
+        order.key.product_id, order.key.duration_days, old_status, KeyStatus.sold
+    ))
+    logger.info(f"Order {order.id} marked as paid. Key {order.key.id} marked as sold and linked to user {order.user_id}.")
+
+    # Выдачу ключа фиксируем в той же транзакции, а отправляет её
+    # OutboxDispatcher: ответ платёжной системе не ждёт Telegram
+    await db.execute(outbox.enqueue(db, outbox.ORDER_DELIVERY, {"order_id": order.id}))
+    logger.info(f"Order {order.id} delivery queued")
+
+
+def _holds_key(order: Order) -> bool:
+    """
+    Принадлежит ли ключ заказу. Резерв живого заказа — его; ключ отменённого
+    или проваленного заказа вернулся в продажу и свободен, только пока его
+    никто не зарезервировал, не купил и не активировал.
+    """
+    if order.status in (OrderStatus.pending, OrderStatus.waiting):
+        return order.key.status in (KeyStatus.reserved, KeyStatus.available)
+    return order.key.status == KeyStatus.available
+
+
+async def _mark_failed(db: AsyncSession, order: Order) -> None:
+    order.status = OrderStatus.failed
+
+    # Возвращаем ключ в доступные, если платеж не прошел
+    if order.key and order.key.status in (KeyStatus.reserved, KeyStatus.sold):
+        old_status = order.key.status
+        order.key.status = KeyStatus.available
+        order.key.reserved_until = None
+        order.key.sold_at = None
+        order.key.sold_to_user_id = None
+        await db.execute(stock.transition(
+            order.key.product_id, order.key.duration_days, old_status, KeyStatus.available
+        ))
+        logger.info(f"Order {order.id} marked as failed. Key {order.key.id} reverted to available.")
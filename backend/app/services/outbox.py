@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import OutboxMessage
+from app.services.notify import notify_listener, notify_statement
+
+logger = logging.getLogger("morpheus.outbox")
+
+OUTBOX_CHANNEL = "outbox"
+
+# Виды сообщений
+ORDER_DELIVERY = "order_delivery"
+
+# Сколько сообщений воркер забирает за один запрос
+OUTBOX_BATCH_SIZE = 50
+# Сколько держится захват сообщения: после падения воркера его подхватит другой
+OUTBOX_LOCK_SECONDS = 300
+
+OutboxHandler = Callable[[dict], Awaitable[None]]
+
+_CLAIM_SQL = text("""
+    UPDATE outbox_messages SET attempts = attempts + 1, locked_until = :locked_until
+    WHERE id IN (
+        SELECT id FROM outbox_messages
+        WHERE sent_at IS NULL AND attempts < :max_attempts AND available_at <= :now
+          AND (locked_until IS NULL OR locked_until < :now)
+        ORDER BY id
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload, attempts
+""")
+
+
+def enqueue(db, kind: str, payload: dict):
+    """
+    Добавляет сообщение в текущую транзакцию (Session или AsyncSession, без commit).
+    Возвращает NOTIFY, который нужно выполнить в той же транзакции:
+    он разбудит диспетчеры воркеров сразу после commit.
+    """
+    db.add(OutboxMessage(kind=kind, payload=payload))
+    return notify_statement(OUTBOX_CHANNEL, kind)
+
+
+class OutboxDispatcher:
+    """
+    Выполняет сообщения outbox_messages: не больше OUTBOX_CONCURRENCY
+    одновременно, с повтором по экспоненциальной паузе до OUTBOX_MAX_ATTEMPTS.
+    Доставка «хотя бы один раз»: при падении между выполнением и отметкой
+    сообщение выполнится повторно.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, OutboxHandler] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def register(self, kind: str, handler: OutboxHandler) -> None:
+        self._handlers[kind] = handler
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def on_notify(self, _payload: Optional[str]) -> None:
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.outbox_poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.drain() >= OUTBOX_BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}", exc_info=True)
+
+    async def drain(self) -> int:
+        """Забирает и выполняет одну пачку сообщений; возвращает её размер"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            messages = (
+                await db.execute(
+                    _CLAIM_SQL,
+                    {
+                        "now": now,
+                        "locked_until": now + timedelta(seconds=OUTBOX_LOCK_SECONDS),
+                        "max_attempts": settings.outbox_max_attempts,
+                        "batch": OUTBOX_BATCH_SIZE,
+                    },
+                )
+            ).all()
+            await db.commit()
+        if not messages:
+            return 0
+
+        semaphore = asyncio.Semaphore(settings.outbox_concurrency)
+
+        async def process(message) -> Optional[str]:
+            handler = self._handlers.get(message.kind)
+            if handler is None:
+                return f"No handler for {message.kind}"
+            async with semaphore:
+                try:
+                    await handler(message.payload)
+                except Exception as e:
+                    return repr(e)
+            return None
+
+        errors = await asyncio.gather(*(process(message) for message in messages))
+        await self._finish(messages, errors)
+        return len(messages)
+
+    async def _finish(self, messages, errors) -> None:
+        now = datetime.utcnow()
+        sent, failed = [], []
+        for message, error in zip(messages, errors):
+            if error is None:
+                sent.append(message.id)
+                continue
+            # Пауза растёт вдвое с каждой попыткой, с разбросом, чтобы повторы не шли стеной
+            delay = min(settings.outbox_retry_base_seconds * 2 ** (message.attempts - 1), 3600)
+            failed.append({
+                "id": message.id,
+                "available_at": now + timedelta(seconds=delay * random.uniform(0.5, 1.0)),
+                "last_error": error[:1000],
+            })
+            log = logger.error if message.attempts >= settings.outbox_max_attempts else logger.warning
+            log(f"Outbox message {message.id} ({message.kind}) attempt {message.attempts} failed: {error}")
+        async with AsyncSessionLocal() as db:
+            if sent:
+                await db.execute(
+                    text("UPDATE outbox_messages SET sent_at = :now, locked_until = NULL WHERE id = ANY(:ids)"),
+                    {"now": now, "ids": sent},
+                )
+            if failed:
+                await db.execute(
+                    text(
+                        "UPDATE outbox_messages SET available_at = :available_at, last_error = :last_error, "
+                        "locked_until = NULL WHERE id = :id"
+                    ),
+                    failed,
+                )
+            await db.commit()
+
+
+outbox_dispatcher = OutboxDispatcher()
+notify_listener.subscribe(OUTBOX_CHANNEL, outbox_dispatcher.on_notify)
@@ -0,0 +1,36 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import PaymentEvent
+
+
+def record_statement(
+    provider: str,
+    payment_id: str,
+    result: str,
+    order_id: Optional[int] = None,
+    amount: Optional[int] = None,
+    currency: Optional[str] = None,
+    payload: Optional[dict] = None,
+):
+    """
+    INSERT события в журнал; RETURNING id пуст, если такое событие уже было.
+    Выполняется в транзакции обработки: при откате повтор не считается дублем.
+    """
+    return (
+        insert(PaymentEvent)
+        .values(
+            provider=provider,
+            payment_id=payment_id,
+            result=result,
+            order_id=order_id,
+            amount=amount,
+            currency=currency,
+            payload=payload,
+            received_at=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(constraint="uq_payment_events_provider_payment_result")
+        .returning(PaymentEvent.id)
+    )
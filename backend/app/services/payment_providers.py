@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger("morpheus.payment_providers")
+
+
+class PaymentRejected(ValueError):
+    """
+    Платёжная система ответила отказом на корректный запрос (бизнес-ошибка).
+    Система при этом исправна: breaker такую ошибку не считает.
+    """
+
+
+@dataclass
+class CreatedPayment:
+    provider: str
+    payment_id: str
+    link: str
+
+
+class PaymentProvider(ABC):
+    """
+    Общий интерфейс платёжной системы. fetch_status возвращает
+    {"result": "success"|"error"|None, "status", "amount", "currency"};
+    result None — платёж ещё не завершён.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def configured(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def create_payment(
+        self,
+        order_id: str,
+        amount_rub: float,
+        description: str,
+        customer: str,
+        method: Optional[str] = None,
+    ) -> CreatedPayment:
+        ...
+
+    @abstractmethod
+    def verify_webhook(self, params: dict) -> bool:
+        ...
+
+    @abstractmethod
+    async def fetch_status(self, payment_id: str) -> Optional[dict]:
+        ...
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд провайдер считается недоступным
+    на reset_seconds; затем пропускается одна пробная попытка (half-open).
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Завершает пробный вызов (вызывается в finally). Если пробу прервали
+        (отмена задачи, отключение клиента) и исход не записан, следующий
+        вызов снова сможет стать пробным, а не получит отказ навсегда.
+        """
+        self._probing = False
+
+
+class ProviderRegistry:
+    """
+    Платёжные системы в порядке приоритета PAYMENT_PROVIDERS. У каждой два
+    CircuitBreaker'а: на создание платежей и на запросы статуса для сверки,
+    чтобы сбои фоновой сверки не отключали систему для покупателей.
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, PaymentProvider] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._status_breakers: Dict[str, CircuitBreaker] = {}
+
+    def register(self, provider: PaymentProvider) -> None:
+        self._providers[provider.name] = provider
+        self._breakers[provider.name] = CircuitBreaker(
+            settings.payment_breaker_failures, settings.payment_breaker_reset_seconds
+        )
+        self._status_breakers[provider.name] = CircuitBreaker(
+            settings.payment_breaker_failures, settings.payment_breaker_reset_seconds
+        )
+
+    def get(self, name: str) -> Optional[PaymentProvider]:
+        return self._providers.get(name)
+
+    def ordered(self) -> List[PaymentProvider]:
+        names = [name.strip() for name in settings.payment_providers.split(",") if name.strip()]
+        return [self._providers[name] for name in names if name in self._providers and self._providers[name].configured()]
+
+    def available(self) -> bool:
+        """Есть ли платёжная система, которую не отключил breaker"""
+        return any(self._breakers[provider.name].state != "open" for provider in self.ordered())
+
+    async def create_payment(
+        self,
+        order_id: str,
+        amount_rub: float,
+        description: str,
+        customer: str,
+        method: Optional[str] = None,
+    ) -> CreatedPayment:
+        """
+        Создаёт платёж у первой доступной системы. Систему с разомкнутым
+        breaker'ом пропускаем сразу, а не ждём её таймаута.
+        """
+        errors = []
+        for provider in self.ordered():
+            breaker = self._breakers[provider.name]
+            probe = breaker.state == "half_open"
+            if not breaker.allow():
+                errors.append(f"{provider.name}: circuit open")
+                continue
+            try:
+                created = await asyncio.wait_for(
+                    provider.create_payment(order_id, amount_rub, description, customer, method),
+                    timeout=settings.payment_create_timeout_seconds,
+                )
+            except PaymentRejected as e:
+                # Система ответила, то есть исправна; отказ пробуем обойти следующей
+                breaker.record_success()
+                logger.warning(f"Payment provider {provider.name} rejected order {order_id}: {e}")
+                errors.append(f"{provider.name}: {e}")
+                continue
+            except Exception as e:
+                breaker.record_failure()
+                logger.warning(f"Payment provider {provider.name} failed for order {order_id}: {e!r}")
+                errors.append(f"{provider.name}: {e}")
+                continue
+            finally:
+                if probe:
+                    breaker.release()
+            breaker.record_success()
+            return created
+        raise ValueError("No payment provider available (" + "; ".join(errors) + ")")
+
+    async def fetch_status(self, provider_name: str, payment_id: str) -> Optional[dict]:
+        """Статус платежа через breaker провайдера; None, если узнать его сейчас нельзя"""
+        provider = self._providers.get(provider_name)
+        breaker = self._status_breakers.get(provider_name)
+        if provider is None or not provider.configured():
+            return None
+        probe = breaker.state == "half_open"
+        if not breaker.allow():
+            return None
+        try:
+            status = await provider.fetch_status(payment_id)
+        except Exception as e:
+            breaker.record_failure()
+            logger.warning(f"{provider_name} status for {payment_id} failed: {e!r}")
+            return None
+        finally:
+            if probe:
+                breaker.release()
+        breaker.record_success()
+        return status
+
+    def health(self) -> List[dict]:
+        return [
+            {
+                "name": name,
+                "configured": provider.configured(),
+                "state": self._breakers[name].state,
+                "failures": self._breakers[name].failures,
+                "status_state": self._status_breakers[name].state,
+                "status_failures": self._status_breakers[name].failures,
+            }
+            for name, provider in self._providers.items()
+        ]
+
+
+payment_providers = ProviderRegistry()
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import async_engine
+
+logger = logging.getLogger("morpheus.rate_limit")
+
+
+@dataclass(frozen=True)
+class BucketSpec:
+    """Бакет: имя, ёмкость (всплеск) и скорость пополнения в токенах/сек"""
+    name: str
+    capacity: float
+    rate: float
+
+
+class LocalBucketStore:
+    """Token bucket'ы в памяти процесса, ограниченные по числу (LRU)"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, specs: List[BucketSpec], cost: float = 1.0) -> bool:
+        """Списывает токен из всех бакетов сразу или не списывает ни из одного"""
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for spec in specs:
+                tokens, updated = self._buckets.get(spec.name, (spec.capacity, now))
+                tokens = min(spec.capacity, tokens + (now - updated) * spec.rate)
+                if tokens < cost:
+                    return False
+                levels.append(tokens)
+            for spec, tokens in zip(specs, levels):
+                self._buckets[spec.name] = (tokens - cost, now)
+                self._buckets.move_to_end(spec.name)
+            # Вытесненный бакет просто начинается заново полным
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+            return True
+
+
+# Один запрос на все бакеты, всё или ничего, как LocalBucketStore.consume:
+# существующие строки блокируются (в порядке имён, чтобы не ловить deadlock)
+# и проверяются вместе, а списание идёт, только если токенов хватает во всех.
+# Отсутствующий бакет считается полным. Если его параллельно создал другой
+# запрос, списание ложится поверх и может на один токен уйти в минус.
+_CONSUME_SQL = text(
+    """
+    WITH spec AS (
+        SELECT * FROM unnest(CAST(:buckets AS text[]), CAST(:capacities AS float8[]), CAST(:rates AS float8[]))
+            AS spec(bucket, capacity, rate)
+    ), locked AS (
+        SELECT b.bucket, b.tokens, b.updated_at
+        FROM rate_limit_buckets b
+        WHERE b.bucket IN (SELECT bucket FROM spec)
+        ORDER BY b.bucket
+        FOR UPDATE
+    ), verdict AS (
+        SELECT COALESCE(bool_and(
+            LEAST(spec.capacity, locked.tokens + EXTRACT(EPOCH FROM clock_timestamp() - locked.updated_at) * spec.rate)
+                >= :cost
+        ), true) AS granted
+        FROM spec JOIN locked USING (bucket)
+    ), consumed AS (
+        INSERT INTO rate_limit_buckets AS b (bucket, tokens, capacity, rate, updated_at)
+        SELECT spec.bucket, spec.capacity - :cost, spec.capacity, spec.rate, clock_timestamp()
+        FROM spec
+        WHERE (SELECT granted FROM verdict)
+        ON CONFLICT (bucket) DO UPDATE SET
+            tokens = LEAST(
+                EXCLUDED.capacity,
+                b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * EXCLUDED.rate
+            ) - :cost,
+            capacity = EXCLUDED.capacity,
+            rate = EXCLUDED.rate,
+            updated_at = clock_timestamp()
+        RETURNING b.bucket
+    )
+    SELECT granted FROM verdict
+    """
+)
+
+# Бакет, не тронутый час, всё равно полон: строку можно удалить
+_PRUNE_SQL = text("DELETE FROM rate_limit_buckets WHERE updated_at < clock_timestamp() - interval '1 hour'")
+
+
+class PostgresBucketStore:
+    """Общие для всех воркеров бакеты в таблице rate_limit_buckets"""
+
+    prune_interval = 600.0
+
+    def __init__(self):
+        self._last_prune = time.monotonic()
+
+    async def consume(self, specs: List[BucketSpec], cost: float = 1.0) -> bool:
+        params = {
+            "buckets": [spec.name for spec in specs],
+            "capacities": [float(spec.capacity) for spec in specs],
+            "rates": [float(spec.rate) for spec in specs],
+            "cost": float(cost),
+        }
+        try:
+            async with async_engine.begin() as conn:
+                granted = (await conn.execute(_CONSUME_SQL, params)).scalar()
+                if time.monotonic() - self._last_prune > self.prune_interval:
+                    self._last_prune = time.monotonic()
+                    await conn.execute(_PRUNE_SQL)
+        except Exception as e:
+            # Лимитер не должен ронять авторизацию: остаёмся на локальных бакетах
+            logger.error(f"Shared rate limit check failed: {e}")
+            return True
+        return bool(granted)
+
+
+class RateLimiter:
+    """
+    Лимитер запросов /api/{slug}/auth по ключу, uuid и IP клиента.
+
+    Общие бакеты (backend=postgres) проверяются только после локальных:
+    клиент, долбящий API в цикле, отсекается без единого соединения из пула.
+    """
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._local = LocalBucketStore()
+        self._shared: Optional[PostgresBucketStore] = PostgresBucketStore() if backend == "postgres" else None
+
+    async def consume(self, specs: List[BucketSpec], cost: float = 1.0) -> bool:
+        if not self._local.consume(specs, cost):
+            return False
+        if self._shared is not None:
+            return await self._shared.consume(specs, cost)
+        return True
+
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_proxy:
+        real_ip = request.headers.get("x-real-ip")
+        if real_ip:
+            return real_ip.strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _auth_buckets(request: Request, product_slug: str, payload) -> List[BucketSpec]:
+    key_rate = settings.rate_limit_key_per_minute / 60.0
+    specs = [
+        BucketSpec(f"ip:{client_ip(request)}", settings.rate_limit_ip_burst, settings.rate_limit_ip_per_minute / 60.0)
+    ]
+    if isinstance(payload, dict):
+        # Значения приходят от клиента как есть: длину ограничиваем, чтобы не раздувать бакеты
+        key_value = payload.get("key")
+        uuid = payload.get("uuid")
+        if isinstance(key_value, str) and key_value:
+            specs.append(BucketSpec(f"key:{product_slug}:{key_value[:128]}", settings.rate_limit_key_burst, key_rate))
+        if isinstance(uuid, str) and uuid:
+            specs.append(BucketSpec(f"uuid:{product_slug}:{uuid[:128]}", settings.rate_limit_key_burst, key_rate))
+    return specs
+
+
+async def limit_auth(request: Request, product_slug: str) -> None:
+    """Зависимость для /auth: 429 до любой работы с БД"""
+    if not settings.rate_limit_enabled:
+        return
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    if not await rate_limiter.consume(_auth_buckets(request, product_slug, payload)):
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": "1"})
+
+
+async def limit_batch_auth(request: Request) -> None:
+    """
+    Зависимость для /auth/batch: свой бакет по IP (batch-ip:) с постоянной
+    ёмкостью RATE_LIMIT_BATCH_IP_BURST, каждая пара из пакета стоит токен.
+    С бакетом ip: у /auth он не пересекается: ёмкость не зависит от того,
+    какой эндпоинт обратился к бакету первым.
+    """
+    if not settings.rate_limit_enabled:
+        return
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    items = payload.get("items") if isinstance(payload, dict) else None
+    capacity = settings.rate_limit_batch_ip_burst
+    # Пакет больше ёмкости всё равно отклонит эндпоинт (400), а не лимитер
+    cost = min(max(1, len(items)), capacity) if isinstance(items, list) else 1
+    ip_bucket = BucketSpec(
+        f"batch-ip:{client_ip(request)}",
+        capacity,
+        settings.rate_limit_batch_ip_per_minute / 60.0,
+    )
+    if not await rate_limiter.consume([ip_bucket], cost):
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": "1"})
+
+
+rate_limiter = RateLimiter(settings.rate_limit_backend)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Order, OrderStatus
+from app.services import orders, payment_events
+from app.services.payment_providers import payment_providers
+
+logger = logging.getLogger("morpheus.reconciler")
+
+# Заказов в одной странице: столько статусов запрашивается, прежде чем читать следующую
+RECONCILE_PAGE_SIZE = 200
+# Сверку в каждый момент ведёт один воркер, чтобы не умножать запросы к платёжным системам
+RECONCILE_LOCK_ID = 0x6D6F7270
+
+
+async def reconcile_waiting_orders() -> Dict[str, int]:
+    """
+    Сверяет заказы в статусе waiting со статусом платежа у их платёжной
+    системы — на случай потерянного webhook'а. Заказы с платежом, которые
+    sweeper отменил за последние RECONCILE_LOOKBACK_HOURS, тоже сверяются:
+    покупатель мог оплатить после отмены. Заказы читаются страницами по id,
+    статусы запрашиваются не больше RECONCILE_CONCURRENCY одновременно через
+    общий HTTP-клиент, а завершённые платежи проводятся тем же переходом, что и в webhook.
+    """
+    counts = {"checked": 0, "paid": 0, "failed": 0}
+    async with AsyncSessionLocal() as lock_db:
+        # Блокировка держится до конца транзакции lock_db, то есть всей сверки
+        if not (await lock_db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": RECONCILE_LOCK_ID})).scalar():
+            return counts
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=settings.reconcile_min_age_seconds)
+        lookback = now - timedelta(hours=settings.reconcile_lookback_hours)
+        semaphore = asyncio.Semaphore(settings.reconcile_concurrency)
+        last_id = 0
+        while True:
+            page = await _waiting_page(last_id, cutoff, lookback)
+            if not page:
+                break
+            last_id = page[-1][0]
+            statuses = await asyncio.gather(
+                *(_fetch_status(semaphore, provider, pay_id) for _, provider, pay_id, _ in page)
+            )
+            counts["checked"] += len(page)
+            for (order_id, provider, pay_id, order_status), status in zip(page, statuses):
+                if not status or not status["result"]:
+                    continue
+                # Отменённому заказу важна только оплата: отказ ничего не меняет
+                if order_status == OrderStatus.cancelled and status["result"] != "success":
+                    continue
+                if await _apply(order_id, provider, pay_id, status):
+                    counts["paid" if status["result"] == "success" else "failed"] += 1
+            if len(page) < RECONCILE_PAGE_SIZE:
+                break
+        await lock_db.rollback()
+    if counts["paid"] or counts["failed"]:
+        logger.info(
+            "Reconciled %s waiting orders: %s paid, %s failed",
+            counts["checked"],
+            counts["paid"],
+            counts["failed"],
+        )
+    return counts
+
+
+async def _waiting_page(
+    last_id: int, cutoff: datetime, lookback: datetime
+) -> List[Tuple[int, str, str, OrderStatus]]:
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(Order.id, Order.provider, Order.provider_pay_id, Order.status)
+            .where(
+                or_(
+                    Order.status == OrderStatus.waiting,
+                    and_(Order.status == OrderStatus.cancelled, Order.updated_at >= lookback),
+                ),
+                Order.provider_pay_id.is_not(None),
+                # Ссылку подготовленного заранее заказа покупатель ещё не видел
+                Order.speculative.is_(False),
+                Order.created_at < cutoff,
+                Order.id > last_id,
+            )
+            .order_by(Order.id)
+            .limit(RECONCILE_PAGE_SIZE)
+        )
+        return [tuple(row) for row in rows]
+
+
+async def _fetch_status(semaphore: asyncio.Semaphore, provider: str, payment_id: str) -> Optional[dict]:
+    async with semaphore:
+        return await payment_providers.fetch_status(provider, payment_id)
+
+
+async def _apply(order_id: int, provider: str, payment_id: str, status: dict) -> bool:
+    async with AsyncSessionLocal() as db:
+        # Тот же журнал, что у webhook'а: кто бы ни пришёл вторым, он увидит дубль
+        event_id = (
+            await db.execute(
+                payment_events.record_statement(
+                    provider,
+                    payment_id,
+                    status["result"],
+                    order_id=order_id,
+                    amount=status["amount"],
+                    currency=status["currency"],
+                    payload={"source": "reconcile", "status": status["status"]},
+                )
+            )
+        ).scalar()
+        if event_id is None:
+            return False
+        # Статус заказа не проверяем: его мог отменить sweeper, а оплату после
+        # отмены проводит apply_payment_result — так же, как в webhook'е.
+        # Иначе событие осталось бы в журнале непроведённым, а пришедший
+        # следом webhook отсёкся бы как дубль
+        order = await orders.lock_order(db, order_id)
+        changed = False
+        if order:
+            changed = await orders.apply_payment_result(db, order, status["result"], payment_id)
+        await db.commit()
+        if changed:
+            orders.invalidate_license(order)
+            logger.info(f"Order {order_id} reconciled as {status['result']} ({provider} status {status['status']})")
+        return changed
@@ -0,0 +1,69 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Key, KeyStatus
+from app.services import stock
+
+logger = logging.getLogger("morpheus.reservations")
+
+
+def claim_statement(product_id: int, duration_days: int):
+    """
+    UPDATE, резервирующий один свободный ключ и возвращающий его id.
+
+    Кандидат выбирается с FOR UPDATE SKIP LOCKED: параллельные покупатели
+    не ждут друг друга и не получают один и тот же ключ. Ключ переходит
+    в статус reserved до reserved_until. Ключи из пулов воркеров пропускаются,
+    пока не истекла их аренда.
+    """
+    now = datetime.utcnow()
+    candidate = (
+        select(Key.id)
+        .where(
+            Key.product_id == product_id,
+            Key.duration_days == duration_days,
+            Key.status == KeyStatus.available,
+            or_(Key.pool_owner.is_(None), Key.reserved_until < now),
+        )
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(Key)
+        .where(Key.id == candidate)
+        .values(
+            status=KeyStatus.reserved,
+            reserved_until=now + timedelta(minutes=settings.key_reservation_minutes),
+            pool_owner=None,
+        )
+        .returning(Key.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def claim_key(db: Session, product_id: int, duration_days: int) -> Optional[Key]:
+    """Резервирует свободный ключ под новый заказ (без commit)"""
+    key_id = db.execute(claim_statement(product_id, duration_days)).scalar()
+    if key_id is None:
+        return None
+    db.execute(stock.transition(product_id, duration_days, KeyStatus.available, KeyStatus.reserved))
+    # populate_existing: объект мог уже лежать в сессии со старым статусом
+    return db.execute(
+        select(Key).where(Key.id == key_id).execution_options(populate_existing=True)
+    ).scalars().one()
+
+
+def release_key(db: Session, key: Key) -> bool:
+    """Возвращает зарезервированный ключ в продажу (без commit)"""
+    if key.status != KeyStatus.reserved:
+        return False
+    key.status = KeyStatus.available
+    key.reserved_until = None
+    db.execute(stock.transition(key.product_id, key.duration_days, KeyStatus.reserved, KeyStatus.available))
+    return True
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import and_, func, select
+
+from app.database import SessionLocal
+from app.models import KeyStock, Product, ProductPrice
+from app.services import keygen, stock
+from app.services.key_filter import key_filter
+
+logger = logging.getLogger("morpheus.restock")
+
+# Сколько ключей одна позиция получает за запуск: большой недобор
+# закрывается за несколько запусков, не держа транзакцию минутами
+RESTOCK_MAX_BATCH = 100_000
+
+# Отчёт последнего запуска в этом воркере, для /admin/stock/restock
+last_report: Optional[dict] = None
+
+
+def _available_column():
+    return func.coalesce(KeyStock.available, 0)
+
+
+def _stock_join():
+    return and_(KeyStock.product_id == ProductPrice.product_id, KeyStock.duration_days == ProductPrice.duration_days)
+
+
+def restock_low_stock() -> dict:
+    """
+    Догенерирует ключи до target_stock для позиций (продукт, срок), у которых
+    свободных ключей меньше restock_threshold. Каждая позиция — отдельная
+    транзакция, а строка цены блокируется SKIP LOCKED: параллельный запуск
+    в другом воркере ту же позицию пропускает.
+    """
+    global last_report
+    started_at = datetime.utcnow()
+    with SessionLocal() as db:
+        price_ids = db.execute(
+            select(ProductPrice.id)
+            .join(Product, Product.id == ProductPrice.product_id)
+            .outerjoin(KeyStock, _stock_join())
+            .where(
+                Product.is_active == True,  # noqa: E712
+                ProductPrice.target_stock > 0,
+                _available_column() < ProductPrice.restock_threshold,
+            )
+        ).scalars().all()
+    items: List[dict] = []
+    for price_id in price_ids:
+        try:
+            item = _restock_price(price_id)
+        except Exception as e:
+            logger.error(f"Restock of price {price_id} failed: {e}")
+            continue
+        if item:
+            items.append(item)
+    last_report = {"started_at": started_at, "finished_at": datetime.utcnow(), "items": items}
+    if items:
+        logger.info("Restocked %s keys for %s SKUs", sum(item["generated"] for item in items), len(items))
+    return last_report
+
+
+def _restock_price(price_id: int) -> Optional[dict]:
+    with SessionLocal() as db:
+        row = db.execute(
+            select(ProductPrice.product_id, ProductPrice.duration_days, ProductPrice.target_stock, ProductPrice.restock_threshold)
+            .where(ProductPrice.id == price_id)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if row is None:
+            return None
+        # Остаток перечитываем под блокировкой: его мог пополнить другой воркер
+        available = db.execute(
+            select(_available_column())
+            .select_from(ProductPrice)
+            .outerjoin(KeyStock, _stock_join())
+            .where(ProductPrice.id == price_id)
+        ).scalar()
+        if available >= row.restock_threshold:
+            return None
+        count = min(row.target_stock - available, RESTOCK_MAX_BATCH)
+        if count <= 0:
+            return None
+        created = keygen.insert_generated_keys(db, row.product_id, row.duration_days, count)
+        db.execute(stock.stock_delta(row.product_id, row.duration_days, available=len(created)))
+        rebuild = len(created) > keygen.KEY_FILTER_INCREMENTAL_LIMIT
+        key_filter.publish(db, row.product_id, rebuild=rebuild)
+        db.commit()
+    if not rebuild and key_filter.add_values(row.product_id, [value for _, value in created]):
+        with SessionLocal() as db:
+            key_filter.publish(db, row.product_id, rebuild=True)
+            db.commit()
+    return {
+        "product_id": row.product_id,
+        "duration_days": row.duration_days,
+        "available": available,
+        "generated": len(created),
+    }
+
+
+async def restock_job() -> None:
+    """Обёртка для планировщика: генерация и COPY идут через синхронный драйвер"""
+    await asyncio.to_thread(restock_low_stock)
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger("morpheus.scheduler")
+
+JobFunc = Callable[[], Awaitable[None]]
+
+
+@dataclass
+class PeriodicJob:
+    name: str
+    interval: float
+    func: JobFunc
+    task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    """
+    Периодические фоновые задачи внутри процесса API.
+
+    Задачи запускаются в каждом воркере, поэтому сами должны быть
+    безопасны при параллельном запуске (SKIP LOCKED, условные UPDATE).
+    """
+
+    def __init__(self):
+        self._jobs: List[PeriodicJob] = []
+
+    def add_job(self, name: str, interval: float, func: JobFunc) -> None:
+        self._jobs.append(PeriodicJob(name=name, interval=interval, func=func))
+
+    async def start(self) -> None:
+        for job in self._jobs:
+            if job.task is None and job.interval > 0:
+                job.task = asyncio.create_task(self._run(job))
+                logger.info("Scheduled job %s every %ss", job.name, job.interval)
+
+    async def stop(self) -> None:
+        for job in self._jobs:
+            if job.task:
+                job.task.cancel()
+                try:
+                    await job.task
+                except asyncio.CancelledError:
+                    pass
+                job.task = None
+
+    async def _run(self, job: PeriodicJob) -> None:
+        # Разносим первые запуски воркеров, чтобы они не шли в БД одновременно
+        await asyncio.sleep(random.uniform(0, min(job.interval, 10)))
+        while True:
+            try:
+                await job.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.name} failed: {e}", exc_info=True)
+            await asyncio.sleep(job.interval)
+
+
+scheduler = Scheduler()
@@ -0,0 +1,111 @@
+from collections import Counter
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import delete, text
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import KeyStatus, KeyStock
+
+# В какой счётчик key_stock попадает ключ с данным статусом.
+# Активированные и истёкшие ключи остаются проданными.
+STOCK_BUCKETS = {
+    KeyStatus.available: "available",
+    KeyStatus.reserved: "reserved",
+    KeyStatus.sold: "sold",
+    KeyStatus.activated: "sold",
+    KeyStatus.expired: "sold",
+}
+
+
+def stock_delta(product_id: int, duration_days: int, available: int = 0, reserved: int = 0, sold: int = 0):
+    """UPSERT, сдвигающий счётчики key_stock; выполняется в транзакции изменения ключей"""
+    stmt = insert(KeyStock).values(
+        product_id=product_id,
+        duration_days=duration_days,
+        available=available,
+        reserved=reserved,
+        sold=sold,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[KeyStock.product_id, KeyStock.duration_days],
+        set_={
+            "available": KeyStock.available + available,
+            "reserved": KeyStock.reserved + reserved,
+            "sold": KeyStock.sold + sold,
+        },
+    )
+
+
+def transition(
+    product_id: int,
+    duration_days: int,
+    old_status: Optional[KeyStatus],
+    new_status: Optional[KeyStatus],
+    count: int = 1,
+):
+    """
+    Изменение остатков при смене статуса ключа. None вместо статуса означает,
+    что ключа не было (создание) или больше нет (удаление).
+    Возвращает None, если счётчики не меняются.
+    """
+    statements = bulk_deltas([(product_id, duration_days, old_status, new_status)], count)
+    return statements[0] if statements else None
+
+
+def bulk_deltas(changes: Iterable[Tuple[int, int, Optional[KeyStatus], Optional[KeyStatus]]], count: int = 1):
+    """Сворачивает набор переходов (product_id, duration_days, old, new) в минимум UPSERT'ов"""
+    counter: Counter = Counter()
+    for product_id, duration_days, old_status, new_status in changes:
+        old_bucket = STOCK_BUCKETS.get(old_status) if old_status else None
+        new_bucket = STOCK_BUCKETS.get(new_status) if new_status else None
+        if old_bucket == new_bucket:
+            continue
+        if old_bucket:
+            counter[(product_id, duration_days, old_bucket)] -= count
+        if new_bucket:
+            counter[(product_id, duration_days, new_bucket)] += count
+    grouped: dict = {}
+    for (product_id, duration_days, bucket), delta in counter.items():
+        if delta:
+            grouped.setdefault((product_id, duration_days), {})[bucket] = delta
+    return [stock_delta(product_id, duration_days, **deltas) for (product_id, duration_days), deltas in grouped.items()]
+
+
+def clear_product_stock(product_id: int):
+    return delete(KeyStock).where(KeyStock.product_id == product_id)
+
+
+# Полный пересчёт из таблицы keys. Счётчики заполняет миграция 0003 и дальше
+# ведут stock_delta; пересчёт нужен только для ремонта дрейфа — см. rebuild
+REBUILD_STOCK_SQL = text("""
+    WITH counts AS (
+        SELECT product_id, duration_days,
+               count(*) FILTER (WHERE status::text = 'available') AS available,
+               count(*) FILTER (WHERE status::text = 'reserved') AS reserved,
+               count(*) FILTER (WHERE status::text IN ('sold', 'activated', 'expired')) AS sold
+        FROM keys
+        GROUP BY product_id, duration_days
+    ), cleared AS (
+        DELETE FROM key_stock ks
+        WHERE NOT EXISTS (
+            SELECT 1 FROM counts c
+            WHERE c.product_id = ks.product_id AND c.duration_days = ks.duration_days
+        )
+    )
+    INSERT INTO key_stock (product_id, duration_days, available, reserved, sold)
+    SELECT product_id, duration_days, available, reserved, sold FROM counts
+    ON CONFLICT (product_id, duration_days) DO UPDATE
+    SET available = EXCLUDED.available, reserved = EXCLUDED.reserved, sold = EXCLUDED.sold
+""")
+
+
+def rebuild(db: Session) -> None:
+    """
+    Пересчитывает key_stock по keys (commit — за вызывающим). Таблица
+    блокируется от записи до конца транзакции: транзакции, уже сдвинувшие
+    счётчики, пересчёт дожидается, а остальные применят свои stock_delta
+    поверх пересчитанных значений, так что счётчики не уплывают.
+    """
+    db.execute(text("LOCK TABLE key_stock IN EXCLUSIVE MODE"))
+    db.execute(REBUILD_STOCK_SQL)
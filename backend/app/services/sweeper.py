@@ -0,0 +1,113 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger("morpheus.sweeper")
+
+SWEEP_BATCH_SIZE = 500
+
+# Одна пачка: отменяет зависшие заказы, снимает с них ключи и возвращает
+# в продажу эти ключи и резервы с истёкшим сроком без живого заказа.
+# key_stock сдвигается в том же запросе.
+_SWEEP_ORDERS_SQL = text("""
+    WITH stale AS (
+        SELECT id, key_id FROM orders
+        WHERE status IN ('pending', 'waiting')
+          AND (created_at < :cutoff OR (speculative AND updated_at < :speculative_cutoff))
+        ORDER BY id
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    ), cancelled AS (
+        UPDATE orders o SET status = 'cancelled', key_id = NULL, speculative = false, updated_at = :now
+        FROM stale
+        WHERE o.id = stale.id
+        RETURNING stale.key_id
+    ), orphaned AS (
+        SELECT k.id FROM keys k
+        WHERE k.status = 'reserved' AND k.reserved_until < :now
+          AND NOT EXISTS (
+              SELECT 1 FROM orders o
+              WHERE o.key_id = k.id AND o.status IN ('pending', 'waiting')
+          )
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    ), released AS (
+        UPDATE keys k SET status = 'available', reserved_until = NULL
+        WHERE k.status = 'reserved'
+          AND k.id IN (SELECT key_id FROM cancelled UNION SELECT id FROM orphaned)
+        RETURNING k.product_id, k.duration_days
+    ), restocked AS (
+        INSERT INTO key_stock (product_id, duration_days, available, reserved, sold)
+        SELECT product_id, duration_days, count(*), -count(*), 0
+        FROM released
+        GROUP BY product_id, duration_days
+        ON CONFLICT (product_id, duration_days) DO UPDATE
+        SET available = key_stock.available + EXCLUDED.available,
+            reserved = key_stock.reserved + EXCLUDED.reserved
+    )
+    SELECT (SELECT count(*) FROM cancelled) AS orders, (SELECT count(*) FROM released) AS keys
+""")
+
+
+# Истёкшие ключи помечаются пачками; заблокированные строки (их прямо сейчас
+# меняет админка или вебхук) пропускаются до следующего запуска.
+# Проданные и активированные ключи в key_stock одинаково считаются sold.
+_EXPIRE_KEYS_SQL = text("""
+    UPDATE keys SET status = 'expired'
+    WHERE id IN (
+        SELECT id FROM keys
+        WHERE status IN ('sold', 'activated') AND expires_at < :now
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    )
+""")
+
+
+async def sweep_abandoned_orders() -> int:
+    """
+    Отменяет заказы, не оплаченные за KEY_RESERVATION_MINUTES, и заранее
+    подготовленные заказы, не подтверждённые за SPECULATIVE_ORDER_TTL_SECONDS,
+    и возвращает их ключи в продажу. Возвращает число освобождённых ключей.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(minutes=settings.key_reservation_minutes)
+    speculative_cutoff = now - timedelta(seconds=settings.speculative_order_ttl_seconds)
+    total_orders = total_keys = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            row = (
+                await db.execute(
+                    _SWEEP_ORDERS_SQL,
+                    {"cutoff": cutoff, "speculative_cutoff": speculative_cutoff, "now": now, "batch": SWEEP_BATCH_SIZE},
+                )
+            ).one()
+            await db.commit()
+        total_orders += row.orders
+        total_keys += row.keys
+        if row.orders < SWEEP_BATCH_SIZE and row.keys < SWEEP_BATCH_SIZE:
+            break
+    if total_orders or total_keys:
+        logger.info("Order sweep: cancelled %s orders, reclaimed %s keys", total_orders, total_keys)
+    else:
+        logger.debug("Order sweep: reclaimed 0 keys")
+    return total_keys
+
+
+async def expire_keys() -> int:
+    """Переводит в expired все ключи с истёкшим expires_at. Возвращает их число."""
+    now = datetime.utcnow()
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(_EXPIRE_KEYS_SQL, {"now": now, "batch": SWEEP_BATCH_SIZE})
+            await db.commit()
+        total += result.rowcount
+        if result.rowcount < SWEEP_BATCH_SIZE:
+            break
+    if total:
+        logger.info("Key expiry sweep: expired %s keys", total)
+    return total
@@ -1,12 +1,47 @@
-import random
+import os
+import secrets
 import string
+from typing import List
+
+KEY_ALPHABET = string.ascii_uppercase + string.digits
+KEY_PREFIX = "MPH"
+KEY_GROUPS = 4
+KEY_GROUP_SIZE = 5
+
+# Байт b < 252 отображается в KEY_ALPHABET[b % 36] равновероятно; 252..255 отбрасываются
+_ACCEPTED_BYTES = len(KEY_ALPHABET) * (256 // len(KEY_ALPHABET))
+_REJECTED_BYTES = bytes(range(_ACCEPTED_BYTES, 256))
+_BYTE_TO_CHAR = bytes(
+    ord(KEY_ALPHABET[b % len(KEY_ALPHABET)]) if b < _ACCEPTED_BYTES else 0 for b in range(256)
+)
 
 
 def generate_key_value() -> str:
     parts = []
-    alphabet = string.ascii_uppercase + string.digits
-    for _ in range(4):
-        part = "".join(random.choices(alphabet, k=5))
+    for _ in range(KEY_GROUPS):
+        part = "".join(secrets.choice(KEY_ALPHABET) for _ in range(KEY_GROUP_SIZE))
         parts.append(part)
-    return "MPH-" + "-".join(parts)
+    return KEY_PREFIX + "-" + "-".join(parts)
+
+
+def generate_key_values(count: int) -> List[str]:
+    """
+    Пачка значений того же формата, что generate_key_value.
 
+    Случайные байты берутся из os.urandom одним куском и переводятся
+    в символы через bytes.translate, без цикла по символам в Python.
+    """
+    chars_per_key = KEY_GROUPS * KEY_GROUP_SIZE
+    needed = count * chars_per_key
+    pool = b""
+    while len(pool) < needed:
+        # С запасом на отброшенные байты (~1.6%)
+        chunk = os.urandom((needed - len(pool)) * 65 // 64 + 64)
+        pool += chunk.translate(None, _REJECTED_BYTES)
+    text = pool[:needed].translate(_BYTE_TO_CHAR).decode("ascii")
+    g = KEY_GROUP_SIZE
+    values = []
+    for i in range(0, needed, chars_per_key):
+        body = text[i:i + chars_per_key]
+        values.append(f"{KEY_PREFIX}-{body[:g]}-{body[g:2 * g]}-{body[2 * g:3 * g]}-{body[3 * g:]}")
+    return values
@@ -0,0 +1,167 @@
+"""Baseline: схема, которую до Alembic создавали create_all и ALTER'ы в lifespan
+
+Миграция идемпотентна: на пустой БД создаёт все таблицы, на существующей
+создаёт только недостающие и добавляет колонки, которые прежде
+добавлялись при старте приложения. Всё, что появилось позже, добавляют
+следующие ревизии.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+KEY_STATUSES = ("available", "sold", "activated", "expired")
+ORDER_STATUSES = ("pending", "waiting", "paid", "failed", "cancelled")
+
+keystatus = postgresql.ENUM(*KEY_STATUSES, name="keystatus", create_type=False)
+orderstatus = postgresql.ENUM(*ORDER_STATUSES, name="orderstatus", create_type=False)
+
+
+def _tables() -> set:
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _columns(table: str) -> dict:
+    return {c["name"]: c for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    postgresql.ENUM(*KEY_STATUSES, name="keystatus").create(bind, checkfirst=True)
+    postgresql.ENUM(*ORDER_STATUSES, name="orderstatus").create(bind, checkfirst=True)
+    existing = _tables()
+
+    if "admin_users" not in existing:
+        op.create_table(
+            "admin_users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("username", sa.String(50), nullable=False, unique=True),
+            sa.Column("password_hash", sa.String(200), nullable=False),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("last_login", sa.DateTime),
+        )
+        op.create_index("ix_admin_users_id", "admin_users", ["id"])
+
+    if "bot_settings" not in existing:
+        op.create_table(
+            "bot_settings",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("bot_enabled", sa.Boolean),
+            sa.Column("api_enabled", sa.Boolean, server_default=sa.true()),
+            sa.Column("maintenance_mode", sa.Boolean),
+            sa.Column("alert_message", sa.Text),
+            sa.Column("technical_message", sa.Text),
+            sa.Column("updated_at", sa.DateTime),
+        )
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("telegram_id", sa.BigInteger, nullable=False, unique=True),
+            sa.Column("username", sa.String(150)),
+            sa.Column("email", sa.String),
+            sa.Column("is_admin", sa.Boolean),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("last_seen", sa.DateTime),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+
+    if "products" not in existing:
+        op.create_table(
+            "products",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("slug", sa.String(100), nullable=False),
+            sa.Column("title", sa.String(200), nullable=False),
+            sa.Column("description", sa.Text),
+            sa.Column("is_active", sa.Boolean),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_products_slug", "products", ["slug"], unique=True)
+
+    if "product_prices" not in existing:
+        op.create_table(
+            "product_prices",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id", ondelete="CASCADE")),
+            sa.Column("duration_days", sa.Integer, nullable=False),
+            sa.Column("price_rub", sa.Float, nullable=False),
+            sa.Column("created_at", sa.DateTime),
+            sa.UniqueConstraint("product_id", "duration_days", name="uq_product_duration"),
+        )
+
+    if "builds" not in existing:
+        op.create_table(
+            "builds",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id", ondelete="CASCADE")),
+            sa.Column("label", sa.String(100), nullable=False),
+            sa.Column("file_path", sa.String(300), nullable=False),
+            sa.Column("is_active", sa.Boolean),
+            sa.Column("created_at", sa.DateTime),
+        )
+
+    if "keys" not in existing:
+        op.create_table(
+            "keys",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("value", sa.String(100), nullable=False),
+            sa.Column("duration_days", sa.Integer, nullable=False),
+            sa.Column("status", keystatus),
+            sa.Column("sold_to_user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("activation_uuid", sa.String(120)),
+            sa.Column("sold_at", sa.DateTime),
+            sa.Column("activated_at", sa.DateTime),
+            sa.Column("expires_at", sa.DateTime),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_keys_value", "keys", ["value"], unique=True)
+
+    if "orders" not in existing:
+        op.create_table(
+            "orders",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id"), nullable=False),
+            sa.Column("duration_days", sa.Integer, nullable=False),
+            sa.Column("amount", sa.Float, nullable=False),
+            sa.Column("currency", sa.String(10)),
+            sa.Column("provider", sa.String(30)),
+            sa.Column("provider_pay_id", sa.String(50)),
+            sa.Column("payment_url", sa.String(400)),
+            sa.Column("status", orderstatus),
+            sa.Column("key_id", sa.Integer, sa.ForeignKey("keys.id")),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("updated_at", sa.DateTime),
+        )
+
+    # Базы, созданные до Alembic: то, что раньше делал lifespan
+    if not isinstance(_columns("users")["telegram_id"]["type"], sa.BigInteger):
+        op.alter_column("users", "telegram_id", type_=sa.BigInteger)
+    if "api_enabled" not in _columns("bot_settings"):
+        op.add_column("bot_settings", sa.Column("api_enabled", sa.Boolean, server_default=sa.true()))
+
+
+def downgrade() -> None:
+    for table in (
+        "orders",
+        "keys",
+        "builds",
+        "product_prices",
+        "products",
+        "users",
+        "bot_settings",
+        "admin_users",
+    ):
+        op.drop_table(table)
+    orderstatus.drop(op.get_bind(), checkfirst=True)
+    keystatus.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,42 @@
+"""key_stock: материализованные остатки ключей по продукту и сроку
+
+Счётчики заполняются здесь один раз, дальше их сдвигают транзакции,
+меняющие ключи. Ремонт дрейфа — POST /admin/stock/rebuild или
+python -m app.cli rebuild-stock.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "key_stock",
+        sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("duration_days", sa.Integer, primary_key=True),
+        sa.Column("available", sa.Integer, nullable=False),
+        sa.Column("reserved", sa.Integer, nullable=False),
+        sa.Column("sold", sa.Integer, nullable=False),
+    )
+    # На этой ревизии статуса reserved ещё нет: резервов ноль
+    op.execute("""
+        INSERT INTO key_stock (product_id, duration_days, available, reserved, sold)
+        SELECT product_id, duration_days,
+               count(*) FILTER (WHERE status = 'available'),
+               0,
+               count(*) FILTER (WHERE status IN ('sold', 'activated', 'expired'))
+        FROM keys
+        GROUP BY product_id, duration_days
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("key_stock")
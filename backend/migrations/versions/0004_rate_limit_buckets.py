@@ -0,0 +1,28 @@
+"""rate_limit_buckets: token bucket'ы лимитера, общие для воркеров
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rate_limit_buckets",
+        sa.Column("bucket", sa.String(255), primary_key=True),
+        sa.Column("tokens", sa.Float, nullable=False),
+        sa.Column("capacity", sa.Float, nullable=False),
+        sa.Column("rate", sa.Float, nullable=False),
+        sa.Column("updated_at", sa.DateTime, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rate_limit_buckets")
@@ -0,0 +1,27 @@
+"""Резерв ключей под заказ: статус reserved и keys.reserved_until
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("keys", sa.Column("reserved_until", sa.DateTime))
+    # Новое значение enum нельзя использовать в той же транзакции, где оно добавлено,
+    # а следующие ревизии строят по нему частичные индексы
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE keystatus ADD VALUE IF NOT EXISTS 'reserved' AFTER 'available'")
+
+
+def downgrade() -> None:
+    # Значение из enum Postgres не удаляется: возвращаем резервы в продажу
+    op.execute("UPDATE keys SET status = 'available' WHERE status = 'reserved'")
+    op.drop_column("keys", "reserved_until")
@@ -0,0 +1,48 @@
+"""Индексы для горячих запросов к keys и orders
+
+Индексы строятся CONCURRENTLY, чтобы не блокировать запись в рабочую базу.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # Каталог бота и выборка ключа под заказ: продукт + срок + статус
+    ("ix_keys_product_duration_status", "keys", ["product_id", "duration_days", "status"], None),
+    ("ix_keys_available", "keys", ["product_id", "duration_days"], "status = 'available'"),
+    # Фоновые задачи: истечение ключей и возврат просроченных резервов
+    ("ix_keys_expires_at", "keys", ["expires_at"], "status IN ('sold', 'activated')"),
+    ("ix_keys_reserved_until", "keys", ["reserved_until"], "status = 'reserved'"),
+    ("ix_orders_status", "orders", ["status"], None),
+    ("ix_orders_user_id", "orders", ["user_id"], None),
+    ("ix_orders_product_id", "orders", ["product_id"], None),
+    ("ix_orders_key_id", "orders", ["key_id"], None),
+    ("ix_orders_open_created_at", "orders", ["created_at"], "status IN ('pending', 'waiting')"),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,21 @@
+"""keys.pool_owner: аренда свободных ключей пулом воркера
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("keys", sa.Column("pool_owner", sa.String(32), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("keys", "pool_owner")
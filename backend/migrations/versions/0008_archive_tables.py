@@ -0,0 +1,59 @@
+"""keys_archive и orders_archive: холодный слой для истёкших ключей и завершённых заказов
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+keystatus = postgresql.ENUM(name="keystatus", create_type=False)
+orderstatus = postgresql.ENUM(name="orderstatus", create_type=False)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "keys_archive",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("value", sa.String(100), nullable=False),
+        sa.Column("duration_days", sa.Integer, nullable=False),
+        sa.Column("status", keystatus, nullable=False),
+        sa.Column("sold_to_user_id", sa.Integer),
+        sa.Column("activation_uuid", sa.String(120)),
+        sa.Column("sold_at", sa.DateTime),
+        sa.Column("activated_at", sa.DateTime),
+        sa.Column("expires_at", sa.DateTime),
+        sa.Column("created_at", sa.DateTime),
+        sa.Column("archived_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_keys_archive_value", "keys_archive", ["value"], unique=True)
+    op.create_table(
+        "orders_archive",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("user_id", sa.Integer, nullable=False),
+        sa.Column("product_id", sa.Integer, sa.ForeignKey("products.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("duration_days", sa.Integer, nullable=False),
+        sa.Column("amount", sa.Float, nullable=False),
+        sa.Column("currency", sa.String(10)),
+        sa.Column("provider", sa.String(30)),
+        sa.Column("provider_pay_id", sa.String(50)),
+        sa.Column("payment_url", sa.String(400)),
+        sa.Column("status", orderstatus, nullable=False),
+        sa.Column("key_id", sa.Integer),
+        sa.Column("created_at", sa.DateTime),
+        sa.Column("updated_at", sa.DateTime),
+        sa.Column("archived_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_orders_archive_user_id", "orders_archive", ["user_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("orders_archive")
+    op.drop_table("keys_archive")
@@ -0,0 +1,23 @@
+"""product_prices.target_stock и restock_threshold: уровни автопополнения ключей
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("product_prices", sa.Column("target_stock", sa.Integer, nullable=False, server_default="0"))
+    op.add_column("product_prices", sa.Column("restock_threshold", sa.Integer, nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    op.drop_column("product_prices", "restock_threshold")
+    op.drop_column("product_prices", "target_stock")
@@ -0,0 +1,35 @@
+"""payment_events: журнал уведомлений платёжных систем
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "payment_events",
+        sa.Column("id", sa.BigInteger, primary_key=True),
+        sa.Column("provider", sa.String(30), nullable=False),
+        sa.Column("payment_id", sa.String(64), nullable=False),
+        sa.Column("result", sa.String(20), nullable=False),
+        sa.Column("order_id", sa.Integer),
+        sa.Column("amount", sa.Integer),
+        sa.Column("currency", sa.String(10)),
+        sa.Column("payload", sa.JSON),
+        sa.Column("received_at", sa.DateTime, nullable=False),
+        sa.UniqueConstraint("provider", "payment_id", "result", name="uq_payment_events_provider_payment_result"),
+    )
+    op.create_index("ix_payment_events_order_id", "payment_events", ["order_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_payment_events_order_id", table_name="payment_events")
+    op.drop_table("payment_events")
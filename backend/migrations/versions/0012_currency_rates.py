@@ -0,0 +1,27 @@
+"""currency_rates: курсы валют к рублю
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "currency_rates",
+        sa.Column("currency", sa.String(10), primary_key=True),
+        sa.Column("rub_per_unit", sa.Float, nullable=False),
+        sa.Column("source", sa.String(30), nullable=False),
+        sa.Column("updated_at", sa.DateTime, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("currency_rates")
@@ -0,0 +1,30 @@
+"""orders.speculative и orders.payment_method: заказы, подготовленные заранее
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("orders", sa.Column("payment_method", sa.String(50)))
+    op.add_column("orders", sa.Column("speculative", sa.Boolean, nullable=False, server_default="false"))
+    op.create_index(
+        "ix_orders_speculative_updated_at",
+        "orders",
+        ["updated_at"],
+        postgresql_where=sa.text("speculative"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_orders_speculative_updated_at", table_name="orders")
+    op.drop_column("orders", "speculative")
+    op.drop_column("orders", "payment_method")
@@ -0,0 +1,28 @@
+"""lease_revocations: отзывы офлайн-лиз, общие для воркеров и перезапусков
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0014"
+down_revision = "0013"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "lease_revocations",
+        sa.Column("product_slug", sa.String(100), primary_key=True),
+        sa.Column("key_value", sa.String(100), primary_key=True),
+        sa.Column("revoked_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_lease_revocations_revoked_at", "lease_revocations", ["revoked_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_lease_revocations_revoked_at", table_name="lease_revocations")
+    op.drop_table("lease_revocations")
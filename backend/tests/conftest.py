@@ -0,0 +1,99 @@
+"""
+Тесты работают с настоящим PostgreSQL. База из TEST_POSTGRES_DB (например,
+morpheus_test) пересоздаётся перед каждым тестом. Остальные параметры
+подключения — те же POSTGRES_*, что у приложения. NicePay заменяет локальный
+NicepayStandin.
+
+Без TEST_POSTGRES_DB пропускаются только тесты, которым нужна база (фикстура
+db или метка postgres); чистая логика — бакеты, брейкер, лизы, учёт пула —
+проверяется и без неё.
+"""
+import asyncio
+import os
+
+import pytest
+
+from tests.nicepay_standin import NicepayStandin
+
+# Настройки читаются при импорте app.config: окружение готовим до любого импорта app
+standin = NicepayStandin()
+standin.start()
+os.environ["NICEPAY_API_BASE"] = standin.api_base
+os.environ["NICEPAY_MERCHANT_ID"] = standin.merchant_id
+os.environ["NICEPAY_SECRET_KEY"] = standin.secret
+os.environ["HTTP_HTTP2"] = "false"
+os.environ["RECONCILE_MIN_AGE_SECONDS"] = "0"
+if os.environ.get("TEST_POSTGRES_DB"):
+    os.environ["POSTGRES_DB"] = os.environ["TEST_POSTGRES_DB"]
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: тесту нужна база из TEST_POSTGRES_DB")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Без базы пропускаем только тесты с фикстурой db или меткой postgres"""
+    if os.environ.get("TEST_POSTGRES_DB"):
+        return
+    skip = pytest.mark.skip(reason="TEST_POSTGRES_DB is not set")
+    for item in items:
+        if "db" in item.fixturenames or item.get_closest_marker("postgres"):
+            item.add_marker(skip)
+
+
+def run(coro):
+    """asyncio.run с закрытием пулов: соединения asyncpg и httpx привязаны к своему loop"""
+    from app.database import async_engine
+    from app.services.http_client import http_client
+
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await http_client.close()
+            await async_engine.dispose()
+
+    return asyncio.run(wrapper())
+
+
+def reset_schema() -> None:
+    """Пустая схема public: без таблиц, типов и ревизии Alembic"""
+    from sqlalchemy import text
+
+    from app.database import engine
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE; CREATE SCHEMA public"))
+    engine.dispose()
+
+
+@pytest.fixture
+def nicepay():
+    standin.reset()
+    return standin
+
+
+@pytest.fixture
+def db():
+    """Чистая схема, продукт "p" с ценой на 30 дней, пользователь и 10 свободных ключей"""
+    from app.database import Base, SessionLocal, engine
+    from app.models import Key, KeyStatus, Product, ProductPrice, User
+    from app.services.stock import REBUILD_STOCK_SQL
+
+    reset_schema()
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        product = Product(slug="p", title="P")
+        session.add(product)
+        session.flush()
+        session.add(ProductPrice(product_id=product.id, duration_days=30, price_rub=300))
+        session.add(User(telegram_id=1, username="buyer"))
+        session.add_all(
+            Key(product_id=product.id, value=f"K{i}", duration_days=30, status=KeyStatus.available)
+            for i in range(10)
+        )
+        session.commit()
+        session.execute(REBUILD_STOCK_SQL)
+        session.commit()
+        yield session
+    engine.dispose()
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+class NicepayStandin:
+    """
+    Локальная замена NicePay API для тестов: POST {api_base}/payment/status
+    отвечает статусом из self.statuses. Запоминает запрошенные payment_id и
+    наибольшее число одновременных запросов.
+    """
+
+    def __init__(self, merchant_id: str = "test-merchant", secret: str = "test-secret"):
+        self.merchant_id = merchant_id
+        self.secret = secret
+        self.statuses: Dict[str, str] = {}
+        self.delay = 0.0
+        self.requests: List[str] = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def api_base(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/public/api"
+
+    def start(self) -> None:
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statuses = {}
+            self.delay = 0.0
+            self.requests = []
+            self.max_in_flight = 0
+
+    def _status_reply(self, body: dict) -> dict:
+        if body.get("merchant_id") != self.merchant_id or body.get("secret") != self.secret:
+            return {"status": "error", "data": {"message": "Invalid merchant", "code": 1}}
+        payment_id = body.get("payment_id")
+        status = self.statuses.get(payment_id)
+        if status is None:
+            return {"status": "error", "data": {"message": "Payment not found", "code": 2}}
+        return {"status": "success", "data": {"payment_id": payment_id, "status": status, "amount": 30000, "currency": "RUB"}}
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != "/public/api/payment/status":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with standin._lock:
+                    standin.requests.append(body.get("payment_id"))
+                    standin._in_flight += 1
+                    standin.max_in_flight = max(standin.max_in_flight, standin._in_flight)
+                try:
+                    if standin.delay:
+                        time.sleep(standin.delay)
+                    reply = json.dumps(standin._status_reply(body)).encode()
+                finally:
+                    with standin._lock:
+                        standin._in_flight -= 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,69 @@
+import asyncio
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal
+from app.routers.public import product_auth, product_auth_batch
+from tests.conftest import run
+
+
+def _sell(db, *values: str) -> None:
+    db.execute(text("UPDATE keys SET status = 'sold' WHERE value = ANY(:values)"), {"values": list(values)})
+    db.commit()
+
+
+async def _batch(items: list) -> list:
+    async with AsyncSessionLocal() as session:
+        return (await product_auth_batch("p", {"items": items}, session))["results"]
+
+
+async def _single(key_value: str, uuid: str) -> dict:
+    async with AsyncSessionLocal() as session:
+        return await product_auth("p", {"key": key_value, "uuid": uuid}, session)
+
+
+def test_batch_activates_and_checks_keys(db):
+    _sell(db, "K0", "K1")
+    results = run(_batch([
+        {"key": "K0", "uuid": "a"},
+        {"key": "K0", "uuid": "b"},
+        {"key": "K1", "uuid": "a"},
+        {"key": "K3", "uuid": "a"},
+        {"key": "nope", "uuid": "a"},
+        {"key": ["K0"], "uuid": "a"},
+    ]))
+
+    assert [r["success"] for r in results] == [True, False, True, False, False, False]
+    assert [r.get("error") for r in results[1:]] == [
+        "HWID mismatch", None, "Key not sold", "Key mismatch", "Key and uuid required"
+    ]
+    assert db.execute(
+        text("SELECT value, status, activation_uuid FROM keys WHERE value IN ('K0', 'K1') ORDER BY value")
+    ).all() == [("K0", "activated", "a"), ("K1", "activated", "a")]
+
+
+def test_concurrent_batches_bind_a_key_once(db):
+    _sell(db, "K0")
+
+    async def race():
+        return await asyncio.gather(*(_batch([{"key": "K0", "uuid": f"hwid-{i}"}]) for i in range(8)))
+
+    results = [batch[0] for batch in run(race())]
+    winner = db.execute(text("SELECT activation_uuid FROM keys WHERE value = 'K0'")).scalar()
+    assert [r["uuid"] for r in results if r["success"]] == [winner]
+    assert all(r["error"] == "HWID mismatch" for r in results if not r["success"])
+
+
+def test_batch_and_single_auth_follow_the_same_rule(db):
+    _sell(db, "K0")
+
+    async def race():
+        return await asyncio.gather(
+            _batch([{"key": "K0", "uuid": "batch"}]),
+            _single("K0", "single"),
+        )
+
+    (batch,), single = run(race())
+    assert [batch["success"], single["success"]].count(True) == 1
+    winner = db.execute(text("SELECT activation_uuid FROM keys WHERE value = 'K0'")).scalar()
+    assert (batch if batch["success"] else single)["uuid"] == winner
@@ -0,0 +1,29 @@
+import logging
+
+from app.models import Order, OrderStatus, Product, User
+from app.services import checkout as checkout_module
+from app.services.checkout import SpeculativeCheckout
+from tests.conftest import run
+
+
+def _fail(*args, **kwargs):
+    raise RuntimeError("boom")
+
+
+async def _fail_async(*args, **kwargs):
+    raise RuntimeError("boom")
+
+
+def test_failed_cleanup_does_not_escape_prepare(db, monkeypatch, caplog):
+    user = db.query(User).one()
+    product = db.query(Product).one()
+    monkeypatch.setattr(checkout_module, "attach_payment", _fail_async)
+    monkeypatch.setattr(checkout_module, "discard_order", _fail)
+
+    with caplog.at_level(logging.ERROR, logger=checkout_module.logger.name):
+        run(SpeculativeCheckout()._prepare(None, user.id, product.id, 30, "sbp"))
+
+    assert "Failed to discard speculative order" in caplog.text
+    # Заказ остаётся pending: его отменит sweeper по TTL
+    order = db.query(Order).one()
+    assert order.speculative and order.status == OrderStatus.pending
@@ -0,0 +1,66 @@
+from collections import deque
+
+from sqlalchemy import text
+
+from app.models import KeyStatus
+from app.services import key_pool as key_pool_module
+from app.services.key_pool import KeyPool
+from app.services.notify import WORKER_ID
+from app.services.reservations import claim_key
+from tests.conftest import run
+
+SKU = (1, 30)
+
+
+def _pool(monkeypatch, size: int) -> KeyPool:
+    monkeypatch.setattr(key_pool_module.settings, "key_pool_size", size)
+    # Пополнение вызываем явно: вне event loop pop не должен его планировать
+    monkeypatch.setattr(key_pool_module.settings, "key_pool_low_water", 0)
+    pool = KeyPool()
+    run(pool._refill(SKU))
+    return pool
+
+
+def test_rolled_back_pop_is_returned_by_renew(db, monkeypatch):
+    db.execute(text("UPDATE keys SET status = 'sold' WHERE value <> 'K0'"))
+    db.commit()
+    pool = _pool(monkeypatch, 1)
+    assert list(pool._pools[SKU]) and claim_key(db, *SKU) is None
+    db.rollback()
+
+    # Ключ снят с пула в памяти, но транзакция заказа откатилась
+    assert pool.pop(db, *SKU).value == "K0"
+    db.rollback()
+    assert not pool._pools[SKU]
+    assert db.execute(text("SELECT pool_owner FROM keys WHERE value = 'K0'")).scalar() == WORKER_ID
+
+    run(pool.renew())
+
+    assert list(pool._pools[SKU]) == [db.execute(text("SELECT id FROM keys WHERE value = 'K0'")).scalar()]
+    key = pool.pop(db, *SKU)
+    assert key is not None and key.value == "K0" and key.status == KeyStatus.reserved
+    db.commit()
+
+
+def test_renew_drops_keys_taken_elsewhere(db, monkeypatch):
+    pool = _pool(monkeypatch, 3)
+    taken, *rest = list(pool._pools[SKU])
+    db.execute(text("UPDATE keys SET status = 'sold', pool_owner = NULL WHERE id = :id"), {"id": taken})
+    db.commit()
+
+    run(pool.renew())
+
+    assert list(pool._pools[SKU]) == rest
+
+
+def test_sync_follows_held_rows():
+    pool = KeyPool()
+    pool._pools[SKU] = deque([1, 2, 3])
+    pool._pools[(1, 90)] = deque([7])
+
+    # 2 продан мимо пула, 5 снят pop'ом в откатившейся транзакции, 7 истёк
+    pool._sync([(3, *SKU), (1, *SKU), (5, *SKU), (8, 2, 30)])
+
+    assert list(pool._pools[SKU]) == [1, 3, 5]
+    assert not pool._pools[(1, 90)]
+    assert list(pool._pools[(2, 30)]) == [8]
@@ -0,0 +1,194 @@
+import json
+import time
+
+import jwt
+import pytest
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import LeaseRevocation
+from app.routers.public import refresh_lease
+from app.security import create_lease_token
+from app.services.license_cache import CachedLicense, LicenseCache, license_cache
+from app.services.notify import notify_listener
+from tests.conftest import run
+
+
+@pytest.fixture
+def listening(monkeypatch):
+    """Воркер, запущенный давно и получающий уведомления"""
+    monkeypatch.setattr(notify_listener, "connected", True)
+    monkeypatch.setattr(license_cache, "_started_at", 0.0)
+    license_cache.clear(0.0)
+    return license_cache
+
+
+def _sell(db, key_value: str, uuid: str = None) -> None:
+    """Ключ продан и, если передан uuid, уже активирован на этом HWID"""
+    db.execute(
+        text(
+            "UPDATE keys SET status = :status, activation_uuid = :uuid, "
+            "expires_at = now() + interval '30 days' WHERE value = :value"
+        ),
+        {"value": key_value, "uuid": uuid, "status": "activated" if uuid else "sold"},
+    )
+    db.commit()
+
+
+def _refresh(lease: str, uuid: str = "hwid") -> dict:
+    async def call():
+        async with AsyncSessionLocal() as session:
+            return await refresh_lease("p", {"lease": lease, "uuid": uuid}, session)
+
+    return run(call())
+
+
+def _lease(key_value: str, uuid: str = "hwid", checked_at: int = None, issued_at: float = None) -> str:
+    token, _ = create_lease_token(key_value, uuid, "p", None, checked_at)
+    if issued_at is None:
+        return token
+    # Лиза из прошлого: переподписываем с другим iat
+    claims = jwt.decode(token, options={"verify_signature": False})
+    claims["iat"] = int(issued_at)
+    return jwt.encode(claims, settings.secret_key, algorithm=settings.lease_algorithm)
+
+
+def test_revocation_is_stored_and_reloaded(db, listening):
+    _sell(db, "K0", "hwid")
+    issued_at = time.time() - 10
+    license_cache.publish(db, "p", "K0")
+    db.commit()
+
+    row = db.get(LeaseRevocation, ("p", "K0"))
+    assert row is not None
+
+    # Другой воркер (или этот же после перезапуска) узнаёт об отзыве из таблицы
+    other = LicenseCache(max_size=10, ttl_seconds=60)
+    other._started_at = 0.0
+    run(other.reload())
+    assert other.is_revoked("p", "K0", issued_at)
+    assert not other.is_revoked("p", "K1", issued_at)
+    assert not other.is_revoked("p", "K0", time.time() + 1)
+
+
+def test_notification_revokes_on_other_workers(listening):
+    other = LicenseCache(max_size=10, ttl_seconds=60)
+    other._started_at = 0.0
+    issued_at = time.time() - 10
+    statement = license_cache.revocation_statement("p")
+
+    run(other.on_notify(statement.compile().params["payload"]))
+
+    assert other.is_revoked("p", "K5", issued_at)
+    assert not other.is_revoked("q", "K5", issued_at)
+
+
+def test_deleted_key_lease_is_not_refreshed(db, listening):
+    _sell(db, "K0", "hwid")
+    lease = _lease("K0", issued_at=time.time() - 10)
+    assert _refresh(lease)["success"] is True
+
+    license_cache.publish(db, "p", "K0")
+    db.execute(text("DELETE FROM keys WHERE value = 'K0'"))
+    db.commit()
+    # Отзыв применяется после (пере)подключения к уведомлениям
+    run(license_cache.on_notify(None))
+
+    assert _refresh(lease) == {"success": False, "error": "Key mismatch"}
+
+
+def test_lease_from_before_start_is_rechecked(db, listening, monkeypatch):
+    # Ключ сброшен в продажу, пока воркер не работал: отзыв он не видел
+    _sell(db, "K0")
+    lease = _lease("K0", issued_at=time.time() - 10)
+    monkeypatch.setattr(license_cache, "_started_at", time.time() - 5)
+
+    # Полная проверка заново привязывает ключ к HWID
+    result = _refresh(lease)
+    assert result["success"] is True
+    assert db.execute(text("SELECT status FROM keys WHERE value = 'K0'")).scalar() == "activated"
+
+
+def test_refresh_chain_is_capped(db, listening, monkeypatch):
+    _sell(db, "K0", "other-hwid")
+    now = int(time.time())
+    fresh = _lease("K0", checked_at=now - 60)
+    stale = _lease("K0", checked_at=now - settings.lease_chain_max_minutes * 60 - 1)
+
+    refreshed = _refresh(fresh)
+    assert refreshed["success"] is True
+    # Продлённая лиза сохраняет время полной проверки
+    assert jwt.decode(refreshed["lease"], options={"verify_signature": False})["chk"] == now - 60
+
+    # Ключ перепривязан к другому HWID: старая цепочка упирается в полную проверку
+    assert _refresh(stale) == {"success": False, "error": "HWID mismatch"}
+
+
+def test_refresh_is_rate_limited_and_validates_uuid(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.services import rate_limit
+
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_key_burst", 2)
+    client = TestClient(app)
+
+    assert client.post("/api/p/lease/refresh", json={"lease": "x", "uuid": ["hwid"]}).status_code == 400
+    statuses = [
+        client.post("/api/p/lease/refresh", json={"lease": "x", "uuid": "limited-hwid"}).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+
+
+def test_revocation_scopes_and_outage(listening, monkeypatch):
+    cache = LicenseCache(max_size=10, ttl_seconds=60)
+    cache._started_at = 100.0
+
+    # Лиза старше процесса могла пропустить отзыв
+    assert cache.is_revoked("p", "K0", 99.0)
+    assert not cache.is_revoked("p", "K0", 150.0)
+
+    cache.invalidate("p", "K0", revoked_at=200.0)
+    assert cache.is_revoked("p", "K0", 150.0) and cache.is_revoked("p", "K0", 200.0)
+    assert not cache.is_revoked("p", "K0", 201.0) and not cache.is_revoked("p", "K1", 150.0)
+
+    cache.invalidate_product("q", revoked_at=300.0)
+    assert cache.is_revoked("q", "K9", 250.0) and not cache.is_revoked("p", "K1", 250.0)
+
+    # Пока уведомления не доходят, отозванной считается любая лиза
+    monkeypatch.setattr(notify_listener, "connected", False)
+    assert cache.is_revoked("p", "K1", 1000.0)
+
+
+def test_malformed_notification_is_ignored(listening):
+    cache = LicenseCache(max_size=10, ttl_seconds=60)
+    cache._started_at = 0.0
+
+    run(cache.on_notify('{"product": "p"}'))
+    run(cache.on_notify("not json"))
+    assert not cache.is_revoked("p", "K0", 1.0)
+
+    run(cache.on_notify(json.dumps({"product": "", "key": "", "at": 50.0})))
+    assert cache.is_revoked("p", "K0", 50.0) and not cache.is_revoked("p", "K0", 51.0)
+
+
+def test_cached_entry_expires(listening, monkeypatch):
+    from app.services import license_cache as license_cache_module
+
+    cache = LicenseCache(max_size=1, ttl_seconds=60)
+    entry = CachedLicense(key_id=1, activation_uuid="hwid", expires_at=None)
+    now = [1000.0]
+    monkeypatch.setattr(license_cache_module.time, "monotonic", lambda: now[0])
+
+    cache.put("p", "K0", entry)
+    assert cache.get("p", "K0") == entry
+    now[0] += 61
+    assert cache.get("p", "K0") is None
+
+    # Сверх max_size вытесняется самая старая запись
+    cache.put("p", "K0", entry)
+    cache.put("p", "K1", entry)
+    assert cache.get("p", "K0") is None and cache.get("p", "K1") == entry
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import inspect, text
+
+from app.database import Base, engine
+from tests.conftest import reset_schema
+
+pytestmark = pytest.mark.postgres
+
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), "..", "alembic.ini")
+
+
+def _alembic() -> Config:
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    return config
+
+
+def _diff() -> list:
+    with engine.connect() as conn:
+        return compare_metadata(MigrationContext.configure(conn), Base.metadata)
+
+
+def test_upgrade_empty_database_to_head():
+    reset_schema()
+    command.upgrade(_alembic(), "head")
+
+    assert _diff() == []
+    command.downgrade(_alembic(), "base")
+    assert set(inspect(engine).get_table_names()) == {"alembic_version"}
+
+
+def test_baseline_is_the_pre_alembic_schema():
+    reset_schema()
+    command.upgrade(_alembic(), "0001")
+
+    tables = set(inspect(engine).get_table_names())
+    assert {"keys", "orders", "bot_settings"} <= tables
+    assert not tables & {"key_stock", "rate_limit_buckets"}
+    assert "reserved_until" not in {c["name"] for c in inspect(engine).get_columns("keys")}
+    with engine.connect() as conn:
+        statuses = conn.execute(text("SELECT unnest(enum_range(NULL::keystatus))::text")).scalars().all()
+    assert statuses == ["available", "sold", "activated", "expired"]
+
+    # База, которую вела старая версия приложения, доводится до head теми же ревизиями
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (id, slug, title) VALUES (1, 'p', 'P')"))
+        conn.execute(text(
+            "INSERT INTO keys (product_id, value, duration_days, status) "
+            "VALUES (1, 'A', 30, 'available'), (1, 'B', 30, 'sold')"
+        ))
+    command.upgrade(_alembic(), "head")
+    assert _diff() == []
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT available, reserved, sold FROM key_stock")).one() == (1, 0, 1)
+
+
+def test_rebuild_repairs_key_stock_drift(db):
+    from app.services import stock
+
+    db.execute(text("UPDATE key_stock SET available = 0"))
+    db.commit()
+
+    stock.rebuild(db)
+    db.commit()
+
+    assert db.execute(text("SELECT available, reserved, sold FROM key_stock")).one() == (10, 0, 0)
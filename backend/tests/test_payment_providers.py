@@ -0,0 +1,132 @@
+import asyncio
+from typing import Optional
+
+import pytest
+
+from app.services import payment_providers as providers_module
+from app.services.currency_rates import RateSource
+from app.services.payment_providers import (
+    CircuitBreaker,
+    CreatedPayment,
+    PaymentProvider,
+    PaymentRejected,
+    ProviderRegistry,
+)
+
+
+class FakeProvider(PaymentProvider):
+    def __init__(self, name: str, behaviour: str = "ok"):
+        self.name = name
+        self.behaviour = behaviour
+        self.calls = 0
+
+    def configured(self) -> bool:
+        return True
+
+    async def create_payment(self, order_id, amount_rub, description, customer, method=None) -> CreatedPayment:
+        self.calls += 1
+        if self.behaviour == "fail":
+            raise ConnectionError("down")
+        if self.behaviour == "reject":
+            raise PaymentRejected("NicePay API error")
+        if self.behaviour == "hang":
+            await asyncio.sleep(3600)
+        return CreatedPayment(self.name, f"{self.name}-{order_id}", "https://pay")
+
+    def verify_webhook(self, params: dict) -> bool:
+        return True
+
+    async def fetch_status(self, payment_id: str) -> Optional[dict]:
+        if self.behaviour == "fail":
+            raise ConnectionError("down")
+        return {"result": None, "status": "process", "amount": None, "currency": None}
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(providers_module.settings, "payment_providers", "first,second")
+    monkeypatch.setattr(providers_module.settings, "payment_breaker_failures", 2)
+    monkeypatch.setattr(providers_module.settings, "payment_breaker_reset_seconds", 0.05)
+    return ProviderRegistry()
+
+
+def _create(registry: ProviderRegistry, order_id: str = "1") -> CreatedPayment:
+    return asyncio.run(registry.create_payment(order_id, 300, "d", "c"))
+
+
+def test_incomplete_provider_fails_on_instantiation():
+    class Incomplete(PaymentProvider):
+        def configured(self) -> bool:
+            return True
+
+    class NoFetch(RateSource):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    with pytest.raises(TypeError):
+        NoFetch()
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    # Пока идёт проба, остальные вызовы отклоняются
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failover_and_rejections(registry):
+    first, second = FakeProvider("first", "fail"), FakeProvider("second")
+    registry.register(first)
+    registry.register(second)
+
+    assert [_create(registry, str(i)).provider for i in range(3)] == ["second"] * 3
+    # После двух сбоев подряд первую систему пропускают, не дожидаясь её ошибки
+    assert first.calls == 2
+
+    second.behaviour = "reject"
+    with pytest.raises(ValueError):
+        _create(registry)
+    health = {item["name"]: item for item in registry.health()}
+    assert health["second"]["state"] == "closed"
+
+
+def test_cancelled_probe_does_not_wedge_the_breaker(registry, monkeypatch):
+    monkeypatch.setattr(providers_module.settings, "payment_providers", "first")
+    first = FakeProvider("first", "fail")
+    registry.register(first)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            _create(registry)
+
+    async def cancelled_probe():
+        await asyncio.sleep(0.06)
+        first.behaviour = "hang"
+        task = asyncio.create_task(registry.create_payment("1", 300, "d", "c"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_probe())
+    first.behaviour = "ok"
+    assert _create(registry).provider == "first"
+
+
+def test_status_failures_use_their_own_breaker(registry):
+    first = FakeProvider("first", "fail")
+    registry.register(first)
+
+    for _ in range(3):
+        assert asyncio.run(registry.fetch_status("first", "p")) is None
+    health = registry.health()[0]
+    assert health["status_state"] == "open" and health["state"] == "closed"
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.services import rate_limit
+from app.services.rate_limit import BucketSpec, LocalBucketStore, limit_auth, limit_batch_auth
+
+
+def _request(body: bytes, ip: str) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(b"x-real-ip", ip.encode())],
+        "client": (ip, 1),
+        "query_string": b"",
+    }
+    return Request(scope, receive)
+
+
+def _allowed(dependency, body: bytes, ip: str, *args) -> bool:
+    try:
+        asyncio.run(dependency(_request(body, ip), *args))
+    except HTTPException as e:
+        assert e.status_code == 429
+        return False
+    return True
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(rate_limit, "rate_limiter", rate_limit.RateLimiter("local"))
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_ip_burst", 3)
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_batch_ip_burst", 5)
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_batch_ip_per_minute", 0)
+    monkeypatch.setattr(rate_limit.settings, "rate_limit_ip_per_minute", 0)
+
+
+def test_consume_is_all_or_nothing():
+    store = LocalBucketStore()
+    wide, narrow = BucketSpec("wide", 10, 0), BucketSpec("narrow", 1, 0)
+
+    assert store.consume([wide, narrow])
+    assert not store.consume([wide, narrow])
+    # Отказ узкого бакета не списал токен из широкого
+    assert all(store.consume([wide]) for _ in range(9))
+    assert not store.consume([wide])
+
+
+def test_batch_and_auth_use_separate_ip_buckets(limiter):
+    batch = b'{"items": [' + b",".join([b'{"key": "k", "uuid": "u"}'] * 5) + b"]}"
+
+    # Полный пакет проходит на свежем IP и не расходует бакет /auth
+    assert _allowed(limit_batch_auth, batch, "10.0.0.1")
+    assert [_allowed(limit_auth, b"{}", "10.0.0.1", "p") for _ in range(4)] == [True, True, True, False]
+    # А /auth, выбравший свой бакет, не мешает полному пакету
+    assert [_allowed(limit_auth, b"{}", "10.0.0.2", "p") for _ in range(4)] == [True, True, True, False]
+    assert _allowed(limit_batch_auth, batch, "10.0.0.2")
+    assert not _allowed(limit_batch_auth, b'{"items": [{}]}', "10.0.0.2")
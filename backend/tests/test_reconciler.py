@@ -0,0 +1,165 @@
+from sqlalchemy import text
+
+from app.models import KeyStatus, Order, OrderStatus
+from app.services import orders, payment_events, reconciler
+from app.services.nicepay import nicepay_client  # noqa: F401 (регистрирует NicePay)
+from app.services.reconciler import reconcile_waiting_orders
+from app.services.sweeper import sweep_abandoned_orders
+from app.database import AsyncSessionLocal
+from tests.conftest import run
+
+
+def _waiting_order(db, payment_id: str, with_key: bool = True) -> int:
+    """Заказ в waiting старше RECONCILE_MIN_AGE_SECONDS; с ключом — ключ резервируется, как при покупке"""
+    key_id = None
+    if with_key:
+        key_id = db.execute(
+            text(
+                "UPDATE keys SET status = 'reserved' WHERE id = "
+                "(SELECT min(id) FROM keys WHERE status = 'available') RETURNING id"
+            )
+        ).scalar()
+        db.execute(text("UPDATE key_stock SET available = available - 1, reserved = reserved + 1"))
+    order_id = db.execute(
+        text(
+            "INSERT INTO orders (user_id, product_id, duration_days, amount, currency, provider, "
+            "provider_pay_id, status, key_id, speculative, created_at, updated_at) "
+            "VALUES (1, 1, 30, 300, 'RUB', 'nicepay', :payment_id, 'waiting', :key_id, false, "
+            "now() - interval '1 hour', now() - interval '1 hour') RETURNING id"
+        ),
+        {"payment_id": payment_id, "key_id": key_id},
+    ).scalar()
+    db.commit()
+    return order_id
+
+
+def _order(db, order_id: int) -> Order:
+    db.expire_all()
+    return db.get(Order, order_id)
+
+
+def test_applies_final_statuses(db, nicepay):
+    paid = _waiting_order(db, "PAY-OK")
+    failed = _waiting_order(db, "PAY-EXPIRED")
+    pending = _waiting_order(db, "PAY-PROCESS")
+    nicepay.statuses = {"PAY-OK": "success", "PAY-EXPIRED": "expired", "PAY-PROCESS": "process"}
+
+    assert run(reconcile_waiting_orders()) == {"checked": 3, "paid": 1, "failed": 1}
+
+    assert _order(db, paid).status == OrderStatus.paid
+    assert _order(db, paid).key.status == KeyStatus.sold
+    assert _order(db, failed).status == OrderStatus.failed
+    assert _order(db, failed).key.status == KeyStatus.available
+    assert _order(db, pending).status == OrderStatus.waiting
+    assert db.execute(text("SELECT payload->>'order_id' FROM outbox_messages")).scalars().all() == [str(paid)]
+    assert db.execute(text("SELECT available, reserved, sold FROM key_stock")).one() == (8, 1, 1)
+
+    # Повторная сверка опрашивает только незавершённый заказ и ничего не меняет
+    nicepay.requests.clear()
+    assert run(reconcile_waiting_orders()) == {"checked": 1, "paid": 0, "failed": 0}
+    assert nicepay.requests == ["PAY-PROCESS"]
+
+
+def test_pages_with_bounded_concurrency(db, nicepay, monkeypatch):
+    monkeypatch.setattr(reconciler, "RECONCILE_PAGE_SIZE", 7)
+    monkeypatch.setattr(reconciler.settings, "reconcile_concurrency", 3)
+    payment_ids = [f"PAY-{i}" for i in range(20)]
+    for payment_id in payment_ids:
+        _waiting_order(db, payment_id, with_key=False)
+    nicepay.statuses = {payment_id: "process" for payment_id in payment_ids}
+    nicepay.delay = 0.05
+
+    assert run(reconcile_waiting_orders()) == {"checked": 20, "paid": 0, "failed": 0}
+    assert sorted(nicepay.requests) == sorted(payment_ids)
+    assert 1 < nicepay.max_in_flight <= 3
+
+
+def test_unknown_payment_is_left_waiting(db, nicepay):
+    order_id = _waiting_order(db, "PAY-UNKNOWN")
+
+    assert run(reconcile_waiting_orders()) == {"checked": 1, "paid": 0, "failed": 0}
+    assert _order(db, order_id).status == OrderStatus.waiting
+    assert db.execute(text("SELECT count(*) FROM payment_events")).scalar() == 0
+
+
+def test_payment_after_sweeper_cancel_is_applied(db, nicepay, monkeypatch):
+    order_id = _waiting_order(db, "PAY-LATE")
+    # Воркер сверки прочитал страницу, а sweeper тем временем отменил заказ
+    now = reconciler.datetime.utcnow()
+    page = run(reconciler._waiting_page(0, now, now - reconciler.timedelta(hours=1)))
+    monkeypatch.setattr(reconciler.settings, "key_reservation_minutes", 0)
+    run(sweep_abandoned_orders())
+    assert _order(db, order_id).status == OrderStatus.cancelled
+
+    nicepay.statuses = {"PAY-LATE": "success"}
+    status = run(nicepay_client.fetch_status("PAY-LATE"))
+    assert run(reconciler._apply(*page[0][:3], status)) is True
+
+    order = _order(db, order_id)
+    assert order.status == OrderStatus.paid
+    assert order.key is not None and order.key.status == KeyStatus.sold
+
+    # Webhook с тем же платежом приходит после сверки и отсекается как дубль
+    async def webhook_event():
+        async with AsyncSessionLocal() as session:
+            event_id = (await session.execute(payment_events.record_statement("nicepay", "PAY-LATE", "success"))).scalar()
+            await session.commit()
+            return event_id
+
+    assert run(webhook_event()) is None
+
+
+def test_sweep_then_reconcile_pays_cancelled_order(db, nicepay, monkeypatch):
+    order_id = _waiting_order(db, "PAY-LOST-WEBHOOK")
+    monkeypatch.setattr(reconciler.settings, "key_reservation_minutes", 0)
+    run(sweep_abandoned_orders())
+    assert _order(db, order_id).status == OrderStatus.cancelled
+    cancelled_failed = _waiting_order(db, "PAY-CANCELLED-EXPIRED")
+    run(sweep_abandoned_orders())
+
+    # Покупатель оплатил уже после отмены, webhook потерялся
+    nicepay.statuses = {"PAY-LOST-WEBHOOK": "success", "PAY-CANCELLED-EXPIRED": "expired"}
+    assert run(reconcile_waiting_orders()) == {"checked": 2, "paid": 1, "failed": 0}
+
+    order = _order(db, order_id)
+    assert order.status == OrderStatus.paid
+    assert order.key.status == KeyStatus.sold and order.key.sold_to_user_id == 1
+    # Отказ по отменённому заказу ничего не меняет
+    assert _order(db, cancelled_failed).status == OrderStatus.cancelled
+    assert db.execute(text("SELECT available, reserved, sold FROM key_stock")).one() == (9, 0, 1)
+
+
+def test_cancelled_orders_outside_lookback_are_skipped(db, nicepay, monkeypatch):
+    order_id = _waiting_order(db, "PAY-OLD")
+    db.execute(
+        text("UPDATE orders SET status = 'cancelled', updated_at = now() - interval '2 days' WHERE id = :id"),
+        {"id": order_id},
+    )
+    db.commit()
+
+    assert run(reconcile_waiting_orders()) == {"checked": 0, "paid": 0, "failed": 0}
+
+
+def test_paid_failed_order_does_not_take_key_of_another_buyer(db, nicepay):
+    first = _waiting_order(db, "PAY-FIRST")
+    nicepay.statuses = {"PAY-FIRST": "expired"}
+    run(reconcile_waiting_orders())
+    first_key = _order(db, first).key_id
+    # Ключ проваленного заказа вернулся в продажу и достался другому покупателю
+    second = _waiting_order(db, "PAY-SECOND")
+    assert _order(db, second).key_id == first_key
+
+    order = run(_late_success(first, "PAY-FIRST"))
+    assert order.status == OrderStatus.paid
+    assert order.key_id not in (None, first_key)
+    assert _order(db, second).key.status == KeyStatus.reserved
+    assert db.execute(text("SELECT count(*) FROM outbox_messages")).scalar() == 1
+
+
+async def _late_success(order_id: int, payment_id: str) -> Order:
+    """Оплата, пришедшая webhook'ом после отказа"""
+    async with AsyncSessionLocal() as session:
+        order = await orders.lock_order(session, order_id)
+        await orders.apply_payment_result(session, order, "success", payment_id)
+        await session.commit()
+        return order